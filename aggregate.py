@@ -0,0 +1,72 @@
+import numpy as np
+
+# Server-side aggregation for the scatter tab.
+#
+# Past a few tens of thousands of points circle glyphs stall the browser and
+# the payload grows with every row. Above AGGREGATE_POINTS points in the
+# plotted window the scatter is drawn instead as one count grid per gender
+# over that window (an `image` glyph through a log color mapper), which costs
+# the same whatever the number of rows. The grid is recomputed for the new
+# window when the plot is zoomed or panned, and raw points come back once the
+# window holds few enough of them.
+
+# Most points drawn as circles before switching to count grids
+AGGREGATE_POINTS = 50000
+# Cells along each axis of a count grid
+GRID_SIZE = 200
+# Shades per gender, from faint to the full gender color
+N_SHADES = 64
+
+
+def extent(values):
+    """``(min, max)`` of the finite values of the arrays in ``values``, or None."""
+    lows, highs = [], []
+    for v in values:
+        v = v[np.isfinite(v)]
+        if len(v):
+            lows.append(v.min())
+            highs.append(v.max())
+    if not lows:
+        return None
+    return float(min(lows)), float(max(highs))
+
+
+def pad(span):
+    # a zero-width extent still needs a cell to fall in
+    if span is None or span[1] > span[0]:
+        return span
+    return span[0] - 0.5, span[1] + 0.5
+
+
+def in_window(x, y, window):
+    """Mask of the points inside ``window``, ``((x0, x1), (y0, y1))``."""
+    (x0, x1), (y0, y1) = window
+    return (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+
+
+def grid_counts(x, y, window, size=GRID_SIZE):
+    """Points per cell of ``window`` as a ``(size, size)`` unsigned array, rows along y.
+
+    Points outside the window (or not finite) are not counted.
+    """
+    (x0, x1), (y0, y1) = window
+    keep = in_window(x, y, window)
+    x, y = x[keep], y[keep]
+    # points on the upper edges belong to the last cell
+    i = np.minimum(((x - x0) * (size / (x1 - x0))).astype(np.intp), size - 1)
+    j = np.minimum(((y - y0) * (size / (y1 - y0))).astype(np.intp), size - 1)
+    counts = np.bincount(j * size + i, minlength=size * size).reshape(size, size)
+    # the grids go out as binary arrays: the narrowest type halves or quarters them
+    for dtype in (np.uint8, np.uint16):
+        if counts.max() <= np.iinfo(dtype).max:
+            return counts.astype(dtype)
+    return counts.astype(np.uint32)
+
+
+def shades(color, background='#2E3332', n=N_SHADES):
+    """Palette blending ``color`` over ``background`` from 30% to full strength."""
+    start = np.array([int(background[k:k + 2], 16) for k in (1, 3, 5)], dtype=np.float64)
+    end = np.array([int(color[k:k + 2], 16) for k in (1, 3, 5)], dtype=np.float64)
+    weights = np.linspace(0.3, 1.0, n)[:, None]
+    rgb = np.round(start + (end - start) * weights).astype(int)
+    return ['#%02x%02x%02x' % tuple(c) for c in rgb]
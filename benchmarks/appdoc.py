@@ -0,0 +1,102 @@
+import os
+import shutil
+import timeit
+
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.document import Document
+from bokeh.protocol import Protocol
+
+from synthetic import synthetic_population, write_csv
+
+# Helpers to run the app in-process: build its document against a synthetic
+# dataset and measure what each widget change sends to the browser.
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILES = ('.py', '.yaml', '.js')
+
+
+def prepare_app(workdir, n_rows, app_dir=APP_DIR, seed=0):
+    """Copy the app sources into ``workdir`` next to an ``n_rows`` synthetic CSV."""
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    for name in os.listdir(app_dir):
+        if name.endswith(APP_FILES) and os.path.isfile(os.path.join(app_dir, name)):
+            shutil.copy(os.path.join(app_dir, name), workdir)
+    data_dir = os.path.join(workdir, 'data')
+    csv_path = os.path.join(data_dir, 'spirometry_anthropometric_clean.csv')
+    stamp = os.path.join(data_dir, 'rows')
+    if not (os.path.exists(csv_path) and os.path.exists(stamp) and open(stamp).read() == '%d %d' % (n_rows, seed)):
+        if not os.path.isdir(data_dir):
+            os.makedirs(data_dir)
+        write_csv(synthetic_population(n_rows, seed), csv_path)
+        with open(stamp, 'w') as f:
+            f.write('%d %d' % (n_rows, seed))
+    return workdir
+
+
+def build_document(app_dir):
+    application = Application(DirectoryHandler(filename=app_dir))
+    doc = Document()
+    application.initialize_document(doc)
+    for handler in application.handlers:
+        if handler.failed:
+            raise RuntimeError(handler.error_detail)
+    return doc
+
+
+def tab(doc, title):
+    for root in doc.roots:
+        for i, panel in enumerate(getattr(root, 'tabs', [])):
+            if panel.title == title:
+                # selected, as tabs are only built the first time they are shown
+                root.active = i
+                return panel
+    raise LookupError(title)
+
+
+def widget(panel, title=None, label=None):
+    for model in panel.select({}):
+        if title is not None and getattr(model, 'title', None) == title:
+            return model
+        if label is not None and getattr(model, 'label', None) == label:
+            return model
+    raise LookupError(title or label)
+
+
+class PatchMeter(object):
+    """Collects the PATCH-DOC messages a server would send for document changes."""
+
+    def __init__(self, doc):
+        self.protocol = Protocol('1.0')
+        self.origin = None
+        self.events = []
+        doc.on_change(self._on_change)
+
+    def _on_change(self, event):
+        # the widget value itself came from the browser and is not echoed back
+        if getattr(event, 'model', None) is self.origin and getattr(event, 'attr', None) in ('value', 'active', 'clicks'):
+            return
+        self.events.append(event)
+
+    def change(self, model, attr, value):
+        """Set ``model.attr`` as the browser would.
+
+        Returns (callback seconds, serialization seconds, bytes sent).
+        """
+        self.origin = model
+        self.events = []
+        start = timeit.default_timer()
+        setattr(model, attr, value)
+        callback = timeit.default_timer() - start
+        self.origin = None
+        start = timeit.default_timer()
+        size = self.message_bytes(self.events)
+        return callback, timeit.default_timer() - start, size
+
+    def message_bytes(self, events):
+        if not events:
+            return 0
+        message = self.protocol.create('PATCH-DOC', events)
+        size = len(message.header_json) + len(message.metadata_json) + len(message.content_json)
+        return size + sum(len(payload) for header, payload in message.buffers)
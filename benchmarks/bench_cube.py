@@ -0,0 +1,81 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cube  # noqa: E402
+from histogram import HistogramEngine  # noqa: E402
+from synthetic import synthetic_population  # noqa: E402
+
+# Compare the histogram tab's engine on the range index alone with the same
+# engine answered from the summary cube, on synthetic populations.
+#
+#   python benchmarks/bench_cube.py --sizes 1000000 4000000
+#
+# Every scenario is a sequence of slider states, the time is the mean of
+# moving the engine to each of them and reading the counts and statistics.
+
+DEFAULTS = ((1, 28), (10, 200), (80, 200), (10, 60))
+
+
+def states(changes):
+    result = []
+    for i, range_ in changes:
+        state = list(DEFAULTS)
+        state[i] = range_
+        result.append(tuple(state))
+    return result
+
+
+SCENARIOS = [
+    ('age drag', states([(0, (start, 28)) for start in range(1, 14)])),
+    ('weight drag', states([(1, (10, end)) for end in range(200, 40, -10)])),
+    ('bmi drag', states([(3, (start / 2., 60)) for start in range(20, 50, 2)])),
+    ('resets', [DEFAULTS, ((8, 20), (30, 60), (120, 170), (15, 25))] * 5),
+]
+
+
+def run(engine, steps):
+    for ranges in steps:
+        engine.update(*ranges)
+        for gender in ('Female', 'Male', 'All'):
+            engine.gender_counts(gender)
+            engine.statistics(gender)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the summary cube')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 4000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('%10s  %-12s %10s %10s %8s' % ('rows', 'scenario', 'index ms', 'cube ms', 'speedup'))
+    for size in args.sizes:
+        population = synthetic_population(size)
+        cube.CUBE_ROWS = 0
+        start = timeit.default_timer()
+        summary = cube.summary_cube(population)
+        build = (timeit.default_timer() - start) * 1000
+        cells = sum(len(partition.keys['AGE']) for partition in summary.partitions.values())
+        print('%10d  cube build %.0f ms, %d cells' % (size, build, cells))
+        for name, steps in SCENARIOS:
+            timings = []
+            engines = []
+            for rows in (None, 0):
+                cube.CUBE_ROWS = rows
+                engine = HistogramEngine(population)
+                engine.update(*DEFAULTS)
+                timings.append(min(timeit.repeat(lambda: run(engine, steps), number=1, repeat=args.repeat))
+                               * 1000 / len(steps))
+                engines.append(engine)
+            for gender in ('Female', 'Male', 'All'):
+                assert np.array_equal(engines[0].gender_counts(gender), engines[1].gender_counts(gender)), name
+            print('%10d  %-12s %10.3f %10.3f %7.1fx' % (size, name, timings[0], timings[1], timings[0] / timings[1]))
+
+
+if __name__ == '__main__':
+    main()
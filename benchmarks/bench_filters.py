@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from filters import RangeIndex  # noqa: E402
+from synthetic import synthetic_population  # noqa: E402
+
+# Compare the per-gender boolean masks the tabs used to build with the
+# sorted range index in filters.py, on synthetic populations: once with one
+# partition per gender, and once on the partitions of the store (gender x
+# age band) the app reads its rows in.
+#
+#   python benchmarks/bench_filters.py --sizes 10000 1000000 10000000
+
+QUERIES = [
+    ('defaults', dict(age=(1, 28), weight=(10, 200), height=(80, 200), bmi=(10, 60))),
+    ('narrow age', dict(age=(10, 12), weight=(10, 200), height=(80, 200), bmi=(10, 60))),
+    ('narrow all', dict(age=(8, 20), weight=(30, 60), height=(120, 170), bmi=(15, 25))),
+    ('empty', dict(age=(30, 40), weight=(10, 200), height=(80, 200), bmi=(10, 60))),
+]
+
+
+def mask_rows(population, gender, age, weight, height, bmi):
+    keep = np.ones(len(population['AGE']), dtype=bool) if gender == 'All' else population['GENDER2'] == gender
+    keep &= ((population['AGE'] > age[0]) & (population['AGE'] < age[1])
+             & (population['WEIGHT'] > weight[0]) & (population['WEIGHT'] < weight[1])
+             & (population['HEIGHT'] > height[0]) & (population['HEIGHT'] < height[1])
+             & (population['BMI'] > bmi[0]) & (population['BMI'] < bmi[1]))
+    return np.flatnonzero(keep)
+
+
+def best(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the range-filter index')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print('%10s  %-11s %-7s %10s %10s %10s %8s %10s' % ('rows', 'query', 'gender', 'mask ms', 'gender ms',
+                                                         'store ms', 'speedup', 'selected'))
+    for size in args.sizes:
+        indexes = []
+        for partitioned in (False, True):
+            population = synthetic_population(size, partitioned=partitioned)
+            index = RangeIndex(population)
+            # the partitions are sorted on first use
+            start = timeit.default_timer()
+            index.select('All', **QUERIES[0][1])
+            build = (timeit.default_timer() - start) * 1000
+            print('%10d  index build %.1f ms, %d partitions' % (size, build, sum(len(p) for p in index.partitions.values())))
+            indexes.append(index)
+        for name, ranges in QUERIES:
+            for gender in ('Male', 'All'):
+                timings = [best(lambda: mask_rows(indexes[1].population, gender, **ranges), args.repeat)]
+                for index in indexes:
+                    expected = mask_rows(index.population, gender, **ranges)
+                    got = index.select(gender, **ranges)
+                    assert np.array_equal(expected, got), (name, gender)
+                    timings.append(best(lambda: index.select(gender, **ranges), args.repeat))
+                print('%10d  %-11s %-7s %10.3f %10.3f %10.3f %7.1fx %10d'
+                      % ((size, name, gender) + tuple(timings) + (timings[0] / timings[2], len(got))))
+
+
+if __name__ == '__main__':
+    main()
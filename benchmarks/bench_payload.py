@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bokeh.core.json_encoder import serialize_json  # noqa: E402
+from bokeh.models import ColumnDataSource  # noqa: E402
+from bokeh.util.serialization import transform_column_source_data  # noqa: E402
+
+from appdoc import APP_DIR, build_document, prepare_app, tab  # noqa: E402
+from bench_tabs import SCENARIOS, run  # noqa: E402
+
+# What the data sources of each tab cost on the wire, split into JSON and
+# binary buffers, and which columns still go out as JSON lists.
+#
+#   python benchmarks/bench_payload.py --rows 100000 --baseline /path/to/old/checkout
+#
+# "initial" is the data of the tab's sources once it is built, "update" the
+# mean PATCH-DOC of the bench_tabs scenario of that tab. With --baseline the
+# same report is made for another checkout of the app and the reduction
+# shown next to it.
+
+
+def source_payload(source):
+    """(JSON bytes, binary bytes, names of the columns sent as JSON) of ``source.data``."""
+    buffers = []
+    data = transform_column_source_data(source.data, buffers=buffers)
+    as_json = sorted(name for name, values in data.items()
+                     if not (isinstance(values, dict) and '__buffer__' in values)
+                     and not (isinstance(values, list) and values and
+                              all(isinstance(v, dict) and '__buffer__' in v for v in values)))
+    return len(serialize_json(data)), sum(len(payload) for header, payload in buffers), as_json
+
+
+def report(app_dir):
+    doc = build_document(app_dir)
+    cache = sys.modules.get('cache')
+    if cache is not None:
+        cache.results.max_bytes = 0
+        cache.results.clear()
+    tabs = {}
+    for title, make_steps in SCENARIOS:
+        panel = tab(doc, title)
+        json_bytes = binary_bytes = 0
+        as_json = set()
+        for source in panel.select({'type': ColumnDataSource}):
+            j, b, names = source_payload(source)
+            json_bytes += j
+            binary_bytes += b
+            as_json.update(names)
+        tabs[title] = dict(json=json_bytes, binary=binary_bytes, as_json=sorted(as_json))
+    for (title, name), values in run(doc, 1).items():
+        tabs[title].setdefault('updates', []).extend(size for callback, size in values)
+    for entry in tabs.values():
+        updates = entry.pop('updates')
+        entry['update'] = sum(updates) / float(len(updates))
+    return tabs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the data payload of every tab')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--app', default=APP_DIR)
+    parser.add_argument('--baseline', default=None, help='another checkout of the app to compare with')
+    parser.add_argument('--json', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'spirometry-bench'))
+    args = parser.parse_args()
+
+    app_dir = prepare_app(os.path.join(args.workdir, 'app-%d' % args.rows), args.rows, app_dir=args.app)
+    tabs = report(app_dir)
+    if args.json:
+        print(json.dumps(tabs))
+        return
+    baseline = None
+    if args.baseline is not None:
+        # its own process: both checkouts have modules of the same names
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--json', '--rows', str(args.rows),
+                                          '--app', args.baseline, '--workdir', args.workdir + '-baseline'])
+        baseline = json.loads(output.decode().strip().splitlines()[-1])
+
+    print('%-14s %11s %11s %11s %11s  %s' % ('tab', 'initial kB', 'json kB', 'binary kB', 'update kB', 'JSON columns'))
+    for title, entry in tabs.items():
+        total = entry['json'] + entry['binary']
+        print('%-14s %11.1f %11.1f %11.1f %11.1f  %s' % (title, total / 1024., entry['json'] / 1024.,
+                                                         entry['binary'] / 1024., entry['update'] / 1024.,
+                                                         ', '.join(entry['as_json']) or '-'))
+        if baseline is not None and title in baseline:
+            old = baseline[title]
+            old_total = old['json'] + old['binary']
+            print('%-14s %11.1f %11.1f %11.1f %11.1f  %s' % ('  baseline', old_total / 1024., old['json'] / 1024.,
+                                                             old['binary'] / 1024., old['update'] / 1024.,
+                                                             ', '.join(old['as_json']) or '-'))
+            print('%-14s %10.0f%% %23s %10.0f%%' % ('  reduction', 100. * (1 - total / float(old_total)), '',
+                                                   100. * (1 - entry['update'] / old['update'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bokeh.models.widgets import CheckboxGroup  # noqa: E402
+
+from appdoc import APP_DIR, PatchMeter, build_document, prepare_app, tab, widget  # noqa: E402
+
+# Websocket bytes and server-side time of scatter tab updates.
+#
+#   python benchmarks/bench_scatter_updates.py --rows 10000 100000
+#
+# Pass --app to measure another checkout of the app (e.g. an older revision).
+
+
+def scenario(panel):
+    age = widget(panel, title='Range of Age')
+    weight = widget(panel, title='Range of Weight')
+    genders = list(panel.select({'type': CheckboxGroup}))
+    steps = []
+    for start in range(2, 12):
+        steps.append(('age drag', age, 'value', (start, 28)))
+    for end in range(70, 60, -1):
+        steps.append(('weight drag', weight, 'value', (10, end)))
+    steps.append(('x axis', widget(panel, label='X Axis'), 'value', 'FVC_MAX'))
+    steps.append(('y axis', widget(panel, label='Y Axis'), 'value', 'HEIGHT'))
+    if genders:
+        steps.append(('gender off', genders[0], 'active', [0, 1]))
+        steps.append(('gender on', genders[0], 'active', [0, 1, 2]))
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure scatter tab updates')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--app', default=APP_DIR)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'spirometry-bench'))
+    args = parser.parse_args()
+
+    print('%8s  %-12s %6s %12s %14s %12s' % ('rows', 'update', 'count', 'callback ms', 'serialize ms', 'bytes'))
+    for n in args.rows:
+        app_dir = prepare_app(os.path.join(args.workdir, 'app-%d' % n), n, app_dir=args.app)
+        doc = build_document(app_dir)
+        meter = PatchMeter(doc)
+        totals = {}
+        for name, model, attr, value in scenario(tab(doc, 'Scatter')):
+            callback, serialize, size = meter.change(model, attr, value)
+            total = totals.setdefault(name, [0, 0.0, 0.0, 0])
+            total[0] += 1
+            total[1] += callback
+            total[2] += serialize
+            total[3] += size
+        for name, (count, callback, serialize, size) in totals.items():
+            print('%8d  %-12s %6d %12.1f %14.1f %12d'
+                  % (n, name, count, callback / count * 1000, serialize / count * 1000, size // count))
+
+
+if __name__ == '__main__':
+    main()
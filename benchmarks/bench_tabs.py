@@ -0,0 +1,144 @@
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bokeh.models.widgets import CheckboxGroup, RadioButtonGroup  # noqa: E402
+
+from appdoc import APP_DIR, PatchMeter, build_document, prepare_app, tab, widget  # noqa: E402
+
+# Server-side latency, patch size and memory of scripted widget changes on
+# all three tabs, with the document built headlessly from main.py.
+#
+#   python benchmarks/bench_tabs.py --rows 10000 1000000 --repeat 3
+#
+# Every step is a change the browser could send; its callback runs
+# synchronously here (no session, so no debouncing or thread pool) and the
+# resulting events are serialized into the PATCH-DOC the browser would get.
+# The shared result cache is disabled unless --cache is given, so repeated
+# steps are measured as cold computations.
+
+
+def histogram_steps(panel):
+    age = widget(panel, title='Range of Age')
+    weight = widget(panel, title='Range of Weight')
+    bin_width = widget(panel, title='Bin Width')
+    genders = panel.select_one({'type': CheckboxGroup})
+    steps = []
+    for start in range(2, 12):
+        steps.append(('age drag', age, 'value', (start, 28)))
+    for end in range(70, 60, -1):
+        steps.append(('weight drag', weight, 'value', (10, end)))
+    for width in (20, 40, 80, 160, 320):
+        steps.append(('bin width', bin_width, 'value', width))
+    steps.append(('gender off', genders, 'active', [0, 1]))
+    steps.append(('gender on', genders, 'active', [0, 1, 2]))
+    return steps
+
+
+def scatter_steps(panel):
+    age = widget(panel, title='Range of Age')
+    weight = widget(panel, title='Range of Weight')
+    genders = panel.select_one({'type': CheckboxGroup})
+    steps = []
+    for start in range(2, 12):
+        steps.append(('age drag', age, 'value', (start, 28)))
+    for end in range(70, 60, -1):
+        steps.append(('weight drag', weight, 'value', (10, end)))
+    steps.append(('x axis', widget(panel, label='X Axis'), 'value', 'FVC_MAX'))
+    steps.append(('y axis', widget(panel, label='Y Axis'), 'value', 'HEIGHT'))
+    steps.append(('x axis', widget(panel, label='X Axis'), 'value', 'SESSION_IQR'))
+    steps.append(('y axis', widget(panel, label='Y Axis'), 'value', 'SESSION_STD'))
+    steps.append(('gender off', genders, 'active', [0, 1]))
+    steps.append(('gender on', genders, 'active', [0, 1, 2]))
+    trend = widget(panel, title='Trend')
+    for kind in ('fit', 'lowess', 'bands'):
+        steps.append(('trend', trend, 'value', kind))
+    for start in range(2, 7):
+        steps.append(('trend drag', age, 'value', (start, 20)))
+    steps.append(('trend', trend, 'value', 'none'))
+    return steps
+
+
+def table_steps(panel):
+    age = widget(panel, title='Range of Age')
+    bmi = widget(panel, title='Range of Body Mass Index')
+    next_button = widget(panel, label='Next')
+    steps = []
+    for start in range(2, 12):
+        steps.append(('age drag', age, 'value', (start, 28)))
+    for end in (50, 40, 30, 25, 20):
+        steps.append(('bmi drag', bmi, 'value', (10, end)))
+    for column in ('FVC_MAX', 'AGE', 'SEQN'):
+        steps.append(('sort', widget(panel, title='Sort by'), 'value', column))
+    order = panel.select_one({'type': RadioButtonGroup})
+    steps.append(('order', order, 'active', 1))
+    steps.append(('order', order, 'active', 0))
+    for clicks in range(1, 6):
+        steps.append(('next page', next_button, 'clicks', next_button.clicks + clicks))
+    return steps
+
+
+SCENARIOS = [('Histogram', histogram_steps), ('Scatter', scatter_steps), ('Summary Table', table_steps)]
+
+
+def run(doc, repeat):
+    meter = PatchMeter(doc)
+    samples = {}
+    for title, make_steps in SCENARIOS:
+        panel = tab(doc, title)
+        initial = [(model, attr, getattr(model, attr)) for name, model, attr, value in make_steps(panel)
+                   if attr != 'clicks']
+        for i in range(repeat):
+            # back to the initial widget values, so every repeat moves them again
+            for model, attr, value in initial:
+                setattr(model, attr, value)
+            for name, model, attr, value in make_steps(panel):
+                callback, serialize, size = meter.change(model, attr, value)
+                samples.setdefault((title, name), []).append((callback, size))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure widget changes on every tab')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--cache', action='store_true', help='keep the shared result cache enabled')
+    parser.add_argument('--app', default=APP_DIR)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'spirometry-bench'))
+    args = parser.parse_args()
+
+    print('%9s  %-14s %-12s %5s %8s %8s %8s %8s %10s %10s'
+          % ('rows', 'tab', 'update', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms', 'mean B', 'max B'))
+    for n in args.rows:
+        app_dir = prepare_app(os.path.join(args.workdir, 'app-%d' % n), n, app_dir=args.app)
+        tracemalloc.start()
+        doc = build_document(app_dir)
+        # the app's modules are imported from its directory by main.py
+        cache = sys.modules.get('cache')
+        if cache is not None and not args.cache:
+            cache.results.max_bytes = 0
+            cache.results.clear()
+        samples = run(doc, args.repeat)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        for (title, name), values in samples.items():
+            latency = np.array([v[0] for v in values]) * 1000
+            size = np.array([v[1] for v in values])
+            p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+            print('%9d  %-14s %-12s %5d %8.1f %8.1f %8.1f %8.1f %10d %10d'
+                  % (n, title, name, len(values), p50, p95, p99, latency.max(), size.mean(), size.max()))
+        # ru_maxrss is in kB on Linux and only ever grows within the process
+        print('%9d  peak traced memory %.1f MB, peak RSS %.1f MB'
+              % (n, peak / 2 ** 20, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import urllib.request
+
+import numpy as np
+import psutil
+from tornado import gen, locks
+from tornado.ioloop import IOLoop
+from tornado.websocket import websocket_connect
+
+from bokeh.client.websocket import WebSocketClientConnectionWrapper
+from bokeh.document import Document
+from bokeh.protocol import Protocol
+from bokeh.protocol.receiver import Receiver
+from bokeh.util.session_id import generate_session_id
+
+from appdoc import APP_DIR, prepare_app, tab, widget
+
+# Multi-session load against a local server.
+#
+#   python benchmarks/load_sessions.py --rows 100000 --sessions 1 8 32 64 --num-procs 2
+#
+# serve.py is started on a synthetic dataset, then for each session count
+# that many websocket clients open a session each and keep dragging the age
+# sliders of the three tabs with some think time in between. Latency is the
+# time from sending a change to the first PATCH-DOC the server answers with;
+# bytes are everything received until the client's next change. Each client
+# first opens every tab, so building them is not part of the figures. The
+# largest session count whose p95 latency stays under --target-ms gives the
+# sessions a worker process can carry.
+
+
+class Client(object):
+    """One browser session speaking the Bokeh protocol over a websocket."""
+
+    def __init__(self, url):
+        self.url = url
+        self.protocol = Protocol('1.0')
+        self.receiver = Receiver(self.protocol)
+        self.document = Document()
+        self.socket = None
+        self.events = []
+        self.received = 0
+        self.applying = False
+        self.patched = locks.Event()
+
+    async def connect(self):
+        url = '%s?bokeh-protocol-version=1.0&bokeh-session-id=%s' % (self.url, generate_session_id())
+        self.socket = WebSocketClientConnectionWrapper(await websocket_connect(url))
+        await self._expect('ACK')
+        await self.protocol.create('PULL-DOC-REQ').send(self.socket)
+        reply = await self._expect('PULL-DOC-REPLY')
+        reply.push_to_document(self.document)
+        self.document.on_change(self._collect)
+        IOLoop.current().spawn_callback(self._read)
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+
+    def _collect(self, event):
+        self.events.append(event)
+
+    async def _receive(self):
+        while True:
+            fragment = await self.socket.read_message()
+            if fragment is None:
+                return None
+            self.received += len(fragment)
+            message = await self.receiver.consume(fragment)
+            if message is not None:
+                return message
+
+    async def _expect(self, msgtype):
+        while True:
+            message = await self._receive()
+            if message is None:
+                raise IOError('connection closed waiting for %s' % msgtype)
+            if message.msgtype == msgtype:
+                return message
+
+    async def _read(self):
+        while True:
+            message = await self._receive()
+            if message is None:
+                return
+            if message.msgtype == 'PATCH-DOC':
+                if self.applying:
+                    buffers = dict((json.loads(header)['id'], payload) for header, payload in message.buffers)
+                    self.document.apply_json_patch(inline_buffers(message.content, buffers), self)
+                self.patched.set()
+
+    async def change(self, model, attr, value, timeout):
+        """Send a widget change, returning the seconds until the server patches the document."""
+        self.events = []
+        setattr(model, attr, value)
+        message = self.protocol.create('PATCH-DOC', self.events)
+        self.patched.clear()
+        start = timeit.default_timer()
+        await message.send(self.socket)
+        await self.patched.wait(datetime.timedelta(seconds=timeout))
+        return timeit.default_timer() - start
+
+
+def inline_buffers(value, buffers):
+    # the Python document only reads arrays sent as JSON lists
+    if isinstance(value, dict):
+        if '__buffer__' in value:
+            array = np.frombuffer(buffers[value['__buffer__']], dtype=value['dtype'])
+            return array.reshape(value['shape']).tolist()
+        return dict((key, inline_buffers(v, buffers)) for key, v in value.items())
+    if isinstance(value, list):
+        return [inline_buffers(v, buffers) for v in value]
+    return value
+
+
+TITLES = ('Histogram', 'Scatter', 'Summary Table')
+
+
+async def open_tabs(client, timeout):
+    # the server builds a tab the first time it is selected: its widgets come
+    # in a patch, the only ones the client applies
+    client.applying = True
+    for root in client.document.roots:
+        for i, panel in enumerate(getattr(root, 'tabs', [])):
+            if panel.title in TITLES and root.active != i:
+                await client.change(root, 'active', i, timeout)
+    client.applying = False
+
+
+def scenario(doc):
+    # the three age sliders, dragged back and forth in turn; every step moves the selection
+    sliders = [widget(tab(doc, title), title='Range of Age') for title in TITLES]
+    starts = list(range(4, 14)) + list(range(12, 4, -1))
+    return [(title, slider, 'value', (start, 28))
+            for start in starts
+            for title, slider in zip(('histogram', 'scatter', 'table'), sliders)]
+
+
+async def run_session(url, stop_at, think, timeout, samples):
+    client = Client(url)
+    try:
+        await client.connect()
+        await open_tabs(client, timeout)
+        steps = scenario(client.document)
+        i = random.randrange(len(steps))
+        while time.time() < stop_at:
+            name, model, attr, value = steps[i % len(steps)]
+            i += 1
+            received = client.received
+            try:
+                latency = await client.change(model, attr, value, timeout)
+            except gen.TimeoutError:
+                samples.append((name, None, 0))
+                continue
+            await gen.sleep(think * random.uniform(0.5, 1.5))
+            samples.append((name, latency, client.received - received))
+    finally:
+        client.close()
+
+
+def server_processes(proc):
+    parent = psutil.Process(proc.pid)
+    return [parent] + parent.children(recursive=True)
+
+
+def cpu_seconds(processes):
+    total = 0.0
+    for p in processes:
+        try:
+            times = p.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def start_server(app_dir, port, num_procs):
+    command = [sys.executable, os.path.join(app_dir, 'serve.py'), '--port', str(port),
+               '--num-procs', str(num_procs), '--allow-websocket-origin', 'localhost:%d' % port]
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 600
+    while True:
+        try:
+            urllib.request.urlopen('http://localhost:%d/stats' % port).read()
+            return proc
+        except IOError:
+            if proc.poll() is not None or time.time() > deadline:
+                raise RuntimeError('server did not start')
+            time.sleep(0.5)
+
+
+async def run_level(url, n_sessions, duration, think, timeout):
+    samples = []
+    stop_at = time.time() + duration
+    await gen.multi([run_session(url, stop_at, think, timeout, samples) for i in range(n_sessions)])
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load a local server with concurrent sessions')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 4, 16, 32])
+    parser.add_argument('--duration', type=float, default=20, help='seconds per session count')
+    parser.add_argument('--think', type=float, default=0.2, help='mean seconds between changes of a session')
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--target-ms', type=float, default=250, help='p95 latency a session count must stay under')
+    parser.add_argument('--num-procs', type=int, default=1)
+    parser.add_argument('--port', type=int, default=5100)
+    parser.add_argument('--app', default=APP_DIR)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'spirometry-bench'))
+    args = parser.parse_args()
+
+    app_dir = prepare_app(os.path.join(args.workdir, 'app-%d' % args.rows), args.rows, app_dir=args.app)
+    url = 'ws://localhost:%d/%s/ws' % (args.port, os.path.basename(app_dir))
+    proc = start_server(app_dir, args.port, args.num_procs)
+    me = psutil.Process()
+    best = 0
+    try:
+        print('%8s %9s %8s %8s %8s %8s %9s %10s %11s %10s'
+              % ('sessions', 'updates/s', 'p50 ms', 'p95 ms', 'p99 ms', 'timeouts', 'mean kB', 'server cpu',
+                 'server MB', 'client cpu'))
+        for n in args.sessions:
+            processes = server_processes(proc)
+            server_cpu, client_cpu, start = cpu_seconds(processes), cpu_seconds([me]), time.time()
+            samples = IOLoop.current().run_sync(
+                lambda: run_level(url, n, args.duration, args.think, args.timeout))
+            elapsed = time.time() - start
+            server_cpu = (cpu_seconds(processes) - server_cpu) / elapsed
+            client_cpu = (cpu_seconds([me]) - client_cpu) / elapsed
+            rss = sum(p.memory_info().rss for p in processes) / 2 ** 20
+
+            latency = np.array([s[1] for s in samples if s[1] is not None]) * 1000
+            size = np.array([s[2] for s in samples if s[1] is not None])
+            timeouts = sum(1 for s in samples if s[1] is None)
+            if not len(latency):
+                print('%8d  no update completed' % n)
+                continue
+            p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+            # server cpu is in cores; a client cpu near 1 means the load generator is the bottleneck
+            print('%8d %9.1f %8.1f %8.1f %8.1f %8d %9.1f %10.2f %11.0f %10.2f'
+                  % (n, len(latency) / args.duration, p50, p95, p99, timeouts, size.mean() / 1024,
+                     server_cpu, rss, client_cpu))
+            if p95 <= args.target_ms and not timeouts:
+                best = max(best, n)
+    finally:
+        for p in server_processes(proc)[::-1]:
+            p.kill()
+    workers = args.num_procs if args.num_procs > 0 else psutil.cpu_count()
+    print('%d sessions within p95 <= %g ms on %d worker process(es): %.1f sessions per worker'
+          % (best, args.target_ms, workers, best / float(workers)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset import partition_population  # noqa: E402
+
+# Synthetic population with the columns of spirometry_anthropometric_clean.csv,
+# in the same typed layout and partitioned row order that
+# dataset.load_population produces.
+
+COLUMNS = ['SEQN', 'RAW_CURVE', 'FVC_MAX', 'FEV1', 'FEV3', 'FEV6', 'PEAK_EXPIRATORY',
+           'MAX_MID_EXPIRATORY', 'PSEUDO_PSU', 'AGE', 'GENDER2', 'GENDER', 'HEIGHT',
+           'WEIGHT', 'BMI', 'SESSION_BEST', 'SESSION_MEAN', 'SESSION_STD', 'SESSION_MEDIAN',
+           'SESSION_IQR', 'SESSION_MINIMUM', 'SESSION_MAXIMUM', 'SESSION_MAX_DISTANCE',
+           'SESSION_MEDIAN_DISTANCE']
+
+
+def synthetic_population(n, seed=0, partitioned=True):
+    rng = np.random.RandomState(seed)
+    f32 = np.float32
+    age = rng.randint(3, 26, n).astype(np.int32)
+    gender = rng.randint(0, 2, n).astype(np.int8)
+    height = np.clip(80 + age * 4.5 + rng.normal(0, 8, n), 80, 200).round(1)
+    weight = np.clip((height / 100) ** 2 * rng.normal(20, 4, n), 10, 200).round(1)
+    bmi = (weight / (height / 100) ** 2).round(1)
+    fvc = np.clip(height * 25 - 1500 + rng.normal(0, 400, n), 200, 7000).round(0)
+    mean = fvc * rng.uniform(0.9, 1.0, n)
+    columns = {
+        'SEQN': np.arange(21000, 21000 + n, dtype=np.int32),
+        'RAW_CURVE': rng.randint(1, 5, n).astype(np.int32),
+        'FVC_MAX': fvc.astype(f32),
+        'FEV1': (fvc * 0.85).round(0).astype(f32),
+        'FEV3': (fvc * 0.95).round(0).astype(f32),
+        'FEV6': (fvc * 0.99).round(0).astype(f32),
+        'PEAK_EXPIRATORY': (fvc * rng.uniform(1.5, 2.1, n)).round(0).astype(f32),
+        'MAX_MID_EXPIRATORY': (fvc * rng.uniform(0.7, 1.1, n)).round(0).astype(f32),
+        'PSEUDO_PSU': rng.randint(1, 3, n).astype(np.int32),
+        'AGE': age,
+        'GENDER2': pd.Categorical.from_codes(gender, ['Female', 'Male']),
+        'GENDER': (2 - gender).astype(np.int32),
+        'HEIGHT': height.astype(f32),
+        'WEIGHT': weight.astype(f32),
+        'BMI': bmi.astype(f32),
+        'SESSION_BEST': fvc.astype(f32),
+        'SESSION_MEAN': mean.round(2).astype(f32),
+        'SESSION_STD': rng.gamma(2, 30, n).round(2).astype(f32),
+        'SESSION_MEDIAN': mean.round(1).astype(f32),
+        'SESSION_IQR': rng.gamma(2, 40, n).round(1).astype(f32),
+        'SESSION_MINIMUM': (fvc * 0.9).round(0).astype(f32),
+        'SESSION_MAXIMUM': fvc.astype(f32),
+        'SESSION_MAX_DISTANCE': rng.gamma(2, 50, n).round(0).astype(f32),
+        'SESSION_MEDIAN_DISTANCE': rng.gamma(2, 20, n).round(1).astype(f32),
+    }
+    return partition_population(columns) if partitioned else columns
+
+
+def write_csv(population, path, chunk_size=1000000):
+    n = len(population['SEQN'])
+    for start in range(0, n, chunk_size):
+        rows = slice(start, start + chunk_size)
+        frame = pd.DataFrame({name: population[name][rows] for name in COLUMNS}, columns=COLUMNS)
+        frame.to_csv(path, index=False, header=start == 0, mode='w' if start == 0 else 'a')
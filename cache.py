@@ -0,0 +1,156 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Process-wide cache of computed tab results.
+#
+# Sessions that show the same filter state (every page load starts from the
+# defaults) get the arrays the first one computed instead of recomputing
+# them. Entries are keyed by the tab and its normalized widget state and
+# evicted least recently used first once their arrays exceed the size
+# budget. Cached arrays are shared between sessions and made read-only.
+# Results of the default widget state, which every new session asks for, are
+# pinned: they count towards the budget but are never evicted. Only results
+# of the population the cache is bound to are kept, so a session still
+# showing the data from before the CSV was appended to never fills the cache
+# with them.
+
+CACHE_BYTES = 256 * 1024 * 1024
+
+
+def normalize(value):
+    """Hashable canonical form of a widget state: tuples for lists and dicts, floats for numbers."""
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(v)) for key, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(normalize(v) for v in value)
+    if isinstance(value, (bool, np.bool_)) or value is None:
+        return value
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    return value
+
+
+def _arrays(value):
+    if isinstance(value, np.ndarray):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            for array in _arrays(v):
+                yield array
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            for array in _arrays(v):
+                yield array
+
+
+def result_bytes(value):
+    """Approximate memory held by the arrays of ``value``."""
+    size = sys.getsizeof(value)
+    for array in _arrays(value):
+        size += array.nbytes
+        if array.dtype.kind == 'O':
+            size += sum(sys.getsizeof(v) for v in array.flat)
+    return size
+
+
+class ResultCache(object):
+    """LRU of computed results bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self.population = None
+        self._entries = OrderedDict()
+        self._pinned = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute, pin=False):
+        """The result stored for ``key``, calling ``compute()`` to make it on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if pin:
+                    self._pinned.add(key)
+                return entry[0]
+            self.misses += 1
+            population = self.population
+        # computed outside the lock: other keys keep being served meanwhile
+        value = compute()
+        if self.population is population:
+            self.put(key, value, pin)
+        return value
+
+    def put(self, key, value, pin=False):
+        size = result_bytes(value)
+        if size > self.max_bytes:
+            return
+        for array in _arrays(value):
+            array.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            if pin:
+                self._pinned.add(key)
+            self._evict()
+
+    def _evict(self):
+        for key in list(self._entries):
+            if self.bytes <= self.max_bytes:
+                return
+            if key not in self._pinned:
+                self.bytes -= self._entries.pop(key)[1]
+                self.evictions += 1
+
+    def bind(self, population):
+        """Drop every entry if results now come from a different population."""
+        with self._lock:
+            if population is not self.population:
+                self._entries.clear()
+                self._pinned.clear()
+                self.bytes = 0
+                self.population = population
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                        entries=len(self._entries), pinned=len(self._pinned), bytes=self.bytes, max_bytes=self.max_bytes)
+
+
+# Shared by every session of the process
+results = ResultCache()
+
+
+def cached(name, compute, population=None):
+    """Wrap ``compute(**state)`` so results are shared through ``results`` under ``(name, state)``.
+
+    ``pin=True`` keeps the result from being evicted, for the default state.
+    ``population()`` is the population ``compute`` reads; results of any
+    other than the one ``results`` is bound to are computed but not shared.
+    ``inputs`` go to ``compute`` too without being part of the key, e.g. a
+    selection the caller already made for the same state.
+    """
+    def lookup(state, pin=False, **inputs):
+        arguments = dict(state, **inputs)
+        if population is not None and population() is not results.population:
+            return compute(**arguments)
+        return results.get((name, normalize(state)), lambda: compute(**arguments), pin)
+    return lookup
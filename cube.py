@@ -0,0 +1,379 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dataset import extends, n_rows, store_partitions, stored_arrays
+from filters import FILTER_COLUMNS
+
+# Summary cube of the population over the slider columns.
+#
+# On populations of tens of millions of rows even the range index has too
+# many rows to visit per slider move. The cube aggregates the rows once into
+# cells of the slider grid: AGE and WEIGHT in steps of 1, HEIGHT and BMI in
+# steps of 0.5. Values lying exactly on a step get cells of their own, so a
+# range whose bounds are on the grid is answered exactly whether the bounds
+# are included or not. The cells of each gender are ordered age first and
+# keep, as prefix sums over that order, their row count and the count, sum
+# and sum of squares of the SUMMARY_COLUMNS; FVC_MAX is kept per ml, as a
+# prefix sum over the age steps and as sparse counts per cell.
+#
+# A state that restricts nothing but the age reads two entries of each
+# prefix sum, whatever the number of rows. Other states add up the runs of
+# cells inside the ranges, which costs the number of occupied cells and never
+# touches a row. Bounds off the grid are left to the range index. The cube is
+# built one partition of the store at a time and stored memory-mapped in the
+# population cache like the index. Rows appended to the CSV are made into
+# cells of their own and merged into those of the population they extend.
+
+# Slider step of each filter column, the grid of the cells
+STEPS = dict(AGE=1.0, WEIGHT=1.0, HEIGHT=0.5, BMI=0.5)
+# Columns whose count, mean and standard deviation the cube answers
+SUMMARY_COLUMNS = ('FVC_MAX', 'SESSION_BEST', 'SESSION_MEAN', 'SESSION_STD')
+# Column counted per ml in the cells, the one of the histogram tab
+HISTOGRAM_COLUMN = 'FVC_MAX'
+# Populations from this many rows on get a cube, None for never
+CUBE_ROWS = 10000000
+
+_lock = threading.Lock()
+_cubes = {}
+
+
+def grid_keys(values, step):
+    """Cell of each value along an axis: ``2k`` on the k-th step, ``2k + 1`` just above it."""
+    values = values.astype(np.float64)
+    k = np.floor(values / step)
+    return (2 * k + (values != k * step)).astype(np.int64)
+
+
+def bound_keys(range_, step, inclusive):
+    """First and last cell within ``range_``, or None when a bound is off the grid."""
+    steps = np.array(range_, dtype=np.float64) / step
+    if not np.isfinite(steps).all() or np.abs(steps - np.round(steps)).max() > 1e-9:
+        return None
+    lo, hi = 2 * int(round(steps[0])), 2 * int(round(steps[1]))
+    if inclusive:
+        return lo, hi
+    return lo + 1, hi - 1
+
+
+def _histogram_bins(population):
+    # whole ml bins of the histogram column, the same as HistogramEngine's
+    values = population[HISTOGRAM_COLUMN]
+    finite = values[np.isfinite(values)]
+    origin = int(np.floor(finite.min())) if len(finite) else 0
+    size = (int(np.floor(finite.max())) - origin + 1) if len(finite) else 1
+    return origin, size
+
+
+def _cell_arrays(population, rows, origin, size):
+    # the cells of ``rows`` in grid order, every sum per cell
+    keys = [grid_keys(population[name][rows], STEPS[name]) for name in FILTER_COLUMNS]
+    order = np.lexsort(keys[::-1])
+    rows = rows[order]
+    keys = [k[order] for k in keys]
+    n = len(rows)
+    new_cell = np.ones(n, dtype=bool)
+    new_cell[1:] = False
+    for k in keys:
+        new_cell[1:] |= k[1:] != k[:-1]
+    starts = np.flatnonzero(new_cell)
+    bounds = np.append(starts, n)
+
+    cells = dict(('key.' + name, k[starts].astype(np.int32)) for name, k in zip(FILTER_COLUMNS, keys))
+    for name in SUMMARY_COLUMNS:
+        values = population[name][rows].astype(np.float64)
+        finite = np.isfinite(values)
+        values = np.where(finite, values, 0)
+        for moment, terms in (('n', finite), ('sum', values), ('squares', values * values)):
+            cells[moment + '.' + name] = np.diff(np.concatenate([[0], np.cumsum(terms)])[bounds])
+
+    # FVC per ml: counts per age step...
+    values = population[HISTOGRAM_COLUMN][rows]
+    finite = np.isfinite(values)
+    bins = (np.floor(values[finite]) - origin).astype(np.int64)
+    age = keys[0]
+    new_age = np.concatenate([[True], age[1:] != age[:-1]])[:n]
+    age_starts = np.flatnonzero(new_age)
+    age_index = (np.cumsum(new_age) - 1)[finite]
+    cells['age.keys'] = age[age_starts].astype(np.int32)
+    cells['age.cells'] = np.diff(np.searchsorted(starts, np.append(age_starts, n)))
+    cells['age.hist'] = np.bincount(age_index * size + bins,
+                                    minlength=len(age_starts) * size).reshape(len(age_starts), size)
+    # ...and the distinct values of every cell with their counts
+    cell = np.cumsum(new_cell)[finite] - 1
+    entries, entry_counts = np.unique(cell * size + bins, return_counts=True)
+    cells['entry.bin'] = (entries % size).astype(np.int32)
+    cells['entry.count'] = entry_counts.astype(np.int32)
+    cells['entry.cells'] = np.diff(np.searchsorted(entries // size, np.arange(len(starts) + 1)))
+    return cells
+
+
+def _stored_cells(arrays, prefix):
+    # the _cell_arrays of a stored partition, back from its prefix sums
+    cells = dict(('key.' + name, arrays[prefix + 'key.' + name]) for name in FILTER_COLUMNS)
+    for name in SUMMARY_COLUMNS:
+        for moment in ('n', 'sum', 'squares'):
+            cells[moment + '.' + name] = np.diff(arrays[prefix + moment + '.' + name], axis=0)
+    for name in ('age.cells', 'age.hist', 'entry.cells'):
+        cells[name] = np.diff(arrays[prefix + name], axis=0)
+    for name in ('age.keys', 'entry.bin', 'entry.count'):
+        cells[name] = arrays[prefix + name]
+    return cells
+
+
+def _merged_cells(parts):
+    # the _cell_arrays of several sets of rows as those of all of them: one
+    # run of cells in grid order, cells found in more than one added up
+    if len(parts) == 1:
+        return parts[0]
+
+    def joined(name):
+        return np.concatenate([part[name] for part in parts])
+
+    size = parts[0]['age.hist'].shape[1]
+    keys = [joined('key.' + name) for name in FILTER_COLUMNS]
+    order = np.lexsort(keys[::-1])
+    keys = [k[order] for k in keys]
+    n = len(order)
+    new_cell = np.ones(n, dtype=bool)
+    new_cell[1:] = False
+    for k in keys:
+        new_cell[1:] |= k[1:] != k[:-1]
+    starts = np.flatnonzero(new_cell)
+    # the merged cell of each cell of the parts
+    cell = np.empty(n, dtype=np.intp)
+    cell[order] = np.cumsum(new_cell) - 1
+
+    cells = dict(('key.' + name, k[starts]) for name, k in zip(FILTER_COLUMNS, keys))
+    for name in SUMMARY_COLUMNS:
+        for moment in ('n', 'sum', 'squares'):
+            values = joined(moment + '.' + name)
+            cells[moment + '.' + name] = np.bincount(cell, weights=values, minlength=len(starts)).astype(values.dtype)
+
+    age = cells['key.AGE']
+    new_age = np.concatenate([[True], age[1:] != age[:-1]])[:len(age)]
+    age_starts = np.flatnonzero(new_age)
+    cells['age.keys'] = age[age_starts]
+    cells['age.cells'] = np.diff(np.append(age_starts, len(age)))
+    cells['age.hist'] = np.zeros((len(age_starts), size), dtype=np.int64)
+    for part in parts:
+        cells['age.hist'][np.searchsorted(cells['age.keys'], part['age.keys'])] += part['age.hist']
+
+    entry_cell = cell[np.repeat(np.arange(n), joined('entry.cells'))]
+    entries, inverse = np.unique(entry_cell * size + joined('entry.bin'), return_inverse=True)
+    cells['entry.bin'] = (entries % size).astype(np.int32)
+    cells['entry.count'] = np.bincount(inverse, weights=joined('entry.count')).astype(np.int32)
+    cells['entry.cells'] = np.diff(np.searchsorted(entries // size, np.arange(len(starts) + 1)))
+    return cells
+
+
+def _partition_arrays(prefix, parts):
+    # the arrays of a _CubePartition, as stored in the cache, from the
+    # _cell_arrays of consecutive runs of its cells
+    def joined(name):
+        return np.concatenate([part[name] for part in parts])
+
+    def prefix_sums(values):
+        return np.concatenate([np.zeros((1,) + values.shape[1:], dtype=values.dtype), np.cumsum(values, axis=0)])
+
+    arrays = {}
+    for name in FILTER_COLUMNS:
+        arrays[prefix + 'key.' + name] = joined('key.' + name)
+    arrays[prefix + 'extent'] = np.array([(k.min(), k.max()) if len(k) else (0, -1) for k in
+                                          (arrays[prefix + 'key.' + name] for name in FILTER_COLUMNS)],
+                                         dtype=np.int64)
+    for name in SUMMARY_COLUMNS:
+        for moment in ('n', 'sum', 'squares'):
+            arrays[prefix + moment + '.' + name] = prefix_sums(joined(moment + '.' + name))
+    arrays[prefix + 'age.keys'] = joined('age.keys')
+    arrays[prefix + 'age.cells'] = prefix_sums(joined('age.cells').astype(np.int64))
+    arrays[prefix + 'age.hist'] = prefix_sums(joined('age.hist').astype(np.int64))
+    arrays[prefix + 'entry.bin'] = joined('entry.bin')
+    arrays[prefix + 'entry.count'] = joined('entry.count')
+    arrays[prefix + 'entry.cells'] = prefix_sums(joined('entry.cells').astype(np.int64))
+    return arrays
+
+
+def _concat_ranges(starts, ends):
+    # every index of the ranges [starts[i], ends[i]) in one array
+    lengths = ends - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return offsets + np.arange(total)
+
+
+class _CubePartition(object):
+    # the cells of one gender
+
+    def __init__(self, arrays, prefix):
+        self.keys = dict((name, arrays[prefix + 'key.' + name]) for name in FILTER_COLUMNS)
+        self.extent = dict(zip(FILTER_COLUMNS, arrays[prefix + 'extent'].tolist()))
+        self.moments = dict((moment, dict((name, arrays[prefix + moment + '.' + name]) for name in SUMMARY_COLUMNS))
+                            for moment in ('n', 'sum', 'squares'))
+        self.age_keys = arrays[prefix + 'age.keys']
+        self.age_cells = arrays[prefix + 'age.cells']
+        self.age_hist = arrays[prefix + 'age.hist']
+        self.entry_bin = arrays[prefix + 'entry.bin']
+        self.entry_count = arrays[prefix + 'entry.count']
+        self.entry_cells = arrays[prefix + 'entry.cells']
+
+    def span(self, age):
+        """First and last age step, and first and last cell, of the ``age`` bounds."""
+        i = np.searchsorted(self.age_keys, age[0], side='left')
+        j = max(i, np.searchsorted(self.age_keys, age[1], side='right'))
+        return i, j, self.age_cells[i], self.age_cells[j]
+
+    def runs(self, bounds):
+        """``(starts, ends, span)``: the runs of cells within ``bounds`` and their age span."""
+        span = self.span(bounds['AGE'])
+        start, end = span[2:]
+        mask = None
+        for name in FILTER_COLUMNS[1:]:
+            lo, hi = bounds[name]
+            first, last = self.extent[name]
+            if lo <= first and hi >= last:
+                continue
+            keys = self.keys[name][start:end]
+            within = (keys >= lo) & (keys <= hi)
+            mask = within if mask is None else mask & within
+        if mask is None:
+            return np.array([start]), np.array([end]), span
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.view(np.int8), [0]])))
+        return start + edges[0::2], start + edges[1::2], span
+
+    def histogram(self, starts, ends, span, size):
+        # the age steps' prefix sums, less the cells left out when those are
+        # the fewer
+        i, j, start, end = span
+        counts = self.age_hist[j] - self.age_hist[i]
+        inside = int((self.entry_cells[ends] - self.entry_cells[starts]).sum())
+        outside = int(self.entry_cells[end] - self.entry_cells[start]) - inside
+        if not outside:
+            return counts
+        if inside < outside:
+            counts, sign = 0, 1
+        else:
+            starts, ends, sign = np.concatenate([[start], ends]), np.concatenate([starts, [end]]), -1
+        entries = _concat_ranges(self.entry_cells[starts], self.entry_cells[ends])
+        return counts + sign * np.bincount(self.entry_bin[entries], weights=self.entry_count[entries],
+                                           minlength=size).astype(np.int64)
+
+    def sums(self, starts, ends, columns):
+        return dict((name, tuple(float((self.moments[moment][name][ends] - self.moments[moment][name][starts]).sum())
+                                 for moment in ('n', 'sum', 'squares')))
+                    for name in columns)
+
+
+class SummaryCube(object):
+    """Prefix-summed cells of the population over the slider grid, per gender.
+
+    ``previous`` is the cube of the population this one extends with
+    appended rows, if any.
+    """
+
+    def __init__(self, population, previous=None):
+        self.population = population
+        genders = pd.Categorical(population['GENDER2'])
+        self.origin, self.size = _histogram_bins(population)
+        start = None
+        if previous is not None and (previous.origin, previous.size) == (self.origin, self.size):
+            start = extends(population, previous.population)
+
+        def cells(start, stop, rows=None):
+            # rows outside every range (a missing slider value) are left out
+            if rows is None:
+                rows = np.arange(start, stop)
+            keep = np.ones(len(rows), dtype=bool)
+            for name in FILTER_COLUMNS:
+                keep &= np.isfinite(population[name][rows])
+            return _cell_arrays(population, rows[keep], self.origin, self.size)
+
+        def build():
+            layout = store_partitions(population)
+            arrays = {}
+            for code in range(-1, len(genders.categories)):
+                if start is not None:
+                    # the cells of the population this one extends, plus those of the new rows
+                    rows = start + np.flatnonzero(genders.codes[start:] == code)
+                    partitions = []
+                    if 'p%d.extent' % code in previous.arrays:
+                        partitions.append(_stored_cells(previous.arrays, 'p%d.' % code))
+                    if len(rows):
+                        partitions.append(cells(0, 0, rows))
+                    parts = [_merged_cells(partitions)] if partitions else []
+                elif layout is not None:
+                    # one store partition at a time: the age bands follow
+                    # each other in age order, and so do their cells
+                    gender = genders.categories[code] if code >= 0 else None
+                    partitions = [p for p in layout if p.gender == gender]
+                    parts = [cells(p.start, p.stop) for p in partitions if p.band is not None and not p.batch]
+                    appended = [p for p in partitions if p.batch]
+                    if appended:
+                        # rows appended since the store was written, of every age
+                        rows = np.concatenate([np.arange(p.start, p.stop) for p in appended])
+                        parts = [_merged_cells(parts + [cells(0, 0, rows)])]
+                else:
+                    rows = np.flatnonzero(genders.codes == code)
+                    partitions = rows
+                    parts = [cells(0, 0, rows)]
+                if code == -1 and not len(partitions):
+                    continue
+                arrays.update(_partition_arrays('p%d.' % code, parts or [cells(0, 0)]))
+            return arrays
+
+        self.arrays = arrays = stored_arrays(population, 'summary_cube', build)
+        self.partitions = {}
+        for code, name in enumerate(genders.categories):
+            self.partitions[name] = _CubePartition(arrays, 'p%d.' % code)
+        if 'p-1.extent' in arrays:
+            self.partitions[None] = _CubePartition(arrays, 'p-1.')
+
+    def bounds(self, ranges, inclusive):
+        """{column: (first, last) cell} of an (age, weight, height, bmi) tuple of ranges, None off the grid."""
+        bounds = {}
+        for name, range_ in zip(FILTER_COLUMNS, ranges):
+            bounds[name] = bound_keys(range_, STEPS[name], inclusive)
+            if bounds[name] is None:
+                return None
+        return bounds
+
+    def cells(self, ranges, inclusive=False):
+        """Cells an answer for ``ranges`` looks at, over all partitions, or None off the grid."""
+        bounds = self.bounds(ranges, inclusive)
+        if bounds is None:
+            return None
+        return sum(int(end - start) for i, j, start, end in
+                   (partition.span(bounds['AGE']) for partition in self.partitions.values()))
+
+    def query(self, key, ranges, inclusive=False, columns=SUMMARY_COLUMNS):
+        """``(counts, sums)`` of partition ``key`` within ``ranges``, or None.
+
+        ``counts`` are the rows per ml of HISTOGRAM_COLUMN in the layout of
+        HistogramEngine's (index 0 is ``self.origin`` ml), ``sums`` is
+        {column: (count, sum, sum of squares)}. None when a range is off the
+        grid or a column is not one of SUMMARY_COLUMNS.
+        """
+        bounds = self.bounds(ranges, inclusive)
+        if bounds is None or any(name not in SUMMARY_COLUMNS for name in columns):
+            return None
+        partition = self.partitions[key]
+        starts, ends, span = partition.runs(bounds)
+        return partition.histogram(starts, ends, span, self.size), partition.sums(starts, ends, columns)
+
+
+def summary_cube(population):
+    """Return the process-wide SummaryCube of ``population``, or None below CUBE_ROWS rows."""
+    if CUBE_ROWS is None or n_rows(population) < CUBE_ROWS:
+        return None
+    with _lock:
+        cube = _cubes.get(id(population))
+        if cube is None or cube.population is not population:
+            # a reloaded population replaces the cube of the old one, and
+            # only adds its new rows to it when they were appended
+            previous = [old for old in _cubes.values() if extends(population, old.population) is not None]
+            _cubes.clear()
+            cube = _cubes[id(population)] = SummaryCube(population, previous[0] if previous else None)
+        return cube
@@ -0,0 +1,844 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from os.path import basename, dirname, exists, join, splitext
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# Process-wide columnar store for the population data.
+#
+# main.py is executed once per Bokeh session, but this module is imported
+# normally and therefore lives once per server process. The CSV is read a
+# single time into compact typed columns (float32 / int32, categorical codes
+# for string columns) which every session and every tab share read-only.
+# The columns are persisted as raw arrays next to the CSV so the next server
+# start only has to memory-map them instead of reading the CSV again.
+#
+# The CSV is never held in memory as a whole: it is streamed in blocks of
+# CHUNK_ROWS rows, once to validate the types of every column and count the
+# rows of each partition, and once more to write every block straight into
+# the memory-mapped columns. Rows are stored partitioned by GENDER2 and age
+# band, each partition a contiguous run of rows in CSV order, with the
+# min/max of every numeric column; the filter index uses these to skip whole
+# partitions outside the slider ranges (see store_partitions).
+#
+# A CSV that only grew (the bytes read so far are unchanged and end on a
+# line) is not read again: the appended lines are parsed alone into
+# partitions of their own at the end of the store, so the rows read before
+# keep their numbers, and the arrays derived from those rows (see
+# stored_arrays) carry over to the new population. In the cache the column
+# files are raw arrays that the new rows are written past the end of, so an
+# append writes those rows alone (see _grow). Every batch of lines adds
+# partitions of its own, which everything built on the partitions goes
+# through, so once appended rows make up more than COMPACT_FRACTION of the
+# store, or make more than COMPACT_PARTITIONS partitions (a trickle of a few
+# lines per poll), the store is rewritten in store order.
+
+CACHE_VERSION = 5
+# Rows parsed per block of the CSV, what ingestion holds in memory at once
+CHUNK_ROWS = 250000
+# Years per age band of the store's partitions
+AGE_BAND = 5
+# Bytes before the end of what was read that must be unchanged for the file
+# to count as appended to
+TAIL_BYTES = 4096
+# Share of appended rows from which the store is rewritten in store order
+COMPACT_FRACTION = 0.25
+# Partitions of appended rows from which the store is rewritten in store order
+COMPACT_PARTITIONS = 64
+
+_lock = threading.Lock()
+_populations = {}
+
+
+class Partition(namedtuple('Partition', ['gender', 'band', 'start', 'stop', 'stats', 'batch'])):
+    """Rows ``start:stop`` of a store: one GENDER2 value and one age band (None when missing).
+
+    ``stats`` is {column: (min, max, missing)} of the numeric columns, min
+    and max over the values present (None when there are none). ``batch`` is
+    0 for the rows in store order and ``k`` for those of the k-th batch of
+    lines appended to the CSV since.
+    """
+    __slots__ = ()
+
+
+class _Loaded(namedtuple('_Loaded', ['signature', 'columns', 'cache_dir', 'layout', 'offset', 'tail', 'previous'])):
+    # a population of _populations: ``offset`` bytes of the CSV read so far,
+    # ``tail`` the digest of the lines just before (None if the file may not
+    # be appended to), ``previous`` the (population, first new row) of the
+    # one it extends
+    __slots__ = ()
+
+
+def _identity(loaded):
+    # what tells the population ``loaded`` from any other the CSV was read as:
+    # the bytes read, the digest of their end and the rows they made
+    rows = loaded.layout[-1].stop if loaded.layout else 0
+    return {'offset': loaded.offset, 'tail': loaded.tail, 'rows': rows}
+
+
+def _cache_dir(csv_path):
+    name = splitext(basename(csv_path))[0]
+    return join(dirname(csv_path), '.%s.cache' % name)
+
+
+def _signature(csv_path):
+    st = os.stat(csv_path)
+    return {'version': CACHE_VERSION, 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def _write_directory(directory, write, replace=True):
+    # write(tmp_dir) fills a directory aside and returns its meta, which goes
+    # to meta.json before the directory is renamed into place
+    tmp_dir = '%s.%d.tmp' % (directory, os.getpid())
+    try:
+        if exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        meta = write(tmp_dir)
+        with open(join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        if exists(directory):
+            if not replace:
+                # another process got there first
+                shutil.rmtree(tmp_dir)
+                return True
+            shutil.rmtree(directory)
+        os.rename(tmp_dir, directory)
+        return True
+    except OSError:
+        # A read-only data directory or a concurrent writer only costs us the
+        # cache, the in-memory columns are still valid
+        log.warning("could not write population cache to %s", directory, exc_info=True)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return False
+
+
+def _save_arrays(directory, arrays, meta, replace=True):
+    # i.npy per array plus meta.json
+    def write(tmp_dir):
+        for i, values in enumerate(arrays.values()):
+            np.save(join(tmp_dir, '%d.npy' % i), np.ascontiguousarray(values))
+        return dict(meta, columns=list(arrays))
+    return _write_directory(directory, write, replace)
+
+
+def _load_meta(directory):
+    try:
+        with open(join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _map(path, dtype=None, n=None):
+    # ``path`` memory-mapped read-only: a .npy file, or the first ``n`` rows
+    # of a raw column of ``dtype``. Plain ndarray views, as slices of an
+    # np.memmap stay memmaps.
+    if dtype is None:
+        values = np.load(path, mmap_mode='r')
+    elif not n:
+        return np.empty(0, dtype=dtype)
+    else:
+        values = np.memmap(path, dtype=dtype, mode='r', shape=(n,))
+    return np.asarray(values)
+
+
+def _load_arrays(directory):
+    # (meta, arrays) memory-mapped from a _save_arrays directory, or None
+    meta = _load_meta(directory)
+    if meta is None:
+        return None
+    try:
+        arrays = {}
+        for i, name in enumerate(meta['columns']):
+            arrays[name] = _map(join(directory, '%d.npy' % i))
+    except (OSError, ValueError, KeyError):
+        return None
+    return meta, arrays
+
+
+def _kind(values):
+    # 'f', 'i', 'b' or 'O' (text) of a parsed column, None if it holds no value
+    if not len(values) or pd.isnull(values).all():
+        return None
+    kind = values.dtype.kind
+    if kind == 'u':
+        return 'i'
+    return kind if kind in 'fib' else 'O'
+
+
+def _partition_keys(genders, ages):
+    # ([(gender, band)], index of each row's key), keys in store order
+    genders = pd.Categorical(genders)
+    n_codes = len(genders.categories)
+    codes = np.where(genders.codes < 0, n_codes, genders.codes).astype(np.int64)
+    bands = np.floor(np.asarray(ages, dtype=np.float64) / AGE_BAND)
+    finite = np.isfinite(bands)
+    bands = np.where(finite, bands, 0).astype(np.int64)
+    # one integer per (gender, band), a missing gender or band sorting last
+    low = bands[finite].min() if finite.any() else 0
+    width = (bands[finite].max() - low + 2) if finite.any() else 1
+    keys, inverse = np.unique(codes * width + np.where(finite, bands - low, width - 1), return_inverse=True)
+    names = [(str(genders.categories[code]) if code < n_codes else None,
+              int(band + low) if band < width - 1 else None)
+             for code, band in zip(keys // width, keys % width)]
+    return names, inverse
+
+
+def _group(inverse, n_keys):
+    # row order grouping the rows of every key, in their original order, and
+    # the bounds of each group in it
+    order = np.argsort(inverse, kind='mergesort')
+    return order, np.searchsorted(inverse[order], np.arange(n_keys + 1))
+
+
+def _stats(values, bounds):
+    # (min, max, missing) of ``values`` within each group of rows bounds[i]:bounds[i + 1]
+    values = values.astype(np.float64)
+    present = ~np.isnan(values)
+    starts = bounds[:-1]
+    filled = np.flatnonzero(bounds[1:] > starts)
+    result = [(None, None, 0)] * len(starts)
+    if len(filled):
+        low = np.fmin.reduceat(values, starts[filled])
+        high = np.fmax.reduceat(values, starts[filled])
+        missing = np.add.reduceat(~present, starts[filled])
+        for i, lo, hi, m in zip(filled, low, high, missing):
+            result[i] = (None if np.isnan(lo) else float(lo), None if np.isnan(hi) else float(hi), int(m))
+    return result
+
+
+def _merge_stats(a, b):
+    lows = [v for v in (a[0], b[0]) if v is not None]
+    highs = [v for v in (a[1], b[1]) if v is not None]
+    return (min(lows) if lows else None, max(highs) if highs else None, a[2] + b[2])
+
+
+class _Slice(io.RawIOBase):
+    # bytes start:stop of a file, so a writer appending to it meanwhile is
+    # never half read
+
+    def __init__(self, path, start, stop):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._left = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._left <= 0:
+            return 0
+        n = self._file.readinto(memoryview(buffer)[:self._left])
+        self._left -= n
+        return n
+
+    def close(self):
+        self._file.close()
+        super(_Slice, self).close()
+
+
+def _reader(csv_path, start, stop, names=None):
+    # blocks() parsing bytes start:stop of the CSV a block at a time, with
+    # the header in them unless the column ``names`` are given
+    options = dict(header=None, names=names) if names is not None else {}
+
+    def blocks():
+        with io.BufferedReader(_Slice(csv_path, start, stop)) as f:
+            for block in pd.read_csv(f, chunksize=CHUNK_ROWS, **options):
+                yield block
+    return blocks
+
+
+def _digest(csv_path, offset):
+    # fingerprint of the bytes before ``offset``, None unless a line ends there
+    start = max(offset - TAIL_BYTES, 0)
+    with open(csv_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(offset - start)
+    if len(data) != offset - start or not data.endswith(b'\n'):
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+def _line_end(csv_path, start, stop):
+    # end of the last complete line of bytes start:stop, ``start`` if none
+    with open(csv_path, 'rb') as f:
+        end = stop
+        while end > start:
+            begin = max(end - 65536, start)
+            f.seek(begin)
+            at = f.read(end - begin).rfind(b'\n')
+            if at >= 0:
+                return begin + at + 1
+            end = begin
+    return start
+
+
+class _Scan(object):
+    # first pass over the CSV: the type of every column, the categories of
+    # the text ones and the rows of every partition
+
+    def __init__(self, csv_path, blocks, names=None):
+        self.csv_path = csv_path
+        self.columns = None
+        self.kinds = {}
+        self.limits = {}
+        self.categories = {}
+        self.partitions = {}
+        if names is not None:
+            self.start(names)
+        for block in blocks():
+            self.add(block)
+        if self.columns is None:
+            raise ValueError('%s has no header' % csv_path)
+
+    def start(self, names):
+        self.columns = list(names)
+        for name in ('GENDER2', 'AGE'):
+            if name not in self.columns:
+                raise ValueError('%s has no %s column to partition on' % (self.csv_path, name))
+        for name in self.columns:
+            self.kinds[name] = set()
+            self.categories[name] = set()
+
+    def add(self, block):
+        if self.columns is None:
+            self.start(block.columns)
+        for name in self.columns:
+            values = block[name].values
+            kind = _kind(values)
+            if kind is None:
+                continue
+            self.kinds[name].add(kind)
+            if kind == 'O':
+                self.categories[name].update(values[~pd.isnull(values)])
+            elif kind == 'i':
+                low, high = self.limits.get(name, (values.min(), values.max()))
+                self.limits[name] = (min(low, values.min()), max(high, values.max()))
+        if _kind(block['GENDER2'].values) not in (None, 'O'):
+            raise ValueError('%s: GENDER2 holds numbers' % self.csv_path)
+        if _kind(block['AGE'].values) == 'O':
+            raise ValueError('%s: AGE holds text' % self.csv_path)
+
+        keys, inverse = _partition_keys(block['GENDER2'].values, block['AGE'].values)
+        counts = np.bincount(inverse, minlength=len(keys))
+        for key, rows in zip(keys, counts):
+            self.partitions[key] = self.partitions.get(key, 0) + int(rows)
+
+    def dtypes(self):
+        """[(column, dtype or categories)] of the store, text columns with their sorted categories."""
+        result = []
+        for name in self.columns:
+            kinds = self.kinds[name]
+            if 'O' in kinds or 'b' in kinds:
+                if len(kinds) > 1:
+                    names = sorted(set(dict(O='text', b='booleans').get(kind, 'numbers') for kind in kinds))
+                    raise ValueError('%s: column %s mixes %s' % (self.csv_path, name, ' and '.join(names)))
+                if kinds == {'b'}:
+                    result.append((name, np.dtype(bool)))
+                else:
+                    result.append((name, sorted(self.categories[name])))
+            elif 'f' in kinds or not kinds:
+                result.append((name, np.dtype(np.float32)))
+            else:
+                info = np.iinfo(np.int32)
+                low, high = self.limits[name]
+                result.append((name, np.dtype(np.int32 if info.min <= low and high <= info.max else np.int64)))
+        return result
+
+    def fits(self, dtypes):
+        """Whether the rows scanned can be stored as they are in columns of ``dtypes``."""
+        for name, dtype in dtypes:
+            kinds = self.kinds[name]
+            if not kinds:
+                # nothing but missing values, which only floats and text can hold
+                if not isinstance(dtype, list) and dtype.kind != 'f':
+                    return False
+            elif isinstance(dtype, list):
+                if kinds != {'O'} or not self.categories[name] <= set(dtype):
+                    return False
+            elif dtype.kind == 'b':
+                if kinds != {'b'}:
+                    return False
+            elif dtype.kind == 'f':
+                if not kinds <= {'f', 'i'}:
+                    return False
+            else:
+                info = np.iinfo(dtype)
+                low, high = self.limits[name]
+                if kinds != {'i'} or low < info.min or high > info.max:
+                    return False
+        return True
+
+    def layout(self, start=0, batch=0):
+        """The Partitions, in store order: by gender, then age band, missing ones last.
+
+        Their statistics are left to the second pass.
+        """
+        def order(key):
+            gender, band = key
+            return (gender is None, gender or '', band is None, band or 0)
+        layout = []
+        for key in sorted(self.partitions, key=order):
+            layout.append(Partition(key[0], key[1], start, start + self.partitions[key], {}, batch))
+            start += self.partitions[key]
+        return layout
+
+
+def _fill(csv_path, blocks, dtypes, layout, allocate):
+    # second pass: every block of the CSV cast to the store's types and
+    # written at the end of the partitions its rows belong to, collecting the
+    # statistics of the values as stored. ``allocate`` gets the rows from the
+    # first partition's start on. Returns (arrays, layout).
+    offset = layout[0].start if layout else 0
+    n = layout[-1].stop - offset if layout else 0
+    arrays = dict((name, allocate(i, name, _storage(dtype), n)) for i, (name, dtype) in enumerate(dtypes))
+    cursor = dict(((p.gender, p.band), p.start - offset) for p in layout)
+    stops = dict(((p.gender, p.band), p.stop - offset) for p in layout)
+    partition_stats = {}
+    for block in blocks():
+        keys, inverse = _partition_keys(block['GENDER2'].values, block['AGE'].values)
+        order, bounds = _group(inverse, len(keys))
+        values = {}
+        for name, dtype in dtypes:
+            column = block[name].values[order]
+            if isinstance(dtype, list):
+                values[name] = pd.Categorical(column, categories=dtype).codes
+            else:
+                values[name] = column.astype(dtype)
+        stats = dict((name, _stats(v, bounds)) for name, v in values.items()
+                     if not isinstance(dict(dtypes)[name], list) and v.dtype.kind in 'fi')
+        for i, key in enumerate(keys):
+            lo, hi = bounds[i], bounds[i + 1]
+            at = cursor.get(key, 0)
+            if key not in cursor or at + hi - lo > stops[key]:
+                raise ValueError('%s changed while it was read' % csv_path)
+            for name in values:
+                arrays[name][at:at + hi - lo] = values[name][lo:hi]
+            cursor[key] = at + hi - lo
+            known = partition_stats.setdefault(key, {})
+            for name, column_stats in stats.items():
+                known[name] = _merge_stats(known[name], column_stats[i]) if name in known else column_stats[i]
+    if cursor != stops:
+        raise ValueError('%s changed while it was read' % csv_path)
+    return arrays, [p._replace(stats=partition_stats.get((p.gender, p.band), {})) for p in layout]
+
+
+def _storage(dtype):
+    # the dtype a column is stored as, codes for the text ones
+    if isinstance(dtype, list):
+        return pd.Categorical([], categories=dtype).codes.dtype
+    return dtype
+
+
+def _columns(dtypes, arrays):
+    return dict((name, pd.Categorical.from_codes(arrays[name], dtype) if isinstance(dtype, list) else arrays[name])
+                for name, dtype in dtypes)
+
+
+def _dtypes(columns):
+    # the dtypes of a population's columns, as _Scan.dtypes gives them
+    return [(name, [str(c) for c in values.categories] if isinstance(values, pd.Categorical) else values.dtype)
+            for name, values in columns.items()]
+
+
+def _codes(values):
+    return values.codes if isinstance(values, pd.Categorical) else values
+
+
+def _in_memory(i, name, dtype, n):
+    return np.empty(n, dtype=dtype)
+
+
+def _column_path(directory, i):
+    # the store's columns are raw arrays, their dtype and length in meta.json
+    return join(directory, '%d.col' % i)
+
+
+def _map_column(path, dtype, start, n, mode):
+    # rows start:start + n of the column file at ``path`` to write to; 'w+'
+    # creates it and 'r+' extends it to that length (see _map to read it)
+    if not n:
+        if mode == 'w+':
+            open(path, 'wb').close()
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=start * np.dtype(dtype).itemsize, shape=(n,))
+
+
+def _mapped(directory):
+    # allocate() of _fill for columns memory-mapped in ``directory``
+    def allocate(i, name, dtype, n):
+        return _map_column(_column_path(directory, i), dtype, 0, n, 'w+')
+    return allocate
+
+
+def _copied(loaded, allocate, full):
+    # allocate() of _fill for the rows appended to ``loaded``, as the end of
+    # columns from ``allocate`` that start with a copy of its rows; the
+    # columns go to ``full``
+    n = n_rows(loaded.columns)
+
+    def copied(i, name, dtype, m):
+        full[name] = values = allocate(i, name, dtype, n + m)
+        old = _codes(loaded.columns[name])
+        for at in range(0, n, CHUNK_ROWS):
+            values[at:min(at + CHUNK_ROWS, n)] = old[at:at + CHUNK_ROWS]
+        return values[n:]
+    return copied
+
+
+@contextmanager
+def _store_lock(cache_dir):
+    # held by the process checking and growing the column files of a store
+    with open(cache_dir + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _grow(loaded, dtypes, tmp_dir, total):
+    # allocate() of _fill for the rows appended to ``loaded``, written past
+    # the end of its column files, which are extended to ``total`` rows and
+    # linked into ``tmp_dir``; None when they can't be.
+    #
+    # Nothing but bytes past the end of a file is ever written, so the rows
+    # any process has mapped stay as they are. A file longer than the rows of
+    # ``loaded`` has been grown by another process already, and is left to it.
+    if fcntl is None or loaded.cache_dir is None:
+        return None
+    n = n_rows(loaded.columns)
+    sources = [_column_path(loaded.cache_dir, i) for i in range(len(dtypes))]
+    targets = [_column_path(tmp_dir, i) for i in range(len(dtypes))]
+    sizes = [np.dtype(_storage(dtype)).itemsize for name, dtype in dtypes]
+    linked = []
+    try:
+        with _store_lock(loaded.cache_dir):
+            meta = _load_meta(loaded.cache_dir)
+            if meta is None or meta.get('population') != _identity(loaded):
+                # rewritten since: its files are another population's
+                return None
+            if any(os.path.getsize(path) != n * size for path, size in zip(sources, sizes)):
+                return None
+            for source, target in zip(sources, targets):
+                os.link(source, target)
+                linked.append(target)
+            for source, size in zip(sources, sizes):
+                os.truncate(source, total * size)
+    except OSError:
+        # no hard links or locks here: the columns are copied instead, and
+        # never into a linked file
+        for target in linked:
+            os.remove(target)
+        return None
+
+    def allocate(i, name, dtype, m):
+        return _map_column(targets[i], dtype, n, m, 'r+')
+    return allocate
+
+
+def _store_meta(loaded, dtypes):
+    categories = dict((name, [str(c) for c in dtype]) for name, dtype in dtypes if isinstance(dtype, list))
+    partitions = [dict(p._asdict(), stats=dict((name, list(s)) for name, s in p.stats.items())) for p in loaded.layout]
+    return dict(loaded.signature, columns=[name for name, dtype in dtypes], categories=categories,
+                dtypes=[np.dtype(_storage(dtype)).str for name, dtype in dtypes],
+                partitions=partitions, offset=loaded.offset, tail=loaded.tail, population=_identity(loaded))
+
+
+def _flush(arrays):
+    for values in arrays.values():
+        if isinstance(values, np.memmap):
+            values.flush()
+
+
+def _ingest(csv_path, signature, allocate=_in_memory):
+    # (dtypes, arrays, _Loaded) of the CSV as of ``signature``
+    size = signature['size']
+    blocks = _reader(csv_path, 0, size)
+    scan = _Scan(csv_path, blocks)
+    dtypes = scan.dtypes()
+    arrays, layout = _fill(csv_path, blocks, dtypes, scan.layout(), allocate)
+    loaded = _Loaded(signature, _columns(dtypes, arrays), None, layout, size, _digest(csv_path, size), None)
+    return dtypes, arrays, loaded
+
+
+def _write_store(csv_path, signature):
+    # the CSV ingested straight into the memory-mapped store
+    def write(tmp_dir):
+        dtypes, arrays, loaded = _ingest(csv_path, signature, _mapped(tmp_dir))
+        _flush(arrays)
+        return _store_meta(loaded, dtypes)
+    return _write_directory(_cache_dir(csv_path), write)
+
+
+def _read_cache(csv_path):
+    # the _Loaded of the store in the cache, whatever the CSV now holds
+    directory = _cache_dir(csv_path)
+    meta = _load_meta(directory)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return None
+    try:
+        # the files may hold more rows, appended by another process since
+        n = meta['population']['rows']
+        columns = dict((name, _map(_column_path(directory, i), np.dtype(dtype), n))
+                       for i, (name, dtype) in enumerate(zip(meta['columns'], meta['dtypes'])))
+        for name, categories in meta['categories'].items():
+            columns[name] = pd.Categorical.from_codes(columns[name], categories)
+        layout = [Partition(p['gender'], p['band'], p['start'], p['stop'],
+                            dict((name, tuple(s)) for name, s in p['stats'].items()), p['batch'])
+                  for p in meta['partitions']]
+        signature = dict((key, meta[key]) for key in ('version', 'mtime_ns', 'size'))
+        return _Loaded(signature, columns, directory, layout, meta['offset'], meta['tail'], None)
+    except (OSError, KeyError, ValueError, TypeError):
+        return None
+
+
+def _link_tree(source, target):
+    # a copy of directory ``source`` sharing its files where the file system can
+    os.makedirs(target)
+    for name in os.listdir(source):
+        try:
+            os.link(join(source, name), join(target, name))
+        except OSError:
+            shutil.copy2(join(source, name), join(target, name))
+
+
+def _relabel(directory, identity):
+    # meta.json of the stored_arrays ``directory`` naming the population
+    # ``identity``; a new file, the old one may be linked from another directory
+    meta = _load_meta(directory)
+    path = join(directory, 'meta.json')
+    os.remove(path)
+    with open(path, 'w') as f:
+        json.dump(dict(meta, population=identity), f)
+
+
+def _append(csv_path, loaded, signature):
+    # the _Loaded of ``loaded`` plus the lines appended to the CSV since, or
+    # None when the file changed otherwise, when the new rows don't fit the
+    # columns as they are typed or when the store is due to be rewritten
+    if loaded.tail is None or signature['size'] < loaded.offset or _digest(csv_path, loaded.offset) != loaded.tail:
+        return None
+    end = _line_end(csv_path, loaded.offset, signature['size'])
+    if end == loaded.offset:
+        # nothing but a line still being written
+        return loaded._replace(signature=signature)
+    dtypes = _dtypes(loaded.columns)
+    names = [name for name, dtype in dtypes]
+    blocks = _reader(csv_path, loaded.offset, end, names)
+    try:
+        scan = _Scan(csv_path, blocks, names)
+    except ValueError:
+        return None
+    if not scan.fits(dtypes):
+        return None
+    n = n_rows(loaded.columns)
+    added = scan.layout(n, max([p.batch for p in loaded.layout] + [0]) + 1)
+    if not added:
+        # blank lines
+        return loaded._replace(signature=signature, offset=end, tail=_digest(csv_path, end))
+    appended = [p for p in loaded.layout + added if p.batch]
+    if (len(appended) > COMPACT_PARTITIONS
+            or sum(p.stop - p.start for p in appended) > COMPACT_FRACTION * added[-1].stop):
+        return None
+
+    def extend(allocate, full=None):
+        # the new rows parsed into the arrays allocate() gives for them, the
+        # old and new rows together in ``full`` if there are columns at all
+        arrays, layout = _fill(csv_path, blocks, dtypes, added, allocate)
+        _flush(arrays)
+        columns = _columns(dtypes, full) if full else None
+        return _Loaded(signature, columns, None, loaded.layout + layout, end, _digest(csv_path, end), (loaded.columns, n))
+
+    try:
+        if loaded.cache_dir is not None:
+            def write(tmp_dir):
+                # the new rows written past the end of the column files,
+                # unless another process did so first: then the columns are copied
+                allocate = _grow(loaded, dtypes, tmp_dir, added[-1].stop)
+                if allocate is None:
+                    full = {}
+                    extended = extend(_copied(loaded, _mapped(tmp_dir), full))
+                    _flush(full)
+                else:
+                    extended = extend(allocate)
+                # what was derived from the old rows alone still holds, if it
+                # was derived from them and not from a population another
+                # process has written to the cache since
+                for name in os.listdir(loaded.cache_dir):
+                    meta = _load_meta(join(loaded.cache_dir, name))
+                    if (meta is not None and meta.get('population') == _identity(loaded)
+                            and meta.get('rows') is not None and meta['rows'][1] <= n):
+                        _link_tree(join(loaded.cache_dir, name), join(tmp_dir, name))
+                        _relabel(join(tmp_dir, name), _identity(extended))
+                return _store_meta(extended, dtypes)
+            stored = _read_cache(csv_path) if _write_directory(loaded.cache_dir, write) else None
+            if stored is not None:
+                return stored._replace(previous=(loaded.columns, n))
+        full = {}
+        return extend(_copied(loaded, _in_memory, full), full)
+    except ValueError:
+        # changed again while it was read
+        return None
+
+
+def _freeze(columns):
+    for values in columns.values():
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+    return columns
+
+
+def load_population(csv_path, cache=True):
+    """Return the population columns for ``csv_path`` as a dict of arrays.
+
+    The result is shared by every caller in the process and must be treated as
+    read-only. Numeric columns are float32/int32 ndarrays, string columns
+    (e.g. GENDER2) are ``pd.Categorical``. Rows are in store order (see
+    store_partitions). The CSV is read again only when its mtime or size
+    changes, and then only the lines appended to it if that is all that
+    changed (see extends); a column mixing text and numbers raises ValueError.
+    """
+    csv_path = os.path.abspath(csv_path)
+    signature = _signature(csv_path)
+    with _lock:
+        loaded = _populations.get(csv_path)
+        if loaded is not None and loaded.signature == signature:
+            return loaded.columns
+
+        stored = _read_cache(csv_path) if cache else None
+        if stored is not None and stored.signature == signature:
+            # written by another process, maybe from the rows we hold
+            if loaded is not None and stored.layout[:len(loaded.layout)] == loaded.layout:
+                stored = stored._replace(previous=(loaded.columns, n_rows(loaded.columns)))
+            loaded = stored
+        else:
+            known = loaded if loaded is not None else stored
+            loaded = _append(csv_path, known, signature) if known is not None else None
+        if loaded is None and cache and _write_store(csv_path, signature):
+            # map the columns just written, so every process serving the
+            # CSV shares the same pages instead of holding its own copy
+            loaded = _read_cache(csv_path)
+        if loaded is None:
+            loaded = _ingest(csv_path, signature)[2]
+        _freeze(loaded.columns)
+        _populations[csv_path] = loaded
+        return loaded.columns
+
+
+def extends(population, previous):
+    """First row of ``population`` past the rows of ``previous``, or None.
+
+    Not None when ``population`` is ``previous`` with the lines appended to
+    its CSV since: rows up to the one returned are those of ``previous``,
+    same values at the same positions. Only the population a CSV was last
+    loaded as knows the one before it.
+    """
+    if population is previous:
+        return n_rows(population)
+    with _lock:
+        for loaded in _populations.values():
+            if loaded.columns is population and loaded.previous is not None and loaded.previous[0] is previous:
+                return loaded.previous[1]
+    return None
+
+
+def partition_population(columns):
+    """``columns`` (a dict of arrays held in memory) reordered into store order.
+
+    Gives populations that were not read by load_population, such as
+    synthetic ones, the same partitions as a store.
+    """
+    keys, inverse = _partition_keys(columns['GENDER2'], columns['AGE'])
+    order, bounds = _group(inverse, len(keys))
+    columns = _freeze(dict((name, values[order]) for name, values in columns.items()))
+    stats = dict((name, _stats(values, bounds)) for name, values in columns.items()
+                 if isinstance(values, np.ndarray) and values.dtype.kind in 'fiu')
+    layout = [Partition(gender, band, int(bounds[i]), int(bounds[i + 1]),
+                        dict((name, column_stats[i]) for name, column_stats in stats.items()), 0)
+              for i, (gender, band) in enumerate(keys)]
+    with _lock:
+        # only the latest one is kept, like the indexes built on it
+        for key in [key for key in _populations if isinstance(key, tuple)]:
+            del _populations[key]
+        _populations[('memory', id(columns))] = _Loaded(None, columns, None, layout, None, None, None)
+    return columns
+
+
+def store_partitions(population):
+    """The Partitions of ``population``, in row order, or None if it has none."""
+    with _lock:
+        for loaded in _populations.values():
+            if loaded.columns is population:
+                return loaded.layout
+    return None
+
+
+def stored_arrays(population, name, build, rows=None):
+    """Arrays derived from ``population``, kept memory-mapped in its cache.
+
+    ``build()`` returns a dict of ndarrays. It only runs when the cache holds
+    no copy yet, so worker processes attaching to the same CSV share one copy
+    of the pages instead of building their own. Populations without a cache
+    (``cache=False``, unwritable data directory, synthetic data) just get
+    the built arrays. Arrays derived from the rows ``rows[0]:rows[1]`` alone
+    are kept when lines are appended to the CSV.
+
+    Every copy names the population it was derived from. One derived from
+    another population (a process that has not seen the CSV grow yet writing
+    to the cache another one has rewritten) is built again, and only the
+    population the cache holds writes its arrays to it.
+    """
+    with _lock:
+        found = [loaded for loaded in _populations.values() if loaded.columns is population]
+    if not found or found[0].cache_dir is None:
+        return _freeze(build())
+    identity = _identity(found[0])
+    directory = join(found[0].cache_dir, name)
+    loaded = _load_arrays(directory)
+    if loaded is None or loaded[0].get('population') != identity:
+        stale = loaded is not None
+        arrays = build()
+        store = _load_meta(found[0].cache_dir)
+        if store is None or store.get('population') != identity:
+            # the CSV was read anew since, the cache is no longer ours
+            return _freeze(arrays)
+        meta = {'population': identity}
+        if rows is not None:
+            meta['rows'] = [int(rows[0]), int(rows[1])]
+        if not _save_arrays(directory, arrays, meta, replace=stale):
+            return _freeze(arrays)
+        loaded = _load_arrays(directory)
+        if loaded is None or loaded[0].get('population') != identity:
+            return _freeze(arrays)
+    return _freeze(loaded[1])
+
+
+def n_rows(population):
+    return len(next(iter(population.values())))
+
+
+def to_frame(population, rows=None, columns=None):
+    """Build a DataFrame from the selected ``rows`` (mask or indices) of the store."""
+    if columns is None:
+        columns = list(population)
+    if rows is None:
+        return pd.DataFrame({name: population[name] for name in columns}, columns=columns)
+    return pd.DataFrame({name: population[name][rows] for name in columns}, columns=columns)
@@ -0,0 +1,23 @@
+// Ask the server for the current table selection; the file is streamed by
+// the /export handler instead of being assembled here.
+// The gender comes from a dropdown, or the checkboxes of the linked filters
+var genders = gender.active !== undefined ? gender.active.map(function (i) { return gender.labels[i]; })
+                                          : [gender.value || 'All'];
+var params = [
+    'gender=' + genders.map(encodeURIComponent).join(','),
+    'age=' + age.value.join(','),
+    'weight=' + weight.value.join(','),
+    'height=' + height.value.join(','),
+    'bmi=' + bmi.value.join(','),
+    'sort=' + encodeURIComponent(sort.value),
+    'order=' + (order.active == 1 ? 'desc' : 'asc'),
+    'format=' + encodeURIComponent(format.value)
+];
+
+var link = document.createElement('a');
+link.href = url + '?' + params.join('&');
+link.target = '_blank';
+link.style.visibility = 'hidden';
+document.body.appendChild(link);
+link.dispatchEvent(new MouseEvent('click'));
+document.body.removeChild(link);
@@ -0,0 +1,194 @@
+import io
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tornado.ioloop import IOLoop
+from tornado.web import HTTPError, RequestHandler
+
+from dataset import load_population
+from query import Filter, select
+from table import TablePager
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Streaming export of the Summary Table selection.
+#
+# The browser asks for /export with the table's filter and sort state in the
+# query string, so any server process can answer it. The selection is
+# recomputed from the shared columns and written out in chunks: encoding runs
+# on a small thread pool and every chunk is flushed before the next one is
+# built, so neither the sessions on the IOLoop nor the browser have to hold
+# the whole file.
+
+CHUNK_ROWS = 50000
+RANGES = ('age', 'weight', 'height', 'bmi')
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'export.csv'),
+    'csv.gz': ('application/gzip', 'export.csv.gz'),
+    'parquet': ('application/octet-stream', 'export.parquet'),
+}
+
+# Set by serve.py when the handler is mounted; None under plain `bokeh serve`
+export_url = None
+
+_executor = ThreadPoolExecutor(max_workers=2)
+
+
+def formats():
+    """Export formats this process can write."""
+    return [fmt for fmt in FORMATS if fmt != 'parquet' or pyarrow is not None]
+
+
+def csv_text(values):
+    # strings for one column chunk, quoting only what needs it
+    if isinstance(values, pd.Categorical):
+        labels = [_quote(str(c)) for c in values.categories] + ['']
+        return np.array(labels, dtype=object)[values.codes].tolist()
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        text = values.astype(str)
+        text[np.isnan(values)] = ''
+        return text.tolist()
+    if values.dtype.kind == 'O':
+        return [_quote(str(v)) for v in values]
+    return values.astype(str).tolist()
+
+
+def _quote(text):
+    if any(c in text for c in ',"\n\r'):
+        return '"%s"' % text.replace('"', '""')
+    return text
+
+
+def csv_chunk(population, rows, header=False):
+    columns = [csv_text(population[name][rows]) for name in population]
+    lines = ['\n'.join(map(','.join, zip(*columns)))] if len(rows) else []
+    if header:
+        lines.insert(0, ','.join(_quote(name) for name in population))
+    return ('\n'.join(lines) + '\n').encode('utf-8') if lines else b''
+
+
+def parquet_chunk(population, rows):
+    return pyarrow.table(dict((name, np.asarray(population[name][rows])) for name in population))
+
+
+def export_rows(population, arguments):
+    """Row indices for the table state described by the request ``arguments``."""
+    ranges = {}
+    for name in RANGES:
+        value = arguments.get(name)
+        if value is None:
+            ranges[name] = (-np.inf, np.inf)
+            continue
+        try:
+            start, end = (float(v) for v in value.split(','))
+        except ValueError:
+            raise HTTPError(400, 'bad range for %s' % name)
+        ranges[name] = (start, end)
+
+    # comma separated, e.g. the genders checked in linked-filter mode
+    genders = [gender for gender in arguments.get('gender', 'All').split(',') if gender]
+    sort_column = arguments.get('sort')
+    if sort_column is not None and sort_column not in population:
+        raise HTTPError(400, 'unknown column %s' % sort_column)
+
+    pager = TablePager(population, [])
+    # the rows the Summary Table shows for the same state
+    pager.select(select(population, Filter(genders, **ranges), complete=True))
+    if sort_column is not None:
+        pager.sort(sort_column, ascending=arguments.get('order', 'asc') != 'desc')
+    return pager.rows
+
+
+class ExportHandler(RequestHandler):
+    """GET /export?gender=&age=a,b&weight=a,b&height=a,b&bmi=a,b&sort=&order=&format="""
+
+    def initialize(self, csv_path, chunk_rows=CHUNK_ROWS):
+        self.csv_path = csv_path
+        self.chunk_rows = chunk_rows
+
+    def run(self, func, *args):
+        return IOLoop.current().run_in_executor(_executor, func, *args)
+
+    async def get(self):
+        fmt = self.get_argument('format', 'csv')
+        if fmt not in FORMATS:
+            raise HTTPError(400, 'unknown format %s' % fmt)
+        if fmt == 'parquet' and pyarrow is None:
+            raise HTTPError(501, 'parquet export needs pyarrow')
+
+        arguments = dict((name, self.get_argument(name)) for name in self.request.arguments)
+        population = load_population(self.csv_path)
+        rows = await self.run(export_rows, population, arguments)
+
+        content_type, filename = FORMATS[fmt]
+        self.set_header('Content-Type', content_type)
+        self.set_header('Content-Disposition', 'attachment; filename="%s"' % filename)
+        self.set_header('Cache-Control', 'no-store')
+        if fmt == 'parquet':
+            await self.write_parquet(population, rows)
+        else:
+            await self.write_csv(population, rows, gzip=fmt == 'csv.gz')
+
+    async def write_csv(self, population, rows, gzip=False):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        for start in range(0, max(len(rows), 1), self.chunk_rows):
+            data = await self.run(csv_chunk, population, rows[start:start + self.chunk_rows], start == 0)
+            if compressor is not None:
+                data = compressor.compress(data)
+            if data:
+                self.write(data)
+                await self.flush()
+        if compressor is not None:
+            self.write(compressor.flush())
+
+    async def write_parquet(self, population, rows):
+        # each chunk becomes a row group; the bytes written so far are
+        # flushed to the client before the next group is encoded
+        sink = _Spool()
+        writer = None
+        for start in range(0, max(len(rows), 1), self.chunk_rows):
+            table = await self.run(parquet_chunk, population, rows[start:start + self.chunk_rows])
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+            await self.run(writer.write_table, table)
+            await self.drain(sink)
+        writer.close()
+        await self.drain(sink)
+
+    async def drain(self, sink):
+        data = sink.take()
+        if data:
+            self.write(data)
+            await self.flush()
+
+
+class _Spool(io.RawIOBase):
+    # write-only file that hands out what was written since the last take(),
+    # while tell() keeps counting from the start as the parquet writer expects
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data, self.parts = b''.join(self.parts), []
+        return data
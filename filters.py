@@ -0,0 +1,471 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from dataset import extends, n_rows, store_partitions, stored_arrays
+
+# Range-filter index for the slider columns.
+#
+# Every tab filters the population on the same four columns with a
+# [start, end] range per column. Instead of building a boolean mask over every
+# row on each slider move, the rows of each partition are sorted once per
+# column; a range query is then two searchsorted calls per column. Narrow
+# selections check only the rows inside the narrowest range against the other
+# ranges, wide ones start from the whole partition and clear the few rows
+# outside, and only when neither side is small do we fall back to a mask over
+# the partition's columns.
+#
+# The partitions are those of the store (GENDER2 x age band, see dataset.py),
+# each a contiguous run of rows. Their min/max tell whether a range keeps
+# all of a partition's rows, none of them, or has to look them up, so only the
+# partitions a range cuts through are ever read; their sorted views are built
+# the first time a query reaches them and stored memory-mapped next to the
+# population cache, so worker processes share one copy and memory follows the
+# partitions in use rather than the size of the file. Populations without
+# partitions get one per gender.
+#
+# Rows appended to the CSV since the store was written (see dataset.py) are
+# one more partition per gender, at the end of the rows. The index of the
+# population they extend hands over the sorted views of its partitions, and
+# its appended partition those of its rows, into which only the new rows are
+# merged.
+
+FILTER_COLUMNS = ('AGE', 'WEIGHT', 'HEIGHT', 'BMI')
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def _in_range(values, start, end, inclusive):
+    if inclusive:
+        return (values >= start) & (values <= end)
+    return (values > start) & (values < end)
+
+
+def _column_range(dtype, start, end, inclusive):
+    # (start, end, inclusive) of a range rounded to values of the column's
+    # type, integer columns with their bounds made inclusive. Plain Python
+    # numbers, which compare the same against the column and much faster
+    # against the partition statistics than numpy scalars.
+    if dtype.kind in 'iu':
+        if inclusive:
+            start, end = np.ceil(start), np.floor(end)
+        else:
+            start, end = np.floor(start) + 1, np.ceil(end) - 1
+        info = np.iinfo(dtype)
+        return int(np.clip(start, info.min, info.max)), int(np.clip(end, info.min, info.max)), True
+    return float(dtype.type(start)), float(dtype.type(end)), inclusive
+
+
+def _merged_stats(stats):
+    # the statistics of partitions taken together
+    result = {}
+    for partition_stats in stats:
+        for name, (low, high, missing) in partition_stats.items():
+            if name not in result:
+                result[name] = (low, high, missing)
+                continue
+            lows = [v for v in (result[name][0], low) if v is not None]
+            highs = [v for v in (result[name][1], high) if v is not None]
+            result[name] = (min(lows) if lows else None, max(highs) if highs else None, result[name][2] + missing)
+    return result
+
+
+class _Partition(object):
+    # rows start:stop of the population, or scattered ``rows`` of one gender
+    # (of a population without partitions, or appended to the store), sorted
+    # once per filter column on first use. ``base`` is the partition of the
+    # population this one extends that holds its first rows.
+
+    def __init__(self, population, name, start, stop, stats, row_type, rows=None, base=None):
+        self.population = population
+        self.name = name
+        self.start = start
+        self.stop = stop
+        # {column: (min, max, missing)}
+        self.stats = stats
+        self.row_type = row_type
+        self._rows = rows
+        self.size = stop - start if rows is None else len(rows)
+        self._arrays = None
+        self._lock = threading.Lock()
+        self.base = base
+
+    @property
+    def scattered(self):
+        return self._rows is not None
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            return np.arange(self.start, self.stop, dtype=self.row_type)
+        return self._rows
+
+    def empty(self):
+        return np.zeros(0, dtype=self.row_type)
+
+    def _load(self):
+        with self._lock:
+            if self._arrays is None:
+                def build():
+                    rows = self.rows
+                    arrays = {}
+                    if self._rows is not None:
+                        arrays['mask'] = np.zeros(self.stop - self.start, dtype=bool)
+                        arrays['mask'][rows - self.start] = True
+                    base = self.base._arrays if self.base is not None else None
+                    if base is not None:
+                        # the base's rows come first, only the rest are sorted
+                        rows = rows[len(self.base.rows):]
+                    for name in FILTER_COLUMNS:
+                        values = self.population[name][rows]
+                        order = np.argsort(values, kind='mergesort')
+                        arrays['order.' + name] = rows[order]
+                        arrays['sorted.' + name] = values[order]
+                        if base is not None:
+                            # equal values keep the base's rows, the lower ones, first
+                            at = np.searchsorted(base['sorted.' + name], arrays['sorted.' + name], side='right')
+                            for key in ('order.' + name, 'sorted.' + name):
+                                arrays[key] = np.insert(base[key], at, arrays[key])
+                    return arrays
+                self._arrays = stored_arrays(self.population, self.name, build,
+                                             rows=None if self._rows is not None else (self.start, self.stop))
+                self.base = None
+            return self._arrays
+
+    def order(self, name):
+        return self._load()['order.' + name]
+
+    def sorted(self, name):
+        return self._load()['sorted.' + name]
+
+    def keeps(self, name, bound):
+        """True if ``bound`` keeps every row of the partition, False if none, None if it has to look."""
+        if name not in self.stats:
+            return None if self.size else False
+        low, high, missing = self.stats[name]
+        if low is None:
+            return False
+        start, end, inclusive = bound
+        if inclusive:
+            if high < start or low > end:
+                return False
+            inside = start <= low and high <= end
+        else:
+            if high <= start or low >= end:
+                return False
+            inside = start < low and high < end
+        return True if inside and not missing else None
+
+    def span(self, name, bound):
+        values = self.sorted(name)
+        start, end, inclusive = bound
+        # keys of the values' own type, or searchsorted converts the values
+        start, end = values.dtype.type(start), values.dtype.type(end)
+        if inclusive:
+            return (np.searchsorted(values, start, side='left'),
+                    np.searchsorted(values, end, side='right'))
+        return (np.searchsorted(values, start, side='right'),
+                np.searchsorted(values, end, side='left'))
+
+    def spans(self, bounds):
+        # sorted positions of every bound that actually removes rows, or
+        # None when some bound removes all of them
+        keeps = dict((name, self.keeps(name, bound)) for name, bound in bounds.items())
+        if False in keeps.values():
+            return None
+        spans = {}
+        for name, bound in bounds.items():
+            if keeps[name]:
+                continue
+            lo, hi = self.span(name, bound)
+            if hi <= lo:
+                return None
+            if hi - lo < self.size:
+                spans[name] = (lo, hi)
+        return spans
+
+    def candidates(self, bounds, spans):
+        # start from the most selective column and check the others only on
+        # the rows that survived it
+        narrowest = min(spans, key=lambda name: spans[name][1] - spans[name][0])
+        lo, hi = spans[narrowest]
+        rows = self.order(narrowest)[lo:hi]
+        for name in spans:
+            if name != narrowest:
+                rows = rows[_in_range(self.population[name][rows], *bounds[name])]
+        return rows
+
+    def small(self, spans):
+        # whether the narrowest span is few enough rows to gather directly
+        return min(hi - lo for lo, hi in spans.values()) * 32 <= self.size
+
+    def mark(self, bounds, spans, out):
+        """Set the rows within ``bounds`` in ``out``, a bitmap of rows start:stop."""
+        if not spans:
+            if self._rows is None:
+                out[:] = True
+            else:
+                out[self._rows - self.start] = True
+            return
+        if self.small(spans):
+            out[self.candidates(bounds, spans) - self.start] = True
+            return
+        # the rows of other partitions may share ``out`` with scattered rows
+        keep = out if self._rows is None else np.zeros(len(out), dtype=bool)
+        keep[:] = True if self._rows is None else self._load()['mask']
+        if sum(self.size - hi + lo for lo, hi in spans.values()) * 8 <= self.size:
+            # few rows fall outside the ranges: clear them through the sorted order
+            for name, (lo, hi) in spans.items():
+                keep[self.order(name)[:lo] - self.start] = False
+                keep[self.order(name)[hi:] - self.start] = False
+        else:
+            # too many rows on both sides of the ranges for the sorted views
+            # to pay off, fall back to a mask over the columns that restrict
+            for name in spans:
+                keep &= _in_range(self.population[name][self.start:self.stop], *bounds[name])
+        if keep is not out:
+            out |= keep
+
+    def moved(self, name, old, new, bounds):
+        # rows entering and leaving the selection when the bound on ``name``
+        # moves from ``old`` to ``new`` while the other bounds stay put
+        for other, bound in bounds.items():
+            if other != name and self.keeps(other, bound) is False:
+                return self.empty(), self.empty()
+        before = self.keeps(name, old)
+        if before is not None and before == self.keeps(name, new):
+            return self.empty(), self.empty()
+        lo0, hi0 = self.span(name, old)
+        lo1, hi1 = self.span(name, new)
+        hi0, hi1 = max(lo0, hi0), max(lo1, hi1)
+        order = self.order(name)
+
+        def difference(lo, hi, lo_other, hi_other):
+            rows = np.concatenate([order[lo:min(hi, lo_other)], order[max(lo, hi_other):hi]])
+            for other, bound in bounds.items():
+                if other != name and len(rows):
+                    rows = rows[_in_range(self.population[other][rows], *bound)]
+            return rows
+
+        return difference(lo1, hi1, lo0, hi0), difference(lo0, hi0, lo1, hi1)
+
+    def distance(self, name, old, new):
+        # rows between the old and the new edges of the bound on ``name``
+        before = self.keeps(name, old)
+        if before is not None and before == self.keeps(name, new):
+            return 0
+        lo0, hi0 = self.span(name, old)
+        lo1, hi1 = self.span(name, new)
+        return abs(int(lo1) - int(lo0)) + abs(int(max(lo1, hi1)) - int(max(lo0, hi0)))
+
+
+class RangeIndex(object):
+    """Sorted views of the AGE/WEIGHT/HEIGHT/BMI columns, per partition of the population.
+
+    ``previous`` is the index of the population this one extends with
+    appended rows, if any.
+    """
+
+    def __init__(self, population, previous=None):
+        self.population = population
+        self.size = n_rows(population)
+        self.dtypes = dict((name, population[name].dtype) for name in FILTER_COLUMNS)
+        row_type = np.int64 if self.size > 2**31 - 1 else np.int32
+        layout = store_partitions(population)
+        # {GENDER2 value (None for missing): [_Partition in row order]}
+        self.partitions = OrderedDict()
+        if layout is not None:
+            known = {}
+            if previous is not None and previous.row_type == row_type:
+                known = dict((partition.name, partition) for partitions in previous.partitions.values()
+                             for partition in partitions)
+            appended = OrderedDict()
+            for i, partition in enumerate(layout):
+                if partition.batch:
+                    appended.setdefault(partition.gender, []).append(partition)
+                    continue
+                self.partitions.setdefault(partition.gender, []).append(
+                    _Partition(population, 'range_index.%d' % i, partition.start, partition.stop,
+                               partition.stats, row_type))
+                old = known.get('range_index.%d' % i)
+                if old is not None and (old.start, old.stop) == (partition.start, partition.stop):
+                    self.partitions[partition.gender][-1]._arrays = old._arrays
+            for gender, partitions in appended.items():
+                # the rows of every batch of this gender, in one partition
+                rows = np.concatenate([np.arange(p.start, p.stop, dtype=row_type) for p in partitions])
+                code = list(population['GENDER2'].categories).index(gender) if gender is not None else -1
+                name = 'range_index.a%d' % code
+                base = known.get(name)
+                if base is not None and not (base.scattered and base.stop <= rows[-1] and
+                                             np.array_equal(base.rows, rows[:len(base.rows)])):
+                    base = None
+                self.partitions.setdefault(gender, []).append(
+                    _Partition(population, name, int(rows[0]), int(rows[-1]) + 1,
+                               _merged_stats([p.stats for p in partitions]), row_type, rows, base))
+        else:
+            genders = pd.Categorical(population['GENDER2'])
+            for code in range(-1, len(genders.categories)):
+                # code -1 holds the rows with a missing gender
+                rows = np.flatnonzero(genders.codes == code).astype(row_type)
+                if code == -1 and not len(rows):
+                    continue
+                start, stop = (int(rows[0]), int(rows[-1]) + 1) if len(rows) else (0, 0)
+                key = genders.categories[code] if code >= 0 else None
+                self.partitions[key] = [_Partition(population, 'range_index.g%d' % code, start, stop, {},
+                                                   row_type, rows)]
+        self.row_type = row_type
+        self._rows = None
+
+    def build(self):
+        """Sort every partition now rather than on first use, e.g. before forking workers."""
+        for partitions in self.partitions.values():
+            for partition in partitions:
+                partition.order(FILTER_COLUMNS[0])
+        self.rows
+        return self
+
+    def select(self, gender, age, weight, height, bmi, inclusive=False, start=None):
+        if gender is None or gender == 'All':
+            keys = list(self.partitions)
+        elif gender in self.partitions:
+            keys = [gender]
+        else:
+            keys = []
+        return self.select_partitions(keys, (age, weight, height, bmi), inclusive, start)
+
+    def select_partition(self, key, ranges, inclusive=False, start=None):
+        """Rows of one partition (a GENDER2 value, None for missing) within ``ranges``.
+
+        ``ranges`` is a (age, weight, height, bmi) tuple of (start, end) pairs.
+        """
+        return self.select_partitions([key], ranges, inclusive, start)
+
+    def select_partitions(self, keys, ranges, inclusive=False, start=None):
+        """Sorted rows of the partitions ``keys`` within ``ranges``, in one pass.
+
+        ``start`` leaves out the rows before it, e.g. all but those appended
+        to the population (see dataset.extends).
+        """
+        partitions = [partition for key in keys for partition in self.partitions[key]
+                      if start is None or partition.stop > start]
+        rows = self._select(partitions, self._bounds(ranges, inclusive))
+        if start:
+            rows = rows[np.searchsorted(rows, start):]
+        return rows
+
+    def changes(self, old, new, inclusive=False):
+        """Rows added to and removed from each partition going from ``old`` to ``new``.
+
+        ``old`` and ``new`` are (age, weight, height, bmi) tuples of ranges.
+        Changed ranges are applied one column at a time, so the cost follows
+        the number of rows between the old and new slider edges rather than
+        the size of the selection. Returns {partition key: [(added, removed), ...]}.
+        """
+        current = self._bounds(old, inclusive)
+        result = dict((key, []) for key in self.partitions)
+        for name, (start, end) in zip(FILTER_COLUMNS, new):
+            bound = self._bound(name, start, end, inclusive)
+            if current[name] == bound:
+                continue
+            for key, partitions in self.partitions.items():
+                moved = [partition.moved(name, current[name], bound, current) for partition in partitions]
+                result[key].append((np.concatenate([added for added, removed in moved]),
+                                    np.concatenate([removed for added, removed in moved])))
+            current[name] = bound
+        return result
+
+    def distance(self, old, new, inclusive=False):
+        """Rows between the old and the new edges of the ranges that differ.
+
+        An upper bound of the rows ``changes(old, new)`` returns, found
+        without gathering any of them.
+        """
+        total = 0
+        for name, old_range, new_range in zip(FILTER_COLUMNS, old, new):
+            old_bound = self._bound(name, old_range[0], old_range[1], inclusive)
+            new_bound = self._bound(name, new_range[0], new_range[1], inclusive)
+            if old_bound == new_bound:
+                continue
+            for partitions in self.partitions.values():
+                total += sum(partition.distance(name, old_bound, new_bound) for partition in partitions)
+        return total
+
+    def _bound(self, name, start, end, inclusive):
+        return _column_range(self.dtypes[name], start, end, inclusive)
+
+    def _bounds(self, ranges, inclusive):
+        # {column: (start, end, inclusive)} of (age, weight, height, bmi) ranges
+        return dict((name, self._bound(name, start, end, inclusive))
+                    for name, (start, end) in zip(FILTER_COLUMNS, ranges))
+
+    @property
+    def rows(self):
+        """Every row of the population, in order."""
+        if self._rows is None:
+            self._rows = stored_arrays(self.population, 'range_index.rows',
+                                       lambda: {'rows': np.arange(self.size, dtype=self.row_type)})['rows']
+        return self._rows
+
+    def _select(self, partitions, bounds):
+        # whole partitions and small selections are put together in row
+        # order (runs of whole partitions as slices of self.rows, so these
+        # cost no copy), anything else goes through one bitmap over the rows
+        # of the partitions
+        plans = [(partition, partition.spans(bounds))
+                 for partition in sorted(partitions, key=lambda partition: partition.start)]
+        plans = [(partition, spans) for partition, spans in plans if spans is not None and partition.size]
+        if not plans:
+            return np.zeros(0, dtype=self.row_type)
+        if all(not spans or partition.small(spans) for partition, spans in plans):
+            pieces = []
+            for partition, spans in plans:
+                if spans:
+                    pieces.append(np.sort(partition.candidates(bounds, spans)))
+                elif partition.scattered:
+                    pieces.append(partition.rows)
+                elif pieces and isinstance(pieces[-1], tuple) and pieces[-1][1] == partition.start:
+                    pieces[-1] = (pieces[-1][0], partition.stop)
+                else:
+                    pieces.append((partition.start, partition.stop))
+            pieces = [self.rows[piece[0]:piece[1]] if isinstance(piece, tuple) else piece for piece in pieces]
+            if len(pieces) == 1:
+                return pieces[0]
+            if all(a.stop <= b.start for (a, _), (b, _) in zip(plans, plans[1:])):
+                return np.concatenate(pieces)
+            # scattered rows of different genders interleave
+            if sum(len(rows) for rows in pieces) * 16 <= self.size:
+                return np.sort(np.concatenate(pieces))
+        start = plans[0][0].start
+        bitmap = np.zeros(max(partition.stop for partition, spans in plans) - start, dtype=bool)
+        for partition, spans in plans:
+            partition.mark(bounds, spans, bitmap[partition.start - start:partition.stop - start])
+        rows = np.flatnonzero(bitmap)
+        if start:
+            rows += start
+        return rows
+
+
+def range_index(population):
+    """Return the process-wide RangeIndex for ``population``, building it once."""
+    with _lock:
+        index = _indexes.get(id(population))
+        if index is None or index.population is not population:
+            # a reloaded population replaces the index of the old one, and
+            # takes over what it can when it only has rows appended
+            previous = [old for old in _indexes.values() if extends(population, old.population) is not None]
+            _indexes.clear()
+            index = _indexes[id(population)] = RangeIndex(population, previous[0] if previous else None)
+        return index
+
+
+def select_rows(population, gender, age, weight, height, bmi, inclusive=False, start=None):
+    """Return the sorted row indices of ``population`` matching the slider ranges.
+
+    ``gender`` is a GENDER2 value, or 'All'/None for every row. Each range is a
+    (start, end) pair; bounds are exclusive unless ``inclusive`` is set.
+    ``start`` leaves out the rows before it.
+    """
+    return range_index(population).select(gender, age, weight, height, bmi, inclusive=inclusive, start=start)
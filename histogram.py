@@ -0,0 +1,178 @@
+import numpy as np
+
+from cube import HISTOGRAM_COLUMN, SUMMARY_COLUMNS, summary_cube
+from dataset import extends
+from filters import range_index
+from query import INCLUSIVE
+
+# Incremental histogram of one population column (FVC_MAX) for the histogram tab.
+#
+# Each session keeps per-gender counts at 1 ml resolution for its current
+# slider ranges, along with the count, sum and sum of squares of the columns
+# of the tab's summary statistics. A new bin width is a re-aggregation of
+# those counts, and a moved slider edge only adds/subtracts the rows between
+# the old and the new edge (see RangeIndex.changes) instead of re-reading the
+# whole selection. Populations large enough to have a summary cube (cube.py)
+# take any on-grid state from the cube instead when it has fewer cells to
+# look at than there are rows to move. Bins are exact as long as the column
+# holds whole ml values. Rows appended to the CSV are added to the counts of
+# the current ranges as they come (see extend).
+
+# Moving one row costs about as much as looking at this many cells of the cube
+ROW_CELLS = 8
+
+
+def _bins(values):
+    # (origin, size) of whole ml bins holding every finite value
+    finite = values[np.isfinite(values)]
+    if not len(finite):
+        return 0, 1
+    origin = int(np.floor(finite.min()))
+    return origin, int(np.floor(finite.max())) - origin + 1
+
+
+class HistogramEngine(object):
+    """Fine-grained FVC counts for one session, kept in sync with its sliders."""
+
+    def __init__(self, population, column='FVC_MAX', inclusive=INCLUSIVE, summary=SUMMARY_COLUMNS):
+        self.column = column
+        self.summary = tuple(summary)
+        self.inclusive = inclusive
+        self._bind(population)
+        self.origin, self.size = _bins(population[column])
+        self.ranges = None
+        self.counts = {}
+        # {partition: (len(summary), 3) array of count, sum, sum of squares}
+        self.sums = {}
+
+    def _bind(self, population):
+        self.population = population
+        self.index = range_index(population)
+        # the cube only answers for its own columns
+        if self.column == HISTOGRAM_COLUMN and set(self.summary) <= set(SUMMARY_COLUMNS):
+            self.cube = summary_cube(population)
+        else:
+            self.cube = None
+
+    def extend(self, population):
+        """Move the counts to ``population``.
+
+        When it only has rows appended to the current one (see
+        dataset.extends), those within the current ranges are added to the
+        counts; any other population is counted from scratch on the next update.
+        """
+        if population is self.population:
+            return
+        start = extends(population, self.population)
+        values = population[self.column][start:] if start is not None else None
+        if values is not None and np.isfinite(values).any():
+            origin, size = _bins(values)
+            if origin < self.origin or origin + size > self.origin + self.size:
+                # values past the bins, which move
+                start = None
+        self._bind(population)
+        if start is None:
+            self.origin, self.size = _bins(population[self.column])
+            self.ranges = None
+            self.counts = {}
+            self.sums = {}
+            return
+        if self.ranges is None:
+            return
+        for key in self.index.partitions:
+            rows = self.index.select_partition(key, self.ranges, self.inclusive, start)
+            self.counts[key] = self.counts.get(key, 0) + self._bincount(rows)
+            self.sums[key] = self.sums.get(key, 0) + self._moments(rows)
+
+    def _bincount(self, rows):
+        values = self.population[self.column][rows]
+        values = values[np.isfinite(values)]
+        return np.bincount((np.floor(values) - self.origin).astype(np.intp), minlength=self.size)
+
+    def _moments(self, rows):
+        sums = np.zeros((len(self.summary), 3))
+        for i, name in enumerate(self.summary):
+            values = self.population[name][rows].astype(np.float64)
+            values = values[np.isfinite(values)]
+            sums[i] = len(values), values.sum(), np.dot(values, values)
+        return sums
+
+    def update(self, age, weight, height, bmi):
+        """Move the counts to the given slider ranges."""
+        ranges = tuple(tuple(r) for r in (age, weight, height, bmi))
+        if ranges == self.ranges:
+            return
+        # the summary cube (if any) looks at its cells, not at rows
+        cells = self.cube.cells(ranges, self.inclusive) if self.cube is not None else None
+        if self.ranges is not None and (cells is None or
+                                        self.index.distance(self.ranges, ranges, self.inclusive) * ROW_CELLS < cells):
+            changes = self.index.changes(self.ranges, ranges, inclusive=self.inclusive)
+            moved = sum(len(a) + len(r) for steps in changes.values() for a, r in steps)
+            if moved < sum(counts.sum() for counts in self.counts.values()):
+                for key, steps in changes.items():
+                    for added, removed in steps:
+                        self.counts[key] += self._bincount(added) - self._bincount(removed)
+                        self.sums[key] += self._moments(added) - self._moments(removed)
+                self.ranges = ranges
+                return
+        if cells is not None:
+            for key in self.index.partitions:
+                counts, sums = self.cube.query(key, ranges, self.inclusive, self.summary)
+                self.counts[key] = counts
+                self.sums[key] = np.array([sums[name] for name in self.summary])
+            self.ranges = ranges
+            return
+        # first call, or so many rows moved that starting over is cheaper
+        for key in self.index.partitions:
+            rows = self.index.select_partition(key, ranges, self.inclusive)
+            self.counts[key] = self._bincount(rows)
+            self.sums[key] = self._moments(rows)
+        self.ranges = ranges
+
+    def gender_counts(self, gender):
+        if gender == 'All':
+            return sum(self.counts.values())
+        if gender in self.counts:
+            return self.counts[gender]
+        return np.zeros(self.size, dtype=np.int64)
+
+    def statistics(self, gender):
+        """{column: (count, mean, standard deviation)} of the summary columns for ``gender``."""
+        if gender == 'All':
+            sums = sum(self.sums.values())
+        else:
+            sums = self.sums.get(gender, np.zeros((len(self.summary), 3)))
+        result = {}
+        for name, (n, total, squares) in zip(self.summary, sums):
+            if not n:
+                result[name] = (0, np.nan, np.nan)
+                continue
+            mean = total / n
+            # sample standard deviation, the differences of squares can round below zero
+            std = np.sqrt(max(squares - total * mean, 0.) / (n - 1)) if n > 1 else np.nan
+            result[name] = (int(n), mean, std)
+        return result
+
+    def bins(self, gender, bin_width):
+        """Counts and edges for ``gender`` with bins of ``bin_width`` ml.
+
+        Mirrors ``np.histogram(x, np.arange(min(x), max(x) + bin_width, bin_width))``:
+        bins start at the smallest selected value and the last bin is closed.
+        A selection holding a single distinct value still gets one bin.
+        """
+        # the counts are per ml, so widths are whole ml
+        bin_width = max(int(round(bin_width)), 1)
+        counts = self.gender_counts(gender)
+        filled = np.flatnonzero(counts)
+        if not len(filled):
+            return np.zeros(0, dtype=np.int64), np.zeros(1)
+        first, last = filled[0], filled[-1]
+        edges = np.arange(first, last + bin_width, bin_width, dtype=np.float64) + self.origin
+        n_bins = max(len(edges) - 1, 1)
+        hist = np.add.reduceat(counts[first:last + 1], np.arange(0, last - first + 1, bin_width))
+        if len(hist) > n_bins:
+            hist = np.concatenate([hist[:n_bins - 1], [hist[n_bins - 1:].sum()]])
+        if len(edges) < 2:
+            edges = np.array([edges[0], edges[0] + bin_width])
+        return hist, edges
+
@@ -0,0 +1,125 @@
+import threading
+
+from bokeh.models.widgets import CheckboxGroup, RangeSlider
+from bokeh.layouts import WidgetBox
+
+import query
+from cache import cached, normalize
+from query import Filter
+from scheduling import Scheduler
+
+# Linked-filter mode: one filter panel for all the tabs.
+#
+# Off by default; serve.py --linked-filters turns it on for every session,
+# and ?linked=1 (or 0) in the URL for one session. The gender and slider
+# widgets of the tabs are then replaced by a single panel next to the tabs.
+# A change of the panel selects the matching rows once, in the pool (and
+# through the result cache, once for every session showing the same state).
+# Every tab built so far then derives what it shows from them: the scatter
+# its columns, the table its sorted page, the histogram its bins (from its
+# own counts, moved to the same ranges, see histogram.py). Those
+# derivations run side by side in the pool, NumPy letting go of the GIL in
+# the gathers and reductions they spend their time in, but only the tab
+# shown is updated; the others keep their result on hold (see
+# Scheduler.hold) and show it when they are selected.
+
+LINKED_FILTERS = False
+
+
+def enabled(doc):
+    """Whether the session of ``doc`` runs in linked-filter mode."""
+    context = doc.session_context
+    if context is not None and context.request is not None:
+        value = context.request.arguments.get('linked', [None])[0]
+        if value is not None:
+            return value in (b'1', b'true')
+    return LINKED_FILTERS
+
+
+class FilterPanel(object):
+    """The filter widgets shared by the tabs of one session, and the rows they select."""
+
+    def __init__(self, doc, population):
+        self.population = population
+        # the same widgets, with the same defaults, as those of the tabs
+        self.select_gender = CheckboxGroup(labels=['Male', 'Female', 'All'], active=[0, 1, 2])
+        self.age_select = RangeSlider(start=1, end=25, value=(1, 28), step=1, title='Range of Age')
+        self.weight_select = RangeSlider(start=10, end=200, value=(10, 200), step=1, title='Range of Weight')
+        self.height_select = RangeSlider(start=80, end=200, value=(80, 200), step=1, title='Range of Height')
+        self.bmi_select = RangeSlider(start=10, end=60, value=(10, 60), step=0.5, title='Range of Body Mass Index')
+        self.widgets = (self.select_gender, self.age_select, self.weight_select, self.height_select, self.bmi_select)
+        self.controls = WidgetBox(self.select_gender, self.age_select, self.weight_select, self.bmi_select, self.height_select)
+        self.defaults = self.spec()
+        # {tab title: Scheduler} of the tabs built so far, and the title shown
+        self.tabs = {}
+        self.visible = None
+        # (population, normalized spec, rows) of the last selection
+        self._selected = None
+        self._lock = threading.Lock()
+        self._select = cached('linked', self._query, lambda: self.population)
+        self.scheduler = Scheduler(doc, self.spec, self._selection, self._changed, name='linked')
+        self.select_gender.on_change('active', self.scheduler.request)
+        for widget in self.widgets[1:]:
+            widget.on_change('value', self.scheduler.request)
+
+    def genders(self):
+        return sorted(self.select_gender.labels[i] for i in self.select_gender.active)
+
+    def spec(self):
+        return dict(genders=self.genders(),
+                    age=tuple(self.age_select.value),
+                    weight=tuple(self.weight_select.value),
+                    height=tuple(self.height_select.value),
+                    bmi=tuple(self.bmi_select.value))
+
+    def at_defaults(self):
+        """Whether the panel holds its defaults, the only state whose tab results are pinned in the cache."""
+        return self.spec() == self.defaults
+
+    def _query(self, **spec):
+        return query.select(self.population, Filter(**spec))
+
+    def _selection(self, state):
+        return self.rows(self.population, Filter(**state))
+
+    def rows(self, population, spec):
+        """Rows of ``population`` matching ``spec``, selected once for all the tabs."""
+        key = normalize(spec)
+        with self._lock:
+            selected = self._selected
+        if selected is not None and selected[0] is population and selected[1] == key:
+            return selected[2]
+        if population is self.population:
+            rows = self._select(spec._asdict())
+        else:
+            rows = query.select(population, spec)
+        with self._lock:
+            self._selected = (population, key, rows)
+        return rows
+
+    def _changed(self, rows):
+        # every tab derives its view from the rows now, only the one shown applies it
+        for scheduler in self.tabs.values():
+            scheduler.flush()
+
+    def add(self, title, scheduler):
+        """Have the tab ``title`` follow the panel through ``scheduler``."""
+        self.tabs[title] = scheduler
+        if self.visible is not None and title != self.visible:
+            scheduler.hold()
+
+    def link(self, tabs):
+        """Follow which of ``tabs`` is shown, holding the updates of the others."""
+        def show(attr, old, new):
+            self.visible = tabs.tabs[new].title
+            for title, scheduler in self.tabs.items():
+                if title == self.visible:
+                    scheduler.release()
+                else:
+                    scheduler.hold()
+        tabs.on_change('active', show)
+        show('active', None, tabs.active)
+
+    def append(self, new_population, start):
+        # the tabs select the new rows themselves, see main.py
+        self.population = new_population
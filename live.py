@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+from functools import partial
+
+from cache import results
+from dataset import extends, load_population, n_rows
+from metrics import registry
+from table import complete_rows
+
+log = logging.getLogger(__name__)
+
+# Live refresh of the population while lines are appended to the CSV.
+#
+# One thread per server process looks at the CSV every POLL_SECONDS. When it
+# changed, load_population reads only the lines appended to it if that is
+# all that changed (see dataset.py), and the shared result cache moves to the
+# new population. Every session subscribed then gets ``callback(population)``
+# on its own thread; its tabs add the new rows within their filters to what
+# they show (see main.py), using the index, the cube and the complete rows
+# of the new population, which are brought up to date from those of the old
+# one rather than built again.
+
+# Seconds between two looks at the CSV, None for no live refresh
+POLL_SECONDS = 2.0
+
+_lock = threading.Lock()
+_watchers = {}
+
+
+class Watcher(object):
+    """The current population of one CSV, and the documents to tell when it changes."""
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.population = load_population(csv_path)
+        results.bind(self.population)
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        # one reload at a time, so populations only ever move forward
+        self._polling = threading.Lock()
+
+    def subscribe(self, doc, callback):
+        """Call ``callback(population)`` on ``doc``'s thread whenever the CSV changes.
+
+        Returns the population to start from: nothing that changes after it
+        is missed. Documents without a server session get their calls
+        straight from the polling thread.
+        """
+        if POLL_SECONDS is None:
+            # no polling thread, each new session looks for itself
+            self.poll()
+        with self._lock:
+            self._subscribers[doc] = callback
+            return self.population
+
+    def unsubscribe(self, doc):
+        with self._lock:
+            self._subscribers.pop(doc, None)
+
+    def poll(self):
+        """Load the CSV again if it changed, and tell the subscribers."""
+        with self._polling:
+            started = time.time()
+            try:
+                population = load_population(self.csv_path)
+            except (OSError, ValueError):
+                # e.g. a line that doesn't parse, which may yet be fixed
+                log.warning("could not reload %s", self.csv_path, exc_info=True)
+                return
+            if population is self.population:
+                return
+            start = extends(population, self.population)
+            results.bind(population)
+            complete_rows(population)
+            with self._lock:
+                self.population = population
+                subscribers = list(self._subscribers.items())
+            registry.observe('live', 'reload', time.time() - started,
+                             rows=n_rows(population) - (start or 0))
+        for doc, callback in subscribers:
+            if doc.session_context is None:
+                callback(population)
+            else:
+                doc.add_next_tick_callback(partial(callback, population))
+
+    def run(self):
+        while True:
+            time.sleep(POLL_SECONDS)
+            try:
+                self.poll()
+            except Exception:
+                log.exception("live refresh of %s failed", self.csv_path)
+
+
+def watcher(csv_path):
+    """The process-wide Watcher of ``csv_path``, polling from a thread of its own unless POLL_SECONDS is None."""
+    csv_path = os.path.abspath(csv_path)
+    with _lock:
+        if csv_path not in _watchers:
+            _watchers[csv_path] = Watcher(csv_path)
+            if POLL_SECONDS is not None:
+                thread = threading.Thread(target=_watchers[csv_path].run, name='live-refresh')
+                thread.daemon = True
+                thread.start()
+        return _watchers[csv_path]
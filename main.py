@@ -1,18 +1,61 @@
-import pandas as pd
 import numpy as np
 from os.path import dirname, join
 from bokeh.plotting import figure
-from bokeh.models import ColumnDataSource,Panel,HoverTool, CustomJS, Select
-from bokeh.models.widgets import Dropdown, CheckboxGroup,Slider,RangeSlider,Tabs, TableColumn, DataTable, Button
-from bokeh.layouts import row, WidgetBox
+from bokeh.models import ColumnDataSource,Panel,HoverTool, CustomJS, Select, LogColorMapper, LinearColorMapper, Legend, LegendItem
+from bokeh.models.widgets import Dropdown, CheckboxGroup,Slider,RangeSlider, TableColumn, DataTable, Button, RadioButtonGroup, Div, Toggle
+from bokeh.models.annotations import Band
+from bokeh.layouts import row, column, WidgetBox
 from bokeh.palettes import Category20_16
-from bokeh.io import curdoc,show
-from bokeh.themes import Theme
+from bokeh.io import curdoc
+from bokeh.core.properties import without_property_validation
 
-import yaml
+from dataset import extends
+import query
+from query import Filter
+from histogram import HistogramEngine
+from sources import RowSource, lookup_hover, lookup_template
+from table import TablePager
+import export
+import aggregate
+from aggregate import extent, pad, in_window, grid_counts, shades
+import overlays
+from scheduling import Scheduler
+from cache import cached, result_bytes
+from metrics import Probe
+import template
+from template import LazyTabs
+import live
+import linked
 
-population = pd.read_csv(join(dirname(__file__),'data','spirometry_anthropometric_clean.csv'))
-theme = Theme(join(dirname(__file__),"theme.yaml"))
+# Tabs built so far, each adding the rows appended to the CSV to what it shows
+appenders = []
+
+def refresh(new_population):
+    global population
+    if new_population is population:
+        return
+    # None when the rows were numbered anew, every tab then starts over
+    start = extends(new_population, population)
+    population = new_population
+    for append in appenders:
+        append(new_population, start)
+
+# Parsed once per server process and shared read-only by every session, and
+# replaced by the watcher when lines are appended to the CSV
+watcher = live.watcher(join(dirname(__file__),'data','spirometry_anthropometric_clean.csv'))
+population = watcher.subscribe(curdoc(), refresh)
+theme = template.theme(join(dirname(__file__),"theme.yaml"))
+# Times the stages of this session's tabs for /metrics, profiling them on ?profile=1
+probe = Probe(curdoc())
+# In linked-filter mode one panel of filters drives every tab (see linked.py)
+panel = linked.FilterPanel(curdoc(), population) if linked.enabled(curdoc()) else None
+if panel is not None:
+    appenders.append(panel.append)
+
+def pinned():
+    # A tab's first result stays in the shared cache only for the defaults
+    # every new session starts from, not for what a linked panel holds by then
+    return panel is None or panel.at_defaults()
 
 # Make plot with histogram and return tab
 
@@ -22,6 +65,10 @@ def histogram_tab(population):
     # Function to make a dataset for histogram based on a list of carriers
     # a minimum delay, maximum delay, and histogram bin widt
     
+    # Per-session FVC counts, updated incrementally as the sliders move
+    engine = HistogramEngine(population)
+
+    @probe.timed('histogram', 'make_dataset', rows=lambda data: int(data['proportion'].sum()), size=result_bytes)
     def make_dataset(gender_list=list(["Male","Female"]),
                     age_start=2,
                     age_end=26,
@@ -34,48 +81,54 @@ def histogram_tab(population):
                     bin_width = 25
                     ):
         
-        hist_population = pd.DataFrame(columns=['proportion', 'left', 'right', 
-                                        'f_proportion', 'f_interval','gender','color'])	  
-        
-                
-        for i, gender_name in enumerate(gender_list):
-            if gender_name == 'All':
-                subset = population
-            else:
-                subset = population[population['GENDER2'] == gender_name]	
-            subset = subset[(subset.AGE > age_start) 
-                                & (subset.AGE < age_end)
-                                & (subset.WEIGHT > weight_start)
-                                & (subset.WEIGHT < weight_end)
-                                & (subset.HEIGHT > height_start)
-                                & (subset.HEIGHT < height_end)
-                                & (subset.BMI > bmi_start)
-                                    & (subset.BMI < bmi_end)
-                            ]
-                            
+        # Rows appended to the CSV since the last update are counted first
+        engine.extend(population)
+        engine.update(age = (age_start, age_end),
+                      weight = (weight_start, weight_end),
+                      height = (height_start, height_end),
+                      bmi = (bmi_start, bmi_end))
 
-            arr_hist, edges = np.histogram(subset['FVC_MAX'], bins = np.arange(np.min(subset['FVC_MAX']), np.max(subset['FVC_MAX']) + bin_width, bin_width))
-            # Divide the counts by the total to get a proportion
-            arr_df = pd.DataFrame({'proportion': arr_hist , 'left': edges[:-1], 'right': edges[1:] })
-            
-            
-            # Format the proportion 
-            arr_df['f_proportion'] = ['%0.5f' % proportion for proportion in arr_df['proportion']]
-            
-            # Format the interval
-            arr_df['f_interval'] = ['%d to %d ml' % (left, right) for left, right in zip(arr_df['left'], arr_df['right'])]
-                
+        # Typed columns only, so they all travel as binary buffers: counts,
+        # edges in whole ml, and the gender and its color as small codes that
+        # the tooltip, the legend and the color mapper resolve in the browser
+        dtypes = dict(proportion=np.int32, left=np.float32, right=np.float32, gender=np.uint8, color=np.uint8)
+        hist_population = dict((name, []) for name in dtypes)
+        # Sorted by gender, each gender's bins already come sorted by left edge
+        for i, gender_name in sorted(enumerate(gender_list), key=lambda item: item[1]):
+            arr_hist, edges = engine.bins(gender_name, bin_width)
+            hist_population['proportion'].append(arr_hist)
+            hist_population['left'].append(edges[:-1])
+            hist_population['right'].append(edges[1:])
             #assign the carrier for labels
-            arr_df['gender'] = gender_name
+            hist_population['gender'].append(np.full(len(arr_hist), available_gender.index(gender_name)))
             #color each carrier differently
-            arr_df['color'] = Category20_16[i]
-            # Add to the overall dataframe
-            hist_population = hist_population.append(arr_df)
-        # Overall dataframe
-        hist_population = hist_population.sort_values(['gender', 'left'])
-        
-        #Add to the overall dataframe
-        return ColumnDataSource(hist_population)   
+            hist_population['color'].append(np.full(len(arr_hist), i))
+        hist_population = dict((name, np.concatenate(parts).astype(dtypes[name]) if parts else np.zeros(0, dtypes[name]))
+                               for name, parts in hist_population.items())
+
+        return hist_population
+
+    def make_density(gender_list, bin_width):
+        # One smoothed curve per gender from the engine's counts, in counts per bin
+        bin_width = max(int(round(bin_width)), 1)
+        density = dict(xs=[], ys=[], gender=[], color=[])
+        for i, gender_name in sorted(enumerate(gender_list), key=lambda item: item[1]):
+            counts = engine.gender_counts(gender_name)
+            x, pdf = overlays.binned_kde(counts, engine.origin)
+            density['xs'].append(x.astype(np.float32))
+            density['ys'].append((pdf * (counts.sum() * bin_width)).astype(np.float32))
+            density['gender'].append(available_gender.index(gender_name))
+            density['color'].append(i)
+        density['gender'] = np.array(density['gender'], dtype=np.uint8)
+        density['color'] = np.array(density['color'], dtype=np.uint8)
+        return density
+
+    def make_view(**state):
+        # Counts, density curves and the summary statistics of every gender
+        # shown, all from the engine at the slider ranges make_dataset moved it to
+        data = make_dataset(**state)
+        return (data, [(gender_name, engine.statistics(gender_name)) for gender_name in sorted(state['gender_list'])],
+                make_density(state['gender_list'], state['bin_width']))
         
     def style(p):
         # Title
@@ -92,30 +145,60 @@ def histogram_tab(population):
         p.yaxis.major_label_text_font_size = '12pt'
         return p
     
-    def make_plot(src):
+    @probe.timed('histogram', 'make_plot')
+    def make_plot(src, density_src):
         # Blank plot with correct labels
         p = figure(plot_width = 700, plot_height = 700, 
                 title = 'Force Vital Capacity',
                 x_axis_label = 'FVC (ml)', y_axis_label = 'Count',background_fill_color="#2E3332")
-        # Quad glyphs to create a histogram
-        p.quad(source = src, bottom = 0, top = 'proportion', left = 'left', right='right',
-            color = 'color', fill_alpha = 0.7,hover_fill_color = 'color', legend = 'gender', 
+        # Quad glyphs to create a histogram, colored by the gender's place in the selection
+        color = dict(field = 'color', transform = LinearColorMapper(palette = Category20_16[:len(available_gender)],
+                                                                   low = -0.5, high = len(available_gender) - 0.5))
+        quads = p.quad(source = src, bottom = 0, top = 'proportion', left = 'left', right='right',
+            color = color, fill_alpha = 0.7,hover_fill_color = color,
             hover_fill_alpha = 1.0, line_color = 'black') 
+        # Legend entries are set by show_legend, one per gender shown
+        legend = Legend(items = [])
+        p.add_layout(legend)
         #pdf line
-        # Hover tool with vline mode
-        hover = HoverTool(tooltips=[('Gender', '@gender'), 
-                                        ('ml', '@f_interval'),
-                                        ('Proportion', '@f_proportion')],
+        density = p.multi_line(source = density_src, xs = 'xs', ys = 'ys', line_color = color, line_width = 3)
+        # Hover tool with vline mode, formatted in the browser
+        hover = HoverTool(renderers=[quads], tooltips=[('Gender', '@gender{custom}'), 
+                                        ('ml', '@left{0} to @right{0} ml'),
+                                        ('Proportion', '@proportion{0.00000}')],
+                            formatters=dict(gender=lookup_hover(available_gender)),
                             mode='vline')
         p.add_tools(hover)
         
         p = style(p)
-        return p
+        return p, quads, density, legend
+
+    def show_legend(data):
+        # Each entry draws its swatch from the first bin of its gender
+        codes, first = np.unique(data['gender'], return_index=True)
+        items = []
+        for code, index in zip(codes, first):
+            item = legend_items.setdefault(int(code), LegendItem(label=available_gender[code], renderers=[quads]))
+            item.index = int(index)
+            items.append(item)
+        if legend.items != items:
+            legend.items = items
     
-    def update(attr,old,new):
-        genders_to_plot = [select_gender.labels[i] for i in select_gender.active]
-        
-        new_src = make_dataset(genders_to_plot, 
+    def show_summary(summary):
+        def cell(n, mean, std):
+            if not n:
+                return '<td>-</td>'
+            if np.isnan(std):
+                return '<td>%.0f</td>' % mean
+            return '<td>%.0f &plusmn; %.0f</td>' % (mean, std)
+        header = '<tr><th>Gender</th><th>n</th>%s</tr>' % ''.join('<th>%s</th>' % label for column, label in summary_columns)
+        lines = ['<tr><td>%s</td><td>%d</td>%s</tr>' % (gender_name, statistics[summary_columns[0][0]][0],
+                                                        ''.join(cell(*statistics[column]) for column, label in summary_columns))
+                 for gender_name, statistics in summary]
+        summary_div.text = '<table>%s%s</table>' % (header, ''.join(lines))
+    
+    def widget_state():
+        return dict(gender_list = [select_gender.labels[i] for i in select_gender.active],
                     age_start = age_select.value[0],
                     age_end = age_select.value[1],
                     weight_start = weight_select.value[0],
@@ -125,57 +208,84 @@ def histogram_tab(population):
                     bmi_start = bmi_select.value[0],
                     bmi_end = bmi_select.value[1],
                     bin_width = binwidth_select.value)
-        
-        src.data.update(new_src.data)
+
+    @probe.timed('histogram', 'update')
+    def update(view):
+        new_data, summary, density_data = view
+        src.data.update(new_data)
+        density_src.data = density_data
+        show_legend(new_data)
+        show_summary(summary)
+
+    # Widget changes are coalesced and the counts computed off the IOLoop
+    scheduler = Scheduler(curdoc(), widget_state, cached('histogram', make_view, lambda: population), update, name='histogram')
+
+    def append(new_population, start):
+        # The engine adds the new rows to its counts on the next update
+        nonlocal population
+        population = new_population
+        scheduler.invalidate()
             
+    # Mean and standard deviation shown under the histogram
+    summary_columns = [('FVC_MAX', 'FVC (ml)'),
+                       ('SESSION_BEST', 'Session best FVC'),
+                       ('SESSION_MEAN', 'Session mean FVC'),
+                       ('SESSION_STD', 'Session std FVC')]
+
     available_gender = list(['Male','Female','All'])
     available_gender.sort()
     gender_colors = Category20_16
     gender_colors.sort()
 
-    select_gender = CheckboxGroup(labels=list(['Male','Female','All']),active = [0,1,2])
-    
-    select_gender.on_change('active', update)
-    
     #binwidth select
     binwidth_select = Slider(start=1,end=600,step = 1,value=60,title='Bin Width')
-    binwidth_select.on_change('value', update)	
-    #age range select
-    age_select = RangeSlider(start=1,end=25,value=(1, 28),step=1,title='Range of Age')
-    age_select.on_change('value', update)
-    #weight range
-    weight_select =RangeSlider(start=10,end=200,value=(10, 200),step=1,title='Range of Weight')
-    weight_select.on_change('value', update)
-    #height range select
-    height_select = RangeSlider(start=80,end=200,value=(80, 200),step=1,title='Range of Height')
-    height_select.on_change('value', update)
-    #BMI range select
-    bmi_select = RangeSlider(start= 10,end=60,value=(10, 60),step=0.5,title='Range of Body Mass Index')
-    bmi_select.on_change('value', update)
+    binwidth_select.on_change('value', scheduler.request)	
+    #density curves
+    density_toggle = Toggle(label='Density curve', active=True)
+    density_toggle.on_change('active', lambda attr, old, new: setattr(density, 'visible', new))
+    if panel is None:
+        select_gender = CheckboxGroup(labels=list(['Male','Female','All']),active = [0,1,2])
         
-    # Initial carriers and data source
-    initial_gender = [select_gender.labels[i] for i in select_gender.active]		
-    
-    src = make_dataset(initial_gender, 
-                        age_start = age_select.value[0],
-                        age_end = age_select.value[1],
-                        weight_start = weight_select.value[0],
-                        weight_end = weight_select.value[1],
-                        height_start = height_select.value[0],
-                        height_end = height_select.value[1],
-                        bmi_start = bmi_select.value[0],
-                        bmi_end = bmi_select.value[1],
-                        bin_width = binwidth_select.value)
+        select_gender.on_change('active', scheduler.request)
+        #age range select
+        age_select = RangeSlider(start=1,end=25,value=(1, 28),step=1,title='Range of Age')
+        age_select.on_change('value', scheduler.request)
+        #weight range
+        weight_select =RangeSlider(start=10,end=200,value=(10, 200),step=1,title='Range of Weight')
+        weight_select.on_change('value', scheduler.request)
+        #height range select
+        height_select = RangeSlider(start=80,end=200,value=(80, 200),step=1,title='Range of Height')
+        height_select.on_change('value', scheduler.request)
+        #BMI range select
+        bmi_select = RangeSlider(start= 10,end=60,value=(10, 60),step=0.5,title='Range of Body Mass Index')
+        bmi_select.on_change('value', scheduler.request)
+    else:
+        # The shared filters, whose changes reach the tab through the panel
+        select_gender, age_select, weight_select, height_select, bmi_select = panel.widgets
+        panel.add('Histogram', scheduler)
+        
+    # Initial carriers and data source, the default state's counts are shared by every session
+    data, summary, density_data = scheduler.compute(widget_state(), pin=pinned())
+    src = ColumnDataSource(data)
+    density_src = ColumnDataSource(density_data)
                             
 
-    p = make_plot(src)
+    p, quads, density, legend = make_plot(src, density_src)
+    legend_items = {}
+    show_legend(src.data)
+    summary_div = Div(width=700)
+    show_summary(summary)
     
     # Put controls in a single element
-    controls = WidgetBox(select_gender,binwidth_select, age_select, weight_select, bmi_select, height_select)
+    if panel is None:
+        controls = WidgetBox(select_gender,binwidth_select, density_toggle, age_select, weight_select, bmi_select, height_select)
+    else:
+        controls = WidgetBox(binwidth_select, density_toggle)
     # Create a row layout
-    layout = row(controls, p)
+    layout = row(controls, column(p, summary_div))
     # Make a tab with the layout 
     tab = Panel(child=layout, title = 'Histogram')
+    appenders.append(append)
     
     return tab
 
@@ -184,182 +294,6 @@ def histogram_tab(population):
 #########################################################################################################################################
 
 def scatter_tab(population): 
-    def make_dataset(gender_list=list(['Male']),
-                    age_start=2,
-                    age_end=26,
-                    weight_start=10,
-                    weight_end=218,
-                    height_start=80,
-                    height_end=200,
-                    bmi_start=11.2,
-                    bmi_end=67.3,
-                    bin_width = 25,
-                    x_axis ='SESSION_IQR',
-                    y_axis ='SESSION_STD'
-                    ):
-        gender_list = sorted(gender_list)                    
-        plot_population = pd.DataFrame(columns=[x_axis , y_axis ,'gender','color'])
-        if len(gender_list) == 0:
-            plot_population = pd.DataFrame(columns=[x_axis , y_axis ,'gender','color'])
-        else:
-            for i, gender_name in enumerate(gender_list):
-                if gender_name == 'All':
-                    subset = population
-                else:
-                    subset = population[population['GENDER2'] == gender_name]	
-                    subset = subset[(subset.AGE > age_start) 
-                                    & (subset.AGE < age_end)
-                                    & (subset.WEIGHT > weight_start)
-                                    & (subset.WEIGHT < weight_end)
-                                    & (subset.HEIGHT > height_start)
-                                    & (subset.HEIGHT < height_end)
-                                    & (subset.BMI > bmi_start)
-                                        & (subset.BMI < bmi_end)
-                                ]
-                    
-                
-                arr_df = pd.DataFrame({'SEQN': subset['SEQN'], x_axis : subset[x_axis] , y_axis : subset[y_axis] })   
-                arr_df['gender'] = gender_name
-                arr_df['color'] = Category20_16[i]
-                arr_df = arr_df[['SEQN',x_axis,y_axis,'gender','color']]
-                
-                if gender_name == "Male":
-                    arr_df1 = arr_df
-                elif gender_name == "Female":
-                    arr_df2 = arr_df
-                else:
-                    arr_df3 = arr_df
-                    
-        if len(gender_list) == 1:
-            plot_population = arr_df
-            plot_population = plot_population.sort_values(['gender','SEQN'])
-            plot_population = plot_population[['SEQN',x_axis,y_axis,'gender','color']]
-            plot_population = plot_population.reset_index(drop=True)
-        elif len(gender_list) == 2:
-            if gender_list[0] == "Female":
-                plot_population = arr_df1.append(arr_df2, ignore_index=True)
-                plot_population = plot_population.sort_values(['gender','SEQN'])
-                plot_population = plot_population.reset_index(drop=True)
-            elif gender_list[1] == "Female":
-                plot_population = arr_df3.append(arr_df2, ignore_index=True)
-                plot_population = plot_population.sort_values(['gender','SEQN'])
-                plot_population = plot_population.reset_index(drop=True)
-            else:
-                plot_population = arr_df1.append(arr_df3, ignore_index=True)
-                plot_population = plot_population.sort_values(['gender','SEQN'])
-                plot_population = plot_population.reset_index(drop=True)
-        elif len(gender_list) == 3:
-            plot_population = arr_df1.append(arr_df2, ignore_index=True)
-            plot_population = plot_population.append(arr_df3, ignore_index=True)
-            plot_population = plot_population.sort_values(['gender','SEQN'])
-            plot_population = plot_population.reset_index(drop=True)
-                
-        
-        return ColumnDataSource(plot_population)   
-    
-    
-    def make_plot(src):
-        p=figure()
-        menu = [('Raw Curve Sequence Number','RAW_CURVE',), 
-                ('Force Vital Capacity (ml)','FVC_MAX'), 
-                ('Force Vital Capacity (ml) at 1sec','FEV1'), 
-                ('Force Vital Capacity (ml) at 3sec','FEV3'), 
-                ('Force Vital Capacity (ml) at 6sec','FEV6'),
-                ('Peak expiratory flow (ml)','PEAK_EXPIRATORY'), 
-                ('Max-Mid expiratory flow (ml)','MAX_MID_EXPIRATORY'), 
-                ('Pseudo PSU','PSEUDO_PSU'), 
-                ('Age (years)','AGE'), 
-                ('Gender','GENDER2'),
-                ('Height (cm)', 'HEIGHT'), 
-                ('Weight (kg)','WEIGHT'), 
-                ('Body mass index (kg/m2)','BMI'), 
-                ('Session best FVC','SESSION_BEST'), 
-                ('Session mean FVC','SESSION_MEAN'),
-                ('Session std FVC','SESSION_STD'), 
-                ('Session median FVC','SESSION_MEDIAN'), 
-                ('Session iqr FVC','SESSION_IQR'), 
-                ('Session minimum FVC','SESSION_MINIMUM'),
-                ('Session maximum FVC','SESSION_MAXIMUM'), 
-                ('Session max distance FVC','SESSION_MAX_DISTANCE'), 
-                ('Session median distance FVC','SESSION_MEDIAN_DISTANCE')]
-        if len(src.column_names) == 5:
-            for i in range(22):
-                if menu[i][1] == src.column_names[1]:
-                        titulo_x = menu[i][0]
-                        titulo_y = menu[i][0]
-                        break
-            xs=src.column_names[1]
-            ys=src.column_names[1]
-            gs=src.column_names[2]
-            zs=src.column_names[3]
-            x_title = titulo_x.title()
-            y_title = titulo_y.title()
-            kw = dict()
-            kw['title'] = "%s vs %s" % (x_title, y_title)
-            # Blank plot with correct labels
-            p = figure(plot_width = 700, plot_height = 700,background_fill_color="#2E3332",**kw)
-            p.xaxis.axis_label = x_title
-            p.yaxis.axis_label = y_title
-            # Quad glyphs to create a histogram
-            p.circle(source=src,x=xs , y=ys , size=7, color=zs,legend=gs,fill_alpha = 0.7)
-#        
-        if len(src.column_names) == 6:
-            for i in range(22):
-                if menu[i][1] == src.column_names[1]:
-                        titulo_x = menu[i][0]
-                if menu[i][1] == src.column_names[2]:        
-                        titulo_y = menu[i][0]                      
-            xs=src.column_names[1]
-            ys=src.column_names[2]
-            gs=src.column_names[3]
-            zs=src.column_names[4]
-            x_title = titulo_x.title()
-            y_title = titulo_y.title()
-            kw = dict()
-            kw['title'] = "%s vs %s" % (x_title, y_title)
-            # Blank plot with correct labels
-            p = figure(plot_width = 700, plot_height = 700,background_fill_color="#2E3332",**kw)
-            p.xaxis.axis_label = x_title
-            p.yaxis.axis_label = y_title
-            # Quad glyphs to create a histogram
-            p.circle(source=src,x=xs , y=ys , size=7, color=zs,legend=gs,fill_alpha = 0.7)   
-        return p
-    
-    def update():
-        genders_to_plot = [select_gender.labels[i] for i in select_gender.active]
-        new_src = make_dataset(genders_to_plot, 
-                    age_start = age_select.value[0],
-                    age_end = age_select.value[1],
-                    weight_start = weight_select.value[0],
-                    weight_end = weight_select.value[1],
-                    height_start = height_select.value[0],
-                    height_end = height_select.value[1],
-                    bmi_start = bmi_select.value[0],
-                    bmi_end = bmi_select.value[1],
-                    x_axis = select_x.value,
-                    y_axis = select_y.value)
-        
-        layout.children[1] = make_plot(new_src)
-    #gender selection
-    available_gender = list(['Male','Female','All'])
-    available_gender.sort()
-    gender_colors = Category20_16
-    gender_colors.sort()
-    select_gender = CheckboxGroup(labels=list(['Male','Female','All']),active = [0,1,2])    
-    select_gender.on_change('active', lambda attr, old, new: update())
-    #age range select
-    age_select = RangeSlider(start=1,end=25,value=(1, 28),step=1,title='Range of Age')
-    age_select.on_change('value', lambda attr, old, new: update())
-    #weight range
-    weight_select =RangeSlider(start=10,end=200,value=(10, 200),step=1,title='Range of Weight')
-    weight_select.on_change('value', lambda attr, old, new: update())
-    #height range select
-    height_select = RangeSlider(start=80,end=200,value=(80, 200),step=1,title='Range of Height')
-    height_select.on_change('value', lambda attr, old, new: update())
-    #BMI range select
-    bmi_select = RangeSlider(start= 10,end=60,value=(10, 60),step=0.5,title='Range of Body Mass Index')
-    bmi_select.on_change('value', lambda attr, old, new: update())
-    
     menu = [('Raw Curve Sequence Number','RAW_CURVE',), 
             ('Force Vital Capacity (ml)','FVC_MAX'), 
             ('Force Vital Capacity (ml) at 1sec','FEV1'), 
@@ -382,142 +316,479 @@ def scatter_tab(population):
             ('Session maximum FVC','SESSION_MAXIMUM'), 
             ('Session max distance FVC','SESSION_MAX_DISTANCE'), 
             ('Session median distance FVC','SESSION_MEDIAN_DISTANCE')]
+    titles = dict((column, label.title()) for label, column in menu)
+
+    @probe.timed('scatter', 'make_dataset', rows=len, size=lambda selection: result_bytes(selection.columns))
+    def make_dataset(x_column, y_column,
+                    gender_list=list(['Male']),
+                    age_start=2,
+                    age_end=26,
+                    weight_start=10,
+                    weight_end=218,
+                    height_start=80,
+                    height_end=200,
+                    bmi_start=11.2,
+                    bmi_end=67.3,
+                    start=None
+                    ):
+        # Rows of each gender and their values on the two axes, from row start on
+        spec = Filter(gender_list,
+                      age = (age_start, age_end),
+                      weight = (weight_start, weight_end),
+                      height = (height_start, height_end),
+                      bmi = (bmi_start, bmi_end))
+        # the rows the shared panel selected for every tab, in linked-filter mode
+        rows = panel.rows(population, spec) if panel is not None and start is None else None
+        return query.run(population, spec, columns = (x_column, y_column), start = start, rows = rows)
+
+    @probe.timed('scatter', 'make_trends', size=result_bytes)
+    def make_trends(filters, x_column, y_column, selection=None):
+        # Trend lines and percentile bands of each gender, whatever the window
+        if selection is None:
+            selection = make_dataset(x_column, y_column, **filters)
+        return dict((gender_name, overlays.trend(columns[x_column], columns[y_column]))
+                    for gender_name, columns in selection.columns.items())
+
+    @probe.timed('scatter', 'make_view', rows=lambda view: sum(len(r) for r in view['rows'].values()), size=result_bytes)
+    def make_view(filters, x_column, y_column, window, trend):
+        # Rows to draw as circles, or count grids when the window holds too many points
+        selection = make_dataset(x_column, y_column, **filters)
+        new_rows = selection.rows
+        values = dict((gender_name, (columns[x_column], columns[y_column]))
+                      for gender_name, columns in selection.columns.items())
+        extents = (extent(x for x, y in values.values()), extent(y for x, y in values.values()))
+        bounds = (pad(extents[0]), pad(extents[1]))
+        if window is None:
+            window = bounds
+        view = dict(rows=new_rows, grids=None, bounds=bounds, window=window, axes=(x_column, y_column),
+                    extents=extents, filters=filters, size=sum(len(rows) for rows in new_rows.values()), trends=None)
+        if trend:
+            # cached per filter state and axes, so zooming doesn't compute them again
+            view['trends'] = trends_cache(dict(filters=filters, x_column=x_column, y_column=y_column), selection=selection)
+        if None in window:
+            return view
+        in_view = dict((gender_name, in_window(x, y, window)) for gender_name, (x, y) in values.items())
+        if sum(int(mask.sum()) for mask in in_view.values()) > aggregate.AGGREGATE_POINTS:
+            view['grids'] = dict((gender_name, grid_counts(x, y, window)) for gender_name, (x, y) in values.items())
+        elif sum(len(rows) for rows in new_rows.values()) > aggregate.AGGREGATE_POINTS:
+            # zoomed in far enough to draw points, but only those in the window
+            view['rows'] = dict((gender_name, rows[in_view[gender_name]]) for gender_name, rows in new_rows.items())
+        return view
+
+    @probe.timed('scatter', 'make_plot')
+    def make_plot(sources, grid_sources):
+        # One persistent figure, one circle renderer per gender drawn in legend order
+        p = figure(plot_width = 700, plot_height = 700,background_fill_color="#2E3332")
+        # Count grids go under the circles, transparent where a cell is empty
+        images = {}
+        for gender_name in available_gender:
+            mapper = LogColorMapper(palette=shades(Category20_16[0]), low=1, high=2, low_color='rgba(0,0,0,0)')
+            images[gender_name] = p.image(source=grid_sources[gender_name], image='image', x='x', y='y', dw='dw', dh='dh',
+                                          color_mapper=mapper, global_alpha=0.7, visible=False)
+        renderers = {}
+        for gender_name in available_gender:
+            renderers[gender_name] = p.circle(source=sources[gender_name].source, x='x', y='y', size=7,
+                                              color=Category20_16[0], legend=gender_name, fill_alpha = 0.7)
+        # The axes fit the extent of the selection, whether it is drawn as circles or grids
+        extent_renderer = p.circle(source=extent_source, x='x', y='y', size=0, alpha=0)
+        p.x_range.renderers = p.y_range.renderers = [extent_renderer]
+        hover = HoverTool(renderers=list(images.values()), tooltips=[('Gender', '@gender'), ('Points', '@image')])
+        p.add_tools(hover)
+        # Trends over the circles, bands under them, shown by the Trend selection
+        trends = {}
+        for gender_name in available_gender:
+            source = trend_sources[gender_name]
+            bands = [Band(source=source, base='x', lower=lower, upper=upper, fill_alpha=alpha, line_alpha=0,
+                          level='underlay', visible=False)
+                     for lower, upper, alpha in (('q10', 'q90', 0.2), ('q25', 'q75', 0.3))]
+            for band in bands:
+                p.add_layout(band)
+            trends[gender_name] = dict(fit=[p.line(source=source, x='x', y='fit', line_width=3, line_dash='dashed', visible=False)],
+                                       lowess=[p.line(source=source, x='x', y='lowess', line_width=3, visible=False)],
+                                       bands=bands + [p.line(source=source, x='x', y='q50', line_width=3, visible=False)])
+        return p, renderers, images, trends
+
+    def plotted_window():
+        # None until the browser has fitted its ranges to the current axes
+        ranges = (p.x_range.start, p.x_range.end, p.y_range.start, p.y_range.end)
+        if view_axes[0] != (select_x.value, select_y.value) or None in ranges:
+            return None
+        if ranges[1] <= ranges[0] or ranges[3] <= ranges[2]:
+            return None
+        return (ranges[0], ranges[1]), (ranges[2], ranges[3])
+
+    def windowed():
+        # Whether the view depends on the plotted window: count grids, or
+        # more rows than are drawn as points. Otherwise the ranges the
+        # browser fits after each update would only echo the same view back.
+        view = shown[0]
+        return view is not None and (view['grids'] is not None or view['size'] > aggregate.AGGREGATE_POINTS)
+
+    def zoomed(attr, old, new):
+        if windowed():
+            scheduler.request(attr, old, new)
+
+    def widget_state():
+        filters = dict(gender_list = sorted(select_gender.labels[i] for i in select_gender.active),
+                       age_start = age_select.value[0],
+                       age_end = age_select.value[1],
+                       weight_start = weight_select.value[0],
+                       weight_end = weight_select.value[1],
+                       height_start = height_select.value[0],
+                       height_end = height_select.value[1],
+                       bmi_start = bmi_select.value[0],
+                       bmi_end = bmi_select.value[1])
+        return dict(filters = filters, x_column = select_x.value, y_column = select_y.value, window = plotted_window() if windowed() else None,
+                    trend = trend_select.value != 'none')
+
+    def show_grid(gender_name, counts, window, color):
+        (x0, x1), (y0, y1) = window
+        grid_sources[gender_name].data = dict(image=[counts], x=[x0], y=[y0], dw=[x1 - x0], dh=[y1 - y0], gender=[gender_name])
+        mapper = images[gender_name].glyph.color_mapper
+        mapper.high = max(int(counts.max()), 2)
+        palette = shades(color)
+        if list(mapper.palette) != palette:
+            mapper.palette = palette
+        images[gender_name].visible = True
+
+    def show_trends(gender_name, trends, color):
+        # The same trends (e.g. after a zoom) are not sent again
+        shown_trend = trends is not None and gender_name in trends
+        data = trends[gender_name] if shown_trend else empty_trend()
+        current = trend_sources[gender_name].data['x']
+        if current is not data['x'] and (shown_trend or len(current)):
+            trend_sources[gender_name].data = data
+        for kind, parts in trend_renderers[gender_name].items():
+            for part in parts:
+                part.visible = shown_trend and kind == trend_select.value
+                if not part.visible:
+                    continue
+                if isinstance(part, Band):
+                    part.fill_color = color
+                else:
+                    part.glyph.line_color = color
+
+    def hide_grid(gender_name):
+        if images[gender_name].visible:
+            images[gender_name].visible = False
+            grid_sources[gender_name].data = empty_grid()
+
+    # Property validation walks every element of the columns on each change
+    @probe.timed('scatter', 'update')
+    @without_property_validation
+    def update(view):
+        new_rows = view['rows']
+        genders_to_plot = sorted(new_rows)
+        view_axes[0] = view['axes']
+        shown[0] = view
+        show_extent(view['bounds'])
+        # Labels are updated in place, the data only by the rows and columns that changed
+        x_title = titles[select_x.value]
+        y_title = titles[select_y.value]
+        p.title.text = "%s vs %s" % (x_title, y_title)
+        p.xaxis.axis_label = x_title
+        p.yaxis.axis_label = y_title
+        for gender_name in available_gender:
+            if gender_name not in new_rows and renderers[gender_name].visible:
+                # An empty source also drops the legend entry of a field label
+                renderers[gender_name].visible = False
+                sources[gender_name].replace([])
+                show_trends(gender_name, None, Category20_16[0])
+                legend_items[gender_name].label = dict(field='SEQN')
+                hide_grid(gender_name)
+            elif gender_name in new_rows:
+                renderers[gender_name].visible = True
+                legend_items[gender_name].label = dict(value=gender_name)
+        for i, gender_name in enumerate(genders_to_plot):
+            src = sources[gender_name]
+            src.set_field('x', select_x.value)
+            src.set_field('y', select_y.value)
+            if view['grids'] is None:
+                hide_grid(gender_name)
+                src.update(new_rows[gender_name])
+            else:
+                src.update([])
+                show_grid(gender_name, view['grids'][gender_name], view['window'], Category20_16[i])
+            glyph = renderers[gender_name].glyph
+            glyph.fill_color = glyph.line_color = Category20_16[i]
+            show_trends(gender_name, view['trends'], Category20_16[i])
+
+    def show_extent(bounds):
+        fitted = dict(x=[], y=[])
+        if None not in bounds:
+            (x0, x1), (y0, y1) = bounds
+            fitted = dict(x=[x0, x1], y=[y0, y1])
+        if extent_source.data != fitted:
+            extent_source.data = fitted
+
+    # Row selection runs off the IOLoop, the sources are updated on the next tick
+    scheduler = Scheduler(curdoc(), widget_state, cached('scatter', make_view, lambda: population), update, name='scatter')
+    trends_cache = cached('scatter-trends', make_trends, lambda: population)
+
+    @without_property_validation
+    def append(new_population, start):
+        # New rows within the filters are streamed to the circles shown; count
+        # grids, an update on its way or rows numbered anew mean starting over
+        nonlocal population
+        population = new_population
+        for src in sources.values():
+            src.rebind(new_population, start)
+        view = shown[0]
+        if start is None or scheduler.busy or view is None or view['grids'] is not None or view['trends'] is not None:
+            scheduler.invalidate()
+            return
+        x_column, y_column = view['axes']
+        selection = make_dataset(x_column, y_column, start=start, **view['filters'])
+        if view['size'] + len(selection) > aggregate.AGGREGATE_POINTS:
+            scheduler.invalidate()
+            return
+        # the view may be shared through the result cache, so it is copied rather than changed
+        rows = dict(view['rows'])
+        for gender_name, added in selection.rows.items():
+            sources[gender_name].extend(added)
+            rows[gender_name] = np.concatenate([rows[gender_name], added])
+        extents = tuple(extent([np.array(span or [], dtype=np.float64)] +
+                               [columns[name] for columns in selection.columns.values()])
+                        for span, name in zip(view['extents'], (x_column, y_column)))
+        bounds = (pad(extents[0]), pad(extents[1]))
+        shown[0] = dict(view, rows=rows, extents=extents, bounds=bounds, size=view['size'] + len(selection))
+        show_extent(bounds)
+
+    #gender selection
+    available_gender = list(['Male','Female','All'])
+    available_gender.sort()
+    gender_colors = Category20_16
+    gender_colors.sort()
+    if panel is None:
+        select_gender = CheckboxGroup(labels=list(['Male','Female','All']),active = [0,1,2])    
+        select_gender.on_change('active', scheduler.request)
+        #age range select
+        age_select = RangeSlider(start=1,end=25,value=(1, 28),step=1,title='Range of Age')
+        age_select.on_change('value', scheduler.request)
+        #weight range
+        weight_select =RangeSlider(start=10,end=200,value=(10, 200),step=1,title='Range of Weight')
+        weight_select.on_change('value', scheduler.request)
+        #height range select
+        height_select = RangeSlider(start=80,end=200,value=(80, 200),step=1,title='Range of Height')
+        height_select.on_change('value', scheduler.request)
+        #BMI range select
+        bmi_select = RangeSlider(start= 10,end=60,value=(10, 60),step=0.5,title='Range of Body Mass Index')
+        bmi_select.on_change('value', scheduler.request)
+    else:
+        select_gender, age_select, weight_select, height_select, bmi_select = panel.widgets
+        panel.add('Scatter', scheduler)
     
     #select x axis
     select_x = Dropdown(label='X Axis', button_type="warning", value='SESSION_IQR', menu=menu)
-    select_x.on_change('value', lambda attr, old, new: update())
+    select_x.on_change('value', scheduler.request)
     #select y axis
     select_y = Dropdown(label='Y Axis', button_type="warning", value='SESSION_STD', menu=menu)
-    select_y.on_change('value', lambda attr, old, new: update())
+    select_y.on_change('value', scheduler.request)
+    #trend lines and bands
+    trend_select = Select(title='Trend', value='none', options=[('none', 'None'), ('fit', 'Least squares line'),
+                                                               ('lowess', 'LOWESS'), ('bands', 'Percentile bands')])
+    trend_select.on_change('value', scheduler.request)
 
-
-    # Initial carriers and data source
-    initial_gender = [select_gender.labels[i] for i in select_gender.active]		
-    
-    src = make_dataset(initial_gender, 
-                        age_start = age_select.value[0],
-                        age_end = age_select.value[1],
-                        weight_start = weight_select.value[0],
-                        weight_end = weight_select.value[1],
-                        height_start = height_select.value[0],
-                        height_end = height_select.value[1],
-                        bmi_start = bmi_select.value[0],
-                        bmi_end = bmi_select.value[1],
-                        x_axis = select_x.value,
-                        y_axis= select_y.value
-                        )
-#    p = make_plot(src)                       
+    # One source per gender, filled by the first update
+    sources = dict((gender_name, RowSource(population, [('SEQN', 'SEQN'), ('x', select_x.value), ('y', select_y.value)]))
+                   for gender_name in available_gender)
+    def empty_grid():
+        return dict(image=[], x=[], y=[], dw=[], dh=[], gender=[])
+    grid_sources = dict((gender_name, ColumnDataSource(data=empty_grid())) for gender_name in available_gender)
+    def empty_trend():
+        return dict((name, np.zeros(0, dtype=np.float32)) for name in ['x', 'fit', 'lowess'] + ['q%d' % q for q in overlays.PERCENTILES])
+    trend_sources = dict((gender_name, ColumnDataSource(data=empty_trend())) for gender_name in available_gender)
+    extent_source = ColumnDataSource(data=dict(x=[], y=[]))
+    # Axes the browser's ranges were last fitted to, and the view shown
+    view_axes = [None]
+    shown = [None]
+    p, renderers, images, trend_renderers = make_plot(sources, grid_sources)
+    # Zooming and panning re-aggregate for the new window, when the view depends on it
+    for plot_range in (p.x_range, p.y_range):
+        plot_range.on_change('start', zoomed)
+        plot_range.on_change('end', zoomed)
+    legend_items = dict((item.renderers[0], item) for item in p.legend[0].items)
+    legend_items = dict((gender_name, legend_items[renderers[gender_name]]) for gender_name in available_gender)
     # Put controls in a single element
-    controls = WidgetBox(select_gender, age_select, weight_select, bmi_select, height_select, select_x, select_y)
+    if panel is None:
+        controls = WidgetBox(select_gender, age_select, weight_select, bmi_select, height_select, select_x, select_y, trend_select)
+    else:
+        controls = WidgetBox(select_x, select_y, trend_select)
     # Create a row layout
-    layout = row(controls, make_plot(src))
+    layout = row(controls, p)
     # Make a tab with the layout 
     tab2 = Panel(child=layout, title = 'Scatter')
-    update()
+    scheduler.run_now(pin=pinned())
+    appenders.append(append)
     return tab2
 
 def table_tab(df):
 
     source = ColumnDataSource(data=dict())
 
-    def update():
-        current = df       
-        if select_gender.value == "Male":
-            current = df[(df['GENDER2'] == 'Male')]
-        elif select_gender.value == "Female":
-            current = df[(df['GENDER2'] == 'Female')]
-        elif select_gender.value == "All":
-            current = df
-            
-        current = current[ (current['HEIGHT'] >= height_select.value[0]) & (current['HEIGHT'] <= height_select.value[1])
-                            & (current['WEIGHT'] >= weight_select.value[0]) & (current['WEIGHT'] <= weight_select.value[1])
-                            & (current['AGE'] >= age_select.value[0]) & (current['AGE'] <= age_select.value[1])
-                            & (current['BMI'] >= bmi_select.value[0]) & (current['BMI'] <= bmi_select.value[1])
-                        ].dropna()
-
-        source.data = {
-            'SEQN'                      : current.SEQN,
-            'RAW_CURVE'                 : current.RAW_CURVE,
-            'FVC_MAX'                   : current.FVC_MAX,
-            'FEV1'                      : current.FEV1,
-            'FEV3'                      : current.FEV3,
-            'FEV6'                      : current.FEV6,
-            'PEAK_EXPIRATORY'           : current.PEAK_EXPIRATORY,
-            'MAX_MID_EXPIRATORY'        : current.MAX_MID_EXPIRATORY,
-            'PSEUDO_PSU'                : current.PSEUDO_PSU,
-            'AGE'                       : current.AGE,
-            'GENDER2'                   : current.GENDER2,
-            'GENDER'                    : current.GENDER,
-            'HEIGHT'                    : current.HEIGHT,
-            'WEIGHT'                    : current.WEIGHT,
-            'BMI'                       : current.BMI,
-            'SESSION_BEST'              : current.SESSION_BEST,
-            'SESSION_MEAN'              : current.SESSION_MEAN,
-            'SESSION_STD'               : current.SESSION_STD,
-            'SESSION_MEDIAN'            : current.SESSION_MEDIAN,
-            'SESSION_IQR'               : current.SESSION_IQR,
-            'SESSION_MINIMUM'           : current.SESSION_MINIMUM,
-            'SESSION_MAXIMUM'           : current.SESSION_MAXIMUM,
-            'SESSION_MAX_DISTANCE'      : current.SESSION_MAX_DISTANCE,
-            'SESSION_MEDIAN_DISTANCE'   : current.SESSION_MEDIAN_DISTANCE
-                    }
-    
-    
-    menu = [("All", "All"), ("Male", "Male"), ("Female", "Female")]
-    select_gender = Dropdown(label="Gender Selection", button_type="warning", menu=menu)
-    select_gender.on_change('value', lambda attr, old, new: update())
+    def widget_state():
+        # one gender from the dropdown, those checked in the shared panel
+        return dict(genders = [select_gender.value or 'All'] if panel is None else panel.genders(),
+                    age = age_select.value,
+                    weight = weight_select.value,
+                    height = height_select.value,
+                    bmi = bmi_select.value,
+                    sort_column = sort_select.value,
+                    ascending = order_select.active == 0)
+
+    def select_rows(genders, age, weight, height, bmi, start=None):
+        # Complete rows only, the table has no way to show a missing value
+        spec = Filter(genders, age = age, weight = weight, height = height, bmi = bmi)
+        rows = panel.rows(df, spec) if panel is not None and start is None else None
+        return query.select(df, spec, complete = True, start = start, rows = rows)
+
+    @probe.timed('table', 'make_dataset', rows=lambda arranged: len(arranged[0]), size=result_bytes)
+    def make_dataset(genders, age, weight, height, bmi, sort_column, ascending):
+        keep = select_rows(genders, age, weight, height, bmi)
+        selected, ordered = pager.arrange(keep, sort_column, ascending)
+        return selected, ordered, sort_column, ascending
+
+    def update(arranged):
+        pager.show(*arranged)
+        show_page()
+
+    @probe.timed('table', 'show_page')
+    def show_page():
+        # Only the displayed columns of the visible page go to the browser
+        source.data = pager.page_data()
+        page_info.text = pager.describe()
+
+    def turn(step):
+        pager.turn(pager.page + step)
+        show_page()
+
+    # Filtering and sorting run off the IOLoop, paging stays synchronous
+    scheduler = Scheduler(curdoc(), widget_state, cached('table', make_dataset, lambda: df), update, name='table')
+
+    def append(new_population, start):
+        # New rows within the filters are merged into the sorted selection and
+        # the page stays where it is, unless an update is on its way anyway
+        nonlocal df
+        df = new_population
+        if start is not None and not scheduler.busy:
+            state = widget_state()
+            pager.append(df, select_rows(state['genders'], state['age'], state['weight'], state['height'], state['bmi'],
+                                         start = start))
+            show_page()
+            return
+        pager.population = df
+        try:
+            if start is None:
+                # rows numbered anew: nothing shown holds until the update
+                pager.select(np.zeros(0, dtype=np.intp))
+        finally:
+            # the update comes whatever happened to what is shown
+            scheduler.invalidate()
+
+    def download():
+        # Written out as text the way the /export route does, so float32
+        # values keep the digits the CSV held
+        download_source.data = dict((name, export.csv_text(df[name][pager.rows])) for name in df)
+
     
-    #height range select
-    height_select = RangeSlider(title="Range of Height", start=80, end=200, value=(80, 200), step=0.5)
-    height_select.on_change('value', lambda attr, old, new: update())
-    #height range select
-    age_select = RangeSlider(title="Range of Age", start=1, end=28, value=(1, 28), step=1)
-    age_select.on_change('value', lambda attr, old, new: update())
-    #weight range select
-    weight_select = RangeSlider(title="Range of Weight", start=10, end=200, value=(10, 200), step=1)
-    weight_select.on_change('value', lambda attr, old, new: update())
-    #height range select
-    bmi_select = RangeSlider(title="Range of Body Mass Index", start=10, end=60, value=(10, 60), step=0.5)
-    bmi_select.on_change('value', lambda attr, old, new: update())
+    if panel is None:
+        menu = [("All", "All"), ("Male", "Male"), ("Female", "Female")]
+        select_gender = Dropdown(label="Gender Selection", button_type="warning", menu=menu)
+        select_gender.on_change('value', scheduler.request)
+        
+        #height range select
+        height_select = RangeSlider(title="Range of Height", start=80, end=200, value=(80, 200), step=0.5)
+        height_select.on_change('value', scheduler.request)
+        #height range select
+        age_select = RangeSlider(title="Range of Age", start=1, end=28, value=(1, 28), step=1)
+        age_select.on_change('value', scheduler.request)
+        #weight range select
+        weight_select = RangeSlider(title="Range of Weight", start=10, end=200, value=(10, 200), step=1)
+        weight_select.on_change('value', scheduler.request)
+        #height range select
+        bmi_select = RangeSlider(title="Range of Body Mass Index", start=10, end=60, value=(10, 60), step=0.5)
+        bmi_select.on_change('value', scheduler.request)
+    else:
+        select_gender, age_select, weight_select, height_select, bmi_select = panel.widgets
+        panel.add('Summary Table', scheduler)
 
     button = Button(label="Download", button_type="success")
-    button.callback = CustomJS(args=dict(source=source),code=open(join(dirname(__file__), "download.js")).read())
 
     columns = [
         TableColumn(field='SEQN', title='SEQN'),
         TableColumn(field='FVC_MAX', title='FVC (ml)'),
         TableColumn(field='AGE', title='AGE (years)'),
-        TableColumn(field='GENDER2', title='GENDER'),
+        TableColumn(field='GENDER2', title='GENDER', formatter=lookup_template(df['GENDER2'].categories)),
         TableColumn(field='HEIGHT', title='HEIGHT (cm)'),
         TableColumn(field='BMI', title='BMI'),
         TableColumn(field="SESSION_BEST", title='SESSION MAXIMUM (ml)')
                     ]
-    data_table = DataTable(source=source, columns=columns, width=1000)
+    # Sorting happens on the server over the whole selection, not per page
+    data_table = DataTable(source=source, columns=columns, width=1000, sortable=False)
+    pager = TablePager(df, [column.field for column in columns])
+
+    #sort selection
+    sort_select = Select(title="Sort by", value='SEQN', options=[(column.field, column.title) for column in columns])
+    sort_select.on_change('value', scheduler.request)
+    order_select = RadioButtonGroup(labels=['Ascending', 'Descending'], active=0)
+    order_select.on_change('active', scheduler.request)
+
+    #download
+    if export.export_url is not None:
+        # Streamed by the server's /export handler from the filter state
+        format_select = Select(title="Export format", value='csv', options=export.formats())
+        button.callback = CustomJS(args=dict(url=export.export_url, gender=select_gender, age=age_select,
+                                             weight=weight_select, height=height_select, bmi=bmi_select,
+                                             sort=sort_select, order=order_select, format=format_select),
+                                   code=open(join(dirname(__file__), "export.js")).read())
+        download_controls = [format_select, button]
+    else:
+        # Plain `bokeh serve` has no export route: the full selection is
+        # handed to the browser only when Download is pressed
+        download_source = ColumnDataSource(data=dict())
+        button.on_click(download)
+        download_source.js_on_change('data', CustomJS(args=dict(source=download_source),code=open(join(dirname(__file__), "download.js")).read()))
+        # Not referenced by the layout, so it needs its own root to be synced
+        curdoc().add_root(download_source)
+        download_controls = [button]
+
+    #page navigation
+    previous_button = Button(label="Previous", width=100)
+    previous_button.on_click(lambda: turn(-1))
+    next_button = Button(label="Next", width=100)
+    next_button.on_click(lambda: turn(1))
+    page_info = Div(width=300)
 
 
     # Put controls in a single element
-    controls = WidgetBox(select_gender, age_select, weight_select, bmi_select, height_select,button)
+    if panel is None:
+        controls = WidgetBox(select_gender, age_select, weight_select, bmi_select, height_select, sort_select, order_select, *download_controls)
+    else:
+        controls = WidgetBox(sort_select, order_select, *download_controls)
     # Create a row layout
-    layout = row(controls,data_table)
+    layout = row(controls, column(data_table, row(previous_button, page_info, next_button)))
     # Make a tab with the layout 
     tab = Panel(child=layout, title = 'Summary Table')
-    update()
+    scheduler.run_now(pin=pinned())
+    appenders.append(append)
 
     return tab
 
-# Create each of the tabs
-tab1 = histogram_tab(population)
-tab2 = scatter_tab(population)
-tab3 = table_tab(population)
-
-
-# Put all the tabs into one application
-tabs = Tabs(tabs = [tab1,tab2,tab3])
+# Create each of the tabs, Scatter and Summary Table only once they are first selected
+tabs = LazyTabs([('Histogram', lambda: probe.timed('histogram', 'build')(histogram_tab)(population)),
+                 ('Scatter', lambda: probe.timed('scatter', 'build')(scatter_tab)(population)),
+                 ('Summary Table', lambda: probe.timed('table', 'build')(table_tab)(population))])
+if panel is not None:
+    panel.link(tabs.tabs)
 
 # Put the tabs in the current document for display
 doc = curdoc()
 doc.theme = theme
-doc.add_root(tabs)
+if panel is not None:
+    # The shared filters, shown above the tabs
+    doc.add_root(panel.controls)
+doc.add_root(tabs.tabs)
 doc.title = "Web app - Grisanti"
+doc.on_session_destroyed(lambda session_context: watcher.unsubscribe(doc))
 
 
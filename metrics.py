@@ -0,0 +1,165 @@
+import cProfile
+import logging
+import os
+import threading
+import time
+import timeit
+from collections import OrderedDict
+from functools import wraps
+
+import cache
+
+log = logging.getLogger(__name__)
+
+# Hot-path timings of the tabs.
+#
+# Every stage of a tab (building it, make_dataset, make_plot, the update that
+# writes a result into the Bokeh models, and the latency from a widget change
+# to that update) is timed, along with the rows it handled and the size of
+# what it returned. The numbers are kept per server process and exposed by
+# serve.py as Prometheus text on /metrics. In a server session the update
+# stage includes serializing the resulting PATCH-DOC messages.
+#
+# With a profile directory configured (serve.py --profile-dir), a session
+# opened with ?profile=1 runs its stages under cProfile and dumps the profile
+# of every stage slower than SLOW_MS into that directory, to be read with
+# pstats or snakeviz.
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Stages at least this slow get their profile dumped
+SLOW_MS = 500
+# Where profiles are dumped; None disables profiling altogether
+PROFILE_DIR = None
+
+
+class _Stage(object):
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        # None for stages that count no rows or sizes
+        self.rows = None
+        self.bytes = None
+
+
+class Registry(object):
+    """Timings, row counts and output sizes per (tab, stage), safe to update from any thread."""
+
+    def __init__(self):
+        self.profiles = 0
+        self._stages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, tab, stage, seconds, rows=None, size=None):
+        with self._lock:
+            entry = self._stages.get((tab, stage))
+            if entry is None:
+                entry = self._stages[(tab, stage)] = _Stage()
+            entry.count += 1
+            entry.seconds += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry.buckets[i] += 1
+                    break
+            if rows is not None:
+                entry.rows = (entry.rows or 0) + rows
+            if size is not None:
+                entry.bytes = (entry.bytes or 0) + size
+
+    def profiled(self):
+        with self._lock:
+            self.profiles += 1
+
+    def render(self):
+        """The counters in the Prometheus text exposition format."""
+        with self._lock:
+            stages = [(key, entry.count, entry.seconds, list(entry.buckets), entry.rows, entry.bytes)
+                      for key, entry in self._stages.items()]
+            profiles = self.profiles
+        lines = ['# HELP spirometry_stage_seconds Time spent in a stage of a tab.',
+                 '# TYPE spirometry_stage_seconds histogram']
+        for (tab, stage), count, seconds, buckets, rows, size in stages:
+            labels = 'tab="%s",stage="%s"' % (tab, stage)
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append('spirometry_stage_seconds_bucket{%s,le="%g"} %d' % (labels, bound, cumulative))
+            lines.append('spirometry_stage_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+            lines.append('spirometry_stage_seconds_sum{%s} %.6f' % (labels, seconds))
+            lines.append('spirometry_stage_seconds_count{%s} %d' % (labels, count))
+        lines += ['# HELP spirometry_stage_rows_total Population rows handled by a stage.',
+                  '# TYPE spirometry_stage_rows_total counter']
+        lines += ['spirometry_stage_rows_total{tab="%s",stage="%s"} %d' % (key + (rows,))
+                  for key, count, seconds, buckets, rows, size in stages if rows is not None]
+        lines += ['# HELP spirometry_stage_output_bytes_total Memory held by the results of a stage.',
+                  '# TYPE spirometry_stage_output_bytes_total counter']
+        lines += ['spirometry_stage_output_bytes_total{tab="%s",stage="%s"} %d' % (key + (size,))
+                  for key, count, seconds, buckets, rows, size in stages if size is not None]
+        lines += ['# HELP spirometry_slow_profiles_total Profiles dumped for slow stages.',
+                  '# TYPE spirometry_slow_profiles_total counter',
+                  'spirometry_slow_profiles_total %d' % profiles]
+        stats = cache.results.stats()
+        for name in ('hits', 'misses', 'evictions'):
+            lines += ['# TYPE spirometry_cache_%s_total counter' % name,
+                      'spirometry_cache_%s_total %d' % (name, stats[name])]
+        for name in ('entries', 'pinned', 'bytes', 'max_bytes'):
+            lines += ['# TYPE spirometry_cache_%s gauge' % name,
+                      'spirometry_cache_%s %d' % (name, stats[name])]
+        return '\n'.join(lines) + '\n'
+
+
+# Shared by every session of the process
+registry = Registry()
+
+# Profilers replace each other's hook: only the outermost stage of a thread is profiled
+_profiling = threading.local()
+
+
+class Probe(object):
+    """Instrumentation of one session's tabs."""
+
+    def __init__(self, doc=None):
+        context = doc.session_context if doc is not None else None
+        self.session_id = context.id if context is not None else None
+        self.profile = False
+        if PROFILE_DIR is not None and context is not None and context.request is not None:
+            self.profile = context.request.arguments.get('profile', [b''])[0] in (b'1', b'true')
+
+    def timed(self, tab, stage, rows=None, size=None):
+        """Decorator recording the duration of each call, plus ``rows(result)`` and ``size(result)``."""
+        def decorate(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                profiler = None
+                if self.profile and not getattr(_profiling, 'active', False):
+                    profiler = cProfile.Profile()
+                    _profiling.active = True
+                    profiler.enable()
+                start = timeit.default_timer()
+                try:
+                    result = function(*args, **kwargs)
+                finally:
+                    elapsed = timeit.default_timer() - start
+                    if profiler is not None:
+                        profiler.disable()
+                        _profiling.active = False
+                registry.observe(tab, stage, elapsed,
+                                 rows=rows(result) if rows is not None else None,
+                                 size=size(result) if size is not None else None)
+                if profiler is not None and elapsed * 1000 >= SLOW_MS:
+                    self._dump(profiler, tab, stage, elapsed)
+                return result
+            return wrapper
+        return decorate
+
+    def _dump(self, profiler, tab, stage, elapsed):
+        name = '%s-%s-%s-%s-%dms.prof' % (time.strftime('%Y%m%d-%H%M%S'), self.session_id, tab, stage, elapsed * 1000)
+        try:
+            profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+        except (IOError, OSError):
+            log.exception("could not write profile %s", name)
+            return
+        registry.profiled()
+        log.info("%s %s took %d ms, profile written to %s", tab, stage, elapsed * 1000, name)
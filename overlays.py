@@ -0,0 +1,157 @@
+import numpy as np
+
+# Statistical overlays of the histogram and scatter tabs.
+#
+# Both work on binned data, so past the one pass that bins the rows their
+# cost depends on the number of bins and not on the number of rows. The
+# histogram's density curve is a Gaussian KDE of the 1 ml counts its engine
+# already keeps (see histogram.py): the counts, coarsened to at most
+# KDE_POINTS bins, are convolved with the kernel through an FFT. The scatter's
+# trends bin the selected points along x into TREND_BINS bins, with the
+# count and the sums of x and y per bin: the least squares line is drawn
+# through the bin means (its slope from the sums of products of all the
+# points), LOWESS fits its local lines to the bin means weighted by their
+# counts, and the percentile bands are read from the cumulative counts of a
+# grid of TREND_BINS x PERCENTILE_BINS cells. LOWESS does without the
+# robustness iterations, which the bin means already smooth over. Past
+# TREND_POINTS points, only an evenly strided sample of them is binned, so a
+# selection of millions of rows takes no longer than one of TREND_POINTS.
+
+# Most points of a density curve
+KDE_POINTS = 256
+# Most points binned for the scatter trends of one gender
+TREND_POINTS = 250000
+# Bins along x of the scatter trends
+TREND_BINS = 100
+# Bins along y the percentiles are read from
+PERCENTILE_BINS = 256
+# Percentiles of the bands, the middle one drawn as a line
+PERCENTILES = (10, 25, 50, 75, 90)
+# Share of the points each LOWESS line is fitted to
+LOWESS_FRACTION = 2. / 3
+
+
+def _coarsen(counts, factor):
+    return np.add.reduceat(counts, np.arange(0, len(counts), factor)) if factor > 1 else counts
+
+
+def _quantiles(counts, probabilities):
+    # bin of each quantile of binned values, interpolated within the bin
+    cumulative = np.cumsum(counts, axis=-1, dtype=np.float64)
+    total = cumulative[..., -1:]
+    targets = np.asarray(probabilities, dtype=np.float64) * total
+    index = np.minimum((cumulative[..., None, :] < targets[..., :, None]).sum(axis=-1), counts.shape[-1] - 1)
+    before = np.take_along_axis(cumulative, index, axis=-1) - np.take_along_axis(counts, index, axis=-1)
+    inside = np.take_along_axis(counts, index, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(inside > 0, (targets - before) / inside, 0.5)
+    return index + np.clip(fraction, 0, 1)
+
+
+def bandwidth(counts, width=1.0):
+    """Silverman's rule of thumb bandwidth of the values binned as ``counts``, in the unit of ``width``."""
+    n = counts.sum()
+    if n < 2:
+        return width
+    centers = (np.arange(len(counts)) + 0.5) * width
+    mean = np.dot(counts, centers) / n
+    std = np.sqrt(max(np.dot(counts, (centers - mean) ** 2) / (n - 1), 0.))
+    low, high = _quantiles(counts, [0.25, 0.75]) * width
+    spread = min(std, (high - low) / 1.34) or std
+    return max(0.9 * spread * n ** -0.2, width)
+
+
+def binned_kde(counts, origin, width=1.0, h=None, points=KDE_POINTS):
+    """``(x, density)`` of the Gaussian KDE of the values binned as ``counts``.
+
+    Bin i holds the values from ``origin + i * width`` to the next bin. ``h``
+    is the bandwidth, Silverman's rule by default. The curve reaches four
+    bandwidths past the first and last bins holding values, at most
+    ``points`` points; the density integrates to 1.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    filled = np.flatnonzero(counts)
+    if not len(filled):
+        return np.zeros(0), np.zeros(0)
+    origin += filled[0] * width
+    counts = counts[filled[0]:filled[-1] + 1]
+    if h is None:
+        h = bandwidth(counts, width)
+    tail = 4 * h
+    # coarse enough for the curve and its tails to fit in the points
+    factor = max(int(np.ceil((len(counts) * width + 2 * tail) / width / points)), 1)
+    counts = _coarsen(counts, factor)
+    width *= factor
+    pad = int(np.ceil(tail / width))
+    # room for the kernel on both sides, so the circular convolution doesn't wrap
+    size = 1 << int(np.ceil(np.log2(len(counts) + 2 * pad)))
+    grid = np.zeros(size)
+    grid[pad:pad + len(counts)] = counts
+    # the Fourier transform of the Gaussian kernel is known, no need to sample it
+    frequencies = np.fft.rfftfreq(size, d=width)
+    smoothed = np.fft.irfft(np.fft.rfft(grid) * np.exp(-2 * (np.pi * frequencies * h) ** 2), size)
+    n = len(counts) + 2 * pad
+    x = origin + (np.arange(n) - pad + 0.5) * width
+    density = np.maximum(smoothed[:n], 0) / (counts.sum() * width)
+    return x, density
+
+
+def _lowess(x, y, weights, fraction):
+    # one weighted local line per bin, through the bins nearest to it
+    distance = np.abs(x[:, None] - x[None, :])
+    order = np.argsort(distance, axis=1)
+    reached = np.cumsum(weights[order], axis=1) >= fraction * weights.sum()
+    nearest = np.take_along_axis(order, reached.argmax(axis=1)[:, None], axis=1)[:, 0]
+    span = np.maximum(distance[np.arange(len(x)), nearest], np.finfo(np.float64).tiny) * 1.000001
+    w = weights * np.clip(1 - (distance / span[:, None]) ** 3, 0, None) ** 3
+    sw = w.sum(axis=1)
+    mx = w.dot(x) / sw
+    my = w.dot(y) / sw
+    sxx = (w * (x[None, :] - mx[:, None]) ** 2).sum(axis=1)
+    sxy = (w * (x[None, :] - mx[:, None]) * (y[None, :] - my[:, None])).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(sxx > 0, sxy / sxx, 0.)
+    return my + slope * (x - mx)
+
+
+def trend(x, y, bins=TREND_BINS, percentile_bins=PERCENTILE_BINS, percentiles=PERCENTILES, points=TREND_POINTS):
+    """Trends of ``y`` along ``x``, as float32 columns over the bins of x holding points.
+
+    ``x`` is the mean x of each bin, ``fit`` the least squares line, ``lowess``
+    the LOWESS curve and ``q<p>`` the p-th percentile of y in the bin. Past
+    ``points`` points they are those of every k-th point.
+    """
+    columns = ['x', 'fit', 'lowess'] + ['q%d' % p for p in percentiles]
+    if len(x) > points:
+        step = -(-len(x) // points)
+        x, y = x[::step], y[::step]
+    keep = np.isfinite(x) & np.isfinite(y)
+    if not keep.all():
+        x, y = x[keep], y[keep]
+    x, y = x.astype(np.float64), y.astype(np.float64)
+    if not len(x):
+        return dict((name, np.zeros(0, dtype=np.float32)) for name in columns)
+    (x0, x1), (y0, y1) = (x.min(), x.max()), (y.min(), y.max())
+    # points on the upper edges belong to the last bin
+    i = np.minimum(((x - x0) * (bins / (x1 - x0 or 1))).astype(np.intp), bins - 1)
+    j = np.minimum(((y - y0) * (percentile_bins / (y1 - y0 or 1))).astype(np.intp), percentile_bins - 1)
+    n = np.bincount(i, minlength=bins).astype(np.float64)
+    sx = np.bincount(i, x, minlength=bins)
+    sy = np.bincount(i, y, minlength=bins)
+    filled = n > 0
+    n, mx, my = n[filled], sx[filled] / n[filled], sy[filled] / n[filled]
+
+    # least squares line, centered so the sums of products stay small
+    cx, cy = x - x.mean(), y - y.mean()
+    sxx = np.dot(cx, cx)
+    slope = np.dot(cx, cy) / sxx if sxx > 0 else 0.
+    fit = y.mean() + slope * (mx - x.mean())
+
+    grid = np.bincount(i * percentile_bins + j, minlength=bins * percentile_bins)
+    grid = grid.reshape(bins, percentile_bins)[filled]
+    levels = y0 + _quantiles(grid, [p / 100. for p in percentiles]) * ((y1 - y0 or 1) / percentile_bins)
+
+    result = dict(x=mx, fit=fit, lowess=_lowess(mx, my, n, LOWESS_FRACTION))
+    for k, p in enumerate(percentiles):
+        result['q%d' % p] = levels[:, k]
+    return dict((name, result[name].astype(np.float32)) for name in columns)
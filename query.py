@@ -0,0 +1,87 @@
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from filters import range_index
+from sources import column_values
+from table import complete_rows
+
+# One query pipeline for the tabs and the export.
+#
+# A filter spec names the GENDER2 groups to show and a (start, end) range per
+# slider column. The semantics are the same for every caller: bounds are
+# inclusive, and 'All' is the group of every row within the ranges (rows with
+# a missing gender only ever show up there). The rows of all requested groups
+# come out of one index query and are split on their gender codes, so every
+# group stays in row order and no per-gender frame is built. Only the columns
+# a caller asks for are gathered, once for the whole selection.
+
+ALL = 'All'
+# Range bounds are part of the selection
+INCLUSIVE = True
+
+
+class Filter(namedtuple('Filter', ['genders', 'age', 'weight', 'height', 'bmi'])):
+    """GENDER2 groups to show (``'All'`` for every row) and ``(start, end)`` per slider column."""
+    __slots__ = ()
+
+    @property
+    def ranges(self):
+        return (self.age, self.weight, self.height, self.bmi)
+
+
+class Result(object):
+    """Rows of each requested group in row order, plus the projected columns of those rows."""
+
+    def __init__(self, rows, columns):
+        # {group: rows} and {group: {column: values}}, groups in sorted order
+        self.rows = rows
+        self.columns = columns
+
+    def __len__(self):
+        return sum(len(rows) for rows in self.rows.values())
+
+
+def _partitions(index, genders):
+    if ALL in genders:
+        return list(index.partitions)
+    return [gender for gender in genders if gender in index.partitions]
+
+
+def select(population, spec, complete=False, start=None, rows=None):
+    """Sorted rows matching ``spec`` in any of its groups.
+
+    ``complete`` drops the rows with a missing value in any column, ``start``
+    the rows before it (e.g. all but those appended, see dataset.extends).
+    ``rows`` are those matching ``spec`` if they were already selected, e.g.
+    once for every tab (see linked.py).
+    """
+    if rows is None:
+        index = range_index(population)
+        rows = index.select_partitions(_partitions(index, spec.genders), spec.ranges, inclusive=INCLUSIVE, start=start)
+    elif start is not None:
+        rows = rows[np.searchsorted(rows, start):]
+    if complete:
+        rows = rows[complete_rows(population)[rows]]
+    return rows
+
+
+def run(population, spec, columns=(), complete=False, start=None, rows=None):
+    """Rows of every group of ``spec`` and their values of ``columns``, in one pass."""
+    rows = select(population, spec, complete, start, rows)
+    values = dict((name, column_values(population, name, rows)) for name in columns)
+    genders = sorted(set(spec.genders))
+    if any(gender != ALL for gender in genders):
+        codes = population['GENDER2'].codes[rows]
+        categories = list(population['GENDER2'].categories)
+    result = Result(OrderedDict(), OrderedDict())
+    for gender in genders:
+        if gender == ALL:
+            result.rows[gender] = rows
+            result.columns[gender] = values
+            continue
+        # one compare over the gathered codes per group, the rows stay in order
+        keep = np.flatnonzero(codes == (categories.index(gender) if gender in categories else -2))
+        result.rows[gender] = rows[keep]
+        result.columns[gender] = dict((name, v[keep]) for name, v in values.items())
+    return result
@@ -0,0 +1,173 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from tornado import gen
+
+from bokeh.document import without_document_lock
+
+from metrics import registry
+
+log = logging.getLogger(__name__)
+
+# Coalesced, off-thread widget callbacks.
+#
+# A slider drag fires a 'value' change for every step. Instead of recomputing
+# on each of them, a tab's widgets only call ``Scheduler.request``; the update
+# runs once the burst has been quiet for ``delay`` ms (or every ``max_wait``
+# ms during a long drag) with whatever the widgets hold at that point. The
+# data work runs in a thread pool shared by the process, so the IOLoop keeps
+# serving the other sessions, and its result is applied to the Bokeh models
+# in a next tick callback. A result whose widget state has been superseded
+# while it was computed is dropped and the computation started again. The time
+# from the first change to the update showing it is recorded as the tab's
+# latency stage (see metrics.py). A scheduler on hold (a tab that isn't shown)
+# keeps computing but only keeps its latest result, and applies it once
+# released.
+
+DEBOUNCE_MS = 50
+MAX_WAIT_MS = 250
+
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+class Scheduler(object):
+    """Update loop for one tab of one session.
+
+    ``state()`` snapshots the widget values on the session thread.
+    ``compute(state)`` does the data work in the pool and must not touch any
+    Bokeh model. ``apply(result)`` pushes the result into the models on the
+    session thread. At most one computation per scheduler is in flight.
+
+    Documents without a server session (e.g. built headlessly by the
+    benchmarks) run every request synchronously.
+    """
+
+    def __init__(self, doc, state, compute, apply, delay=DEBOUNCE_MS, max_wait=MAX_WAIT_MS, name=None):
+        self.doc = doc
+        self.state = state
+        self.compute = compute
+        self.apply = apply
+        self.delay = delay
+        self.max_wait = max_wait
+        self.name = name
+        self.generation = 0
+        self.running = False
+        self.started = 0
+        self.held = False
+        self._pending = None
+        self._timeout = None
+        self._burst_start = None
+        self._requested = None
+
+    def run_now(self, **options):
+        """Compute and apply synchronously, e.g. to fill the tab when it is built.
+
+        ``options`` go to ``compute``, e.g. ``pin=True`` for a cached compute.
+        """
+        self.generation += 1
+        self.started = self.generation
+        self.apply(self.compute(self.state(), **options))
+
+    @property
+    def busy(self):
+        """Whether an update is being computed, waits for a burst of changes to end or is kept on hold."""
+        return self.running or self._timeout is not None or self._pending is not None
+
+    def hold(self):
+        """Keep the results computed from now on instead of applying them, e.g. while the tab is hidden."""
+        self.held = True
+
+    def release(self):
+        """Apply the result kept on hold if it is still current, or compute it if there is none."""
+        self.held = False
+        pending, self._pending = self._pending, None
+        if pending is not None and pending[0] == self.generation:
+            self.apply(pending[1])
+        elif self.started != self.generation and not self.busy:
+            if self.doc.session_context is None:
+                self.run_now()
+            else:
+                self._start()
+
+    def invalidate(self):
+        """Schedule an update although no widget changed, e.g. because the data did."""
+        self.request(None, None, None)
+
+    def request(self, attr, old, new):
+        """Widget callback: schedule an update with the widget values at the time it runs."""
+        if self.doc.session_context is None:
+            if self.held:
+                # computed once released
+                self.generation += 1
+            else:
+                self.run_now()
+            return
+        self.generation += 1
+        now = time.time()
+        if self._requested is None:
+            self._requested = now
+        if self._timeout is not None:
+            if (now - self._burst_start) * 1000 >= self.max_wait:
+                # a long drag still refreshes every max_wait ms
+                return
+            self.doc.remove_timeout_callback(self._timeout)
+        else:
+            self._burst_start = now
+        self._timeout = self.doc.add_timeout_callback(self._fire, self.delay)
+
+    def flush(self):
+        """Like ``request``, without waiting for a burst of changes to end, e.g. once the rows it reads are ready."""
+        if self.doc.session_context is None:
+            self.request(None, None, None)
+            return
+        self.generation += 1
+        if self._requested is None:
+            self._requested = time.time()
+        if self._timeout is not None:
+            self.doc.remove_timeout_callback(self._timeout)
+            self._timeout = None
+        if not self.running:
+            self._start()
+
+    def _fire(self):
+        self._timeout = None
+        if not self.running:
+            self._start()
+
+    def _start(self):
+        self.running = True
+        generation = self.started = self.generation
+        state = self.state()
+
+        @gen.coroutine
+        @without_document_lock
+        def compute():
+            try:
+                result = yield _executor.submit(self.compute, state)
+            except Exception:
+                log.exception("update failed")
+                self.doc.add_next_tick_callback(self._done)
+                return
+            self.doc.add_next_tick_callback(partial(self._finish, generation, result))
+
+        self.doc.add_next_tick_callback(compute)
+
+    def _finish(self, generation, result):
+        if generation == self.generation and self.held:
+            # the latency is that of the tab showing it, once released
+            self._pending = (generation, result)
+            self._requested = None
+        elif generation == self.generation:
+            self.apply(result)
+            if self.name is not None and self._requested is not None:
+                registry.observe(self.name, 'latency', time.time() - self._requested)
+            self._requested = None
+        self._done()
+
+    def _done(self):
+        self.running = False
+        if self.started != self.generation and self._timeout is None:
+            # the widgets moved on while computing: start over with their new state
+            self._start()
@@ -0,0 +1,128 @@
+import argparse
+import multiprocessing
+import os
+from os.path import abspath, basename, dirname, join
+
+from bokeh.application import Application
+from bokeh.application.handlers import DirectoryHandler
+from bokeh.server.server import Server
+from tornado.web import RequestHandler
+
+import aggregate
+import cache
+import cube
+import export
+import linked
+import live
+import metrics
+from dataset import load_population
+from filters import range_index
+from table import complete_rows
+
+# Runs the app the way `bokeh serve` does, plus the routes a directory app
+# can't add by itself (the streaming /export download, /stats counters and
+# the Prometheus /metrics endpoint).
+#
+#     python serve.py --port 5006 --allow-websocket-origin localhost:5006
+#
+# With --num-procs the columns, the filter indexes and (from --cube-rows rows
+# on) the summary cube are built once into the memory-mapped cache next to
+# the CSV before the workers are forked; every worker then maps the same
+# files read-only, so memory stays flat as the number of workers grows. The
+# CSV itself is streamed into that cache in blocks (see dataset.py), so it
+# may be larger than memory. Lines appended to the CSV while it runs show up
+# in the open sessions every --poll-seconds (see live.py).
+
+APP_DIR = dirname(abspath(__file__))
+CSV_PATH = join(APP_DIR, 'data', 'spirometry_anthropometric_clean.csv')
+
+
+class StatsHandler(RequestHandler):
+    """GET /stats: hit/miss/eviction counters of the shared result cache, as JSON."""
+
+    def get(self):
+        self.set_header('Cache-Control', 'no-store')
+        self.write(dict(cache=cache.results.stats()))
+
+
+class MetricsHandler(RequestHandler):
+    """GET /metrics: stage timings of the tabs and cache counters of this worker, as Prometheus text."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.set_header('Cache-Control', 'no-store')
+        self.write(metrics.registry.render())
+
+
+def prepare_data(csv_path, cube_rows=cube.CUBE_ROWS):
+    """Build the memory-mapped columns and indexes of ``csv_path`` for the workers to attach to."""
+    cube.CUBE_ROWS = cube_rows
+    population = load_population(csv_path)
+    range_index(population).build()
+    complete_rows(population)
+    cube.summary_cube(population)
+
+
+def make_server(port=5006, address=None, allow_websocket_origin=None, prefix='', num_procs=1):
+    app_path = '/' + basename(APP_DIR)
+    prefix = prefix.strip('/')
+    prefix = '/' + prefix if prefix else ''
+    # main.py reads this to point the Download button at the handler
+    export.export_url = prefix + '/export'
+    return Server({app_path: Application(DirectoryHandler(filename=APP_DIR))},
+                  port=port, address=address, prefix=prefix, num_procs=num_procs,
+                  allow_websocket_origin=allow_websocket_origin,
+                  extra_patterns=[('/export', export.ExportHandler, dict(csv_path=CSV_PATH)),
+                                  ('/stats', StatsHandler),
+                                  ('/metrics', MetricsHandler)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--address', default=None)
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--num-procs', type=int, default=1,
+                        help='worker processes to fork, 0 for one per CPU')
+    parser.add_argument('--allow-websocket-origin', action='append', default=None)
+    parser.add_argument('--aggregate-points', type=int, default=aggregate.AGGREGATE_POINTS,
+                        help='points in view above which the scatter is drawn as count grids')
+    parser.add_argument('--cache-mb', type=float, default=cache.CACHE_BYTES / 2 ** 20,
+                        help='memory budget of the result cache shared by the sessions')
+    parser.add_argument('--cube-rows', type=int, default=cube.CUBE_ROWS,
+                        help='rows from which the histogram tab is answered from a precomputed summary cube')
+    parser.add_argument('--profile-dir', default=None,
+                        help='let sessions opened with ?profile=1 dump cProfile profiles of slow stages here')
+    parser.add_argument('--poll-seconds', type=float, default=live.POLL_SECONDS,
+                        help='seconds between two looks for lines appended to the CSV, 0 for no live refresh')
+    parser.add_argument('--linked-filters', action='store_true', default=linked.LINKED_FILTERS,
+                        help='one filter panel for all the tabs (sessions may still choose with ?linked=0 or 1)')
+    parser.add_argument('--slow-ms', type=float, default=metrics.SLOW_MS,
+                        help='stages at least this slow get their profile dumped')
+    args = parser.parse_args()
+
+    aggregate.AGGREGATE_POINTS = args.aggregate_points
+    cache.results.max_bytes = int(args.cache_mb * 2 ** 20)
+    metrics.SLOW_MS = args.slow_ms
+    cube.CUBE_ROWS = args.cube_rows
+    live.POLL_SECONDS = args.poll_seconds or None
+    linked.LINKED_FILTERS = args.linked_filters
+    if args.profile_dir is not None:
+        if not os.path.isdir(args.profile_dir):
+            os.makedirs(args.profile_dir)
+        metrics.PROFILE_DIR = abspath(args.profile_dir)
+
+    if args.num_procs != 1:
+        # Built in a throwaway process: the launcher itself never holds the
+        # data, so the workers it forks can only get it from the mapped files
+        process = multiprocessing.get_context('spawn').Process(target=prepare_data, args=(CSV_PATH, cube.CUBE_ROWS))
+        process.start()
+        process.join()
+
+    server = make_server(args.port, args.address, args.allow_websocket_origin, args.prefix, args.num_procs)
+    server.start()
+    server.io_loop.start()
+
+
+if __name__ == '__main__':
+    main()
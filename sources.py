@@ -0,0 +1,154 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from bokeh.models import ColumnDataSource, CustomJSHover
+from bokeh.models.widgets import HTMLTemplateFormatter
+
+# ColumnDataSource kept in sync with a changing set of population rows.
+#
+# Assigning ``source.data`` re-sends every row of every column. Here each row
+# of the source is a slot holding one population row; when the selection
+# changes, slots of rows that left are overwritten with rows that entered
+# (``source.patch``), extra rows are appended (``source.stream``) and extra
+# free slots are dropped from the front (``source.stream`` with rollover).
+# Only when most of the rows change is the whole data replaced, since patches
+# travel as JSON while full columns go out as binary buffers.
+
+# Patches cost roughly four times as much per row as a full binary column
+FULL_UPDATE_RATIO = 4
+
+# Only numeric columns of these types travel as binary buffers; strings and
+# int64 go out as JSON lists. Labels are therefore sent as small integer
+# codes and turned back into names by the formatters below, in the browser.
+
+
+def column_values(population, column, rows):
+    values = population[column][rows]
+    if isinstance(values, pd.Categorical):
+        # categorical columns are plotted by code
+        codes = values.codes.astype(np.float32)
+        codes[values.codes == -1] = np.nan
+        return codes
+    return np.asarray(values)
+
+
+def lookup_hover(names):
+    """Tooltip formatter showing ``names[value]`` for a column of codes (``@column{custom}``)."""
+    return CustomJSHover(code="var names = %s; return value >= 0 && value < names.length ? names[value] : ''"
+                              % json.dumps([str(name) for name in names]))
+
+
+def lookup_template(names):
+    """Table cell formatter showing ``names[value]`` for a column of codes, blank for -1."""
+    return HTMLTemplateFormatter(template='<%%- %s[value] %%>' % json.dumps([str(name) for name in names]))
+
+
+def _patch_list(slots, values):
+    # JSON can't carry NaN in scalar patches, only inside slice patches
+    patches = []
+    for slot, value in zip(slots.tolist(), values.tolist()):
+        if isinstance(value, float) and not np.isfinite(value):
+            patches.append((slice(slot, slot + 1), np.array([value], dtype=values.dtype)))
+        else:
+            patches.append((slot, value))
+    return patches
+
+
+class RowSource(object):
+    """A ColumnDataSource showing ``fields`` of a set of population rows.
+
+    ``fields`` maps source column names to population column names. Row order
+    in the source is arbitrary.
+    """
+
+    def __init__(self, population, fields, rows=None):
+        self.population = population
+        self.fields = dict(fields)
+        self.rows = self.requested = np.asarray([] if rows is None else rows, dtype=np.int64)
+        self.source = ColumnDataSource(data=self._columns(self.rows))
+        # whether the rows shown are those of a population since replaced
+        self.stale = False
+
+    def _columns(self, rows):
+        return dict((name, column_values(self.population, column, rows))
+                    for name, column in self.fields.items())
+
+    def set_field(self, name, column):
+        """Point source column ``name`` at another population column."""
+        if self.fields.get(name) == column:
+            return
+        self.fields[name] = column
+        if not self.stale:
+            self.source.data[name] = column_values(self.population, column, self.rows)
+
+    def replace(self, rows):
+        self.rows = self.requested = np.asarray(rows, dtype=np.int64)
+        self.source.data = self._columns(self.rows)
+        self.stale = False
+
+    def rebind(self, population, start):
+        """Read the rows from ``population`` from now on.
+
+        ``start`` is its first row past those of the current population (see
+        dataset.extends): the rows shown keep their values. None means the
+        rows were numbered anew, and the next update sends every row again.
+        """
+        self.population = population
+        if start is None:
+            self.stale = True
+
+    def extend(self, rows):
+        """Show ``rows`` as well, sending only them (``source.stream``)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows):
+            self.rows = np.concatenate([self.rows, rows])
+            self.requested = np.concatenate([self.requested, rows])
+            self.source.stream(self._columns(rows))
+
+    def update(self, rows):
+        """Show ``rows``, sending only the slots that change."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.stale:
+            self.replace(rows)
+            return
+        if len(rows) == len(self.requested) and np.array_equal(rows, self.requested):
+            return
+        self.requested = rows
+        kept = np.isin(self.rows, rows)
+        holes = np.flatnonzero(~kept)
+        added = rows[~np.isin(rows, self.rows)]
+        changed = max(len(holes), len(added))
+        if not changed:
+            return
+        if changed * FULL_UPDATE_RATIO > len(rows):
+            self.replace(rows)
+            return
+
+        slots = self.rows.copy()
+        # free slots beyond what the new rows fill are dropped from the front
+        drop = max(len(holes) - len(added), 0)
+        filled = holes[drop:]
+        slots[filled] = added[:len(filled)]
+        patched = [filled]
+        if drop:
+            # survivors in the front slots move into the dropped holes further back
+            front = np.arange(drop)
+            movers = front[~np.isin(front, holes[:drop])]
+            targets = holes[:drop][holes[:drop] >= drop]
+            slots[targets] = slots[movers]
+            patched.append(targets)
+        patched = np.concatenate(patched)
+
+        if len(patched):
+            values = self._columns(slots[patched])
+            self.source.patch(dict((name, _patch_list(patched, values[name])) for name in values))
+        if drop:
+            self.source.stream(self._columns(slots[:0]), rollover=len(slots) - drop)
+            slots = slots[drop:]
+        if len(added) > len(filled):
+            extra = added[len(filled):]
+            self.source.stream(self._columns(extra))
+            slots = np.concatenate([slots, extra])
+        self.rows = slots
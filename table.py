@@ -0,0 +1,160 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from dataset import extends, n_rows, stored_arrays
+
+# Server-side paging for the Summary Table tab.
+#
+# The session keeps the filtered and sorted row selection; the browser only
+# receives the displayed columns of the page it is looking at.
+
+PAGE_SIZE = 100
+
+_lock = threading.Lock()
+_complete = {}
+
+
+def complete_rows(population):
+    """Boolean mask of the rows without missing values, computed once per population.
+
+    A population with rows appended to the previous one only checks the new rows.
+    """
+    with _lock:
+        cached = _complete.get(id(population))
+        if cached is not None and cached[0] is population:
+            return cached[1]
+        start, known = 0, None
+        for old, mask in _complete.values():
+            first = extends(population, old)
+            if first is not None:
+                start, known = first, mask
+
+        def build():
+            mask = np.ones(n_rows(population) - start, dtype=bool)
+            for values in population.values():
+                mask &= ~pd.isnull(values[start:])
+            return {'complete': np.concatenate([known, mask]) if start else mask}
+
+        mask = stored_arrays(population, 'complete_rows', build)['complete']
+        _complete.clear()
+        _complete[id(population)] = (population, mask)
+        return mask
+
+
+def decimal_values(values):
+    """``values`` with float32 ones as the float64 of their shortest decimal text.
+
+    The browser prints a float32 as the float64 it widens to (144.7 as
+    144.6999969482422); the text is what the CSV held (see export.csv_text).
+    """
+    values = np.asarray(values)
+    if values.dtype == np.float32:
+        return values.astype(str).astype(np.float64)
+    return values
+
+
+def sort_order(keys, ascending=True):
+    """Stable argsort of ``keys``: equal keys keep their order in either direction."""
+    if ascending:
+        return np.argsort(keys, kind='mergesort')
+    # sorted from the end, equal keys come out last first; read backwards
+    # the keys descend and equal ones are back in order
+    return (len(keys) - 1 - np.argsort(keys[::-1], kind='mergesort'))[::-1]
+
+
+def sort_key(values):
+    if isinstance(values, pd.Categorical):
+        return values.codes
+    return values
+
+
+class TablePager(object):
+    """Filtered selection of one table, sorted on the server and served a page at a time."""
+
+    def __init__(self, population, columns, page_size=PAGE_SIZE):
+        self.population = population
+        self.columns = list(columns)
+        self.page_size = page_size
+        self.selected = np.zeros(0, dtype=np.int64)
+        self.rows = self.selected
+        self.sort_column = None
+        self.ascending = True
+        self.page = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def n_pages(self):
+        return max((len(self.rows) + self.page_size - 1) // self.page_size, 1)
+
+    def arrange(self, rows, sort_column=None, ascending=True):
+        """``(selected, ordered)`` rows for ``rows`` without changing the pager.
+
+        Safe to run off the session thread; ``show`` adopts the result.
+        """
+        selected = np.asarray(rows)
+        ordered = selected
+        if sort_column is not None:
+            ordered = selected[sort_order(sort_key(self.population[sort_column])[selected], ascending)]
+        return selected, ordered
+
+    def show(self, selected, ordered, sort_column=None, ascending=True):
+        self.selected = selected
+        self.rows = ordered
+        self.sort_column = sort_column
+        self.ascending = ascending
+        self.page = 0
+
+    def select(self, rows):
+        """Show ``rows`` (indices into the population)."""
+        selected, ordered = self.arrange(rows, self.sort_column, self.ascending)
+        self.show(selected, ordered, self.sort_column, self.ascending)
+
+    def append(self, population, rows):
+        """Add ``rows`` of ``population``, which extends the one shown (see dataset.extends).
+
+        The rows go where sorting the whole selection again would put them,
+        and the page stays put.
+        """
+        self.population = population
+        rows = np.asarray(rows)
+        self.selected = np.concatenate([self.selected, rows])
+        if self.sort_column is None:
+            self.rows = self.selected
+            return
+        # new rows come after the ones already shown of the same key, as
+        # they would from the stable sort
+        key = sort_key(population[self.sort_column])
+        rows = rows[sort_order(key[rows], self.ascending)]
+        if self.ascending:
+            self.rows = np.insert(self.rows, np.searchsorted(key[self.rows], key[rows], side='right'), rows)
+            return
+        # merged backwards, where the keys ascend: before the equal ones shown
+        ordered, rows = self.rows[::-1], rows[::-1]
+        self.rows = np.insert(ordered, np.searchsorted(key[ordered], key[rows], side='left'), rows)[::-1]
+
+    def sort(self, column, ascending=True):
+        selected, ordered = self.arrange(self.selected, column, ascending)
+        self.show(selected, ordered, column, ascending)
+
+    def turn(self, page):
+        self.page = min(max(page, 0), self.n_pages - 1)
+
+    def page_data(self):
+        """Displayed columns of the current page, categorical ones as their codes."""
+        rows = self.rows[self.page * self.page_size:(self.page + 1) * self.page_size]
+        data = {}
+        for name in self.columns:
+            values = self.population[name]
+            # categorical columns go out as codes, named by the column's formatter
+            data[name] = decimal_values((values.codes if isinstance(values, pd.Categorical) else values)[rows])
+        return data
+
+    def describe(self):
+        if not len(self.rows):
+            return 'No matching rows'
+        first = self.page * self.page_size
+        return 'Rows %d to %d of %d' % (first + 1, min(first + self.page_size, len(self.rows)), len(self.rows))
@@ -0,0 +1,50 @@
+import threading
+
+from bokeh.models import Panel
+from bokeh.models.widgets import Div, Tabs
+from bokeh.themes import Theme
+
+# What every new session starts from.
+#
+# main.py runs once per session. The pieces that are the same for all of them
+# are made once per process here: the parsed theme, and (through the pinned
+# entries of the shared result cache, see cache.py) the datasets of the
+# default widget state. Only the first tab is built with the document; the
+# others are built the first time they are selected, so a burst of page loads
+# pays for the Histogram tab alone.
+
+_themes = {}
+_lock = threading.Lock()
+
+
+def theme(path):
+    """The Theme of ``path``, parsed once per process and shared by every document."""
+    with _lock:
+        if path not in _themes:
+            _themes[path] = Theme(filename=path)
+        return _themes[path]
+
+
+class LazyTabs(object):
+    """Tabs whose panels past the first are built the first time they are selected.
+
+    ``builders`` is a list of ``(title, build)``, ``build()`` returning the
+    Panel of that title. Until then a panel only holds a placeholder.
+    """
+
+    def __init__(self, builders):
+        self.builders = {}
+        panels = []
+        for i, (title, build) in enumerate(builders):
+            if i == 0:
+                panels.append(build())
+            else:
+                panels.append(Panel(child=Div(text='Loading...'), title=title))
+                self.builders[i] = build
+        self.tabs = Tabs(tabs=panels)
+        self.tabs.on_change('active', self.show)
+
+    def show(self, attr, old, new):
+        build = self.builders.pop(new, None)
+        if build is not None:
+            self.tabs.tabs[new].child = build().child